@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+'''Cost of running 10 callbacks per event on a PV updating at 100 Hz
+
+Two measurements:
+
+dispatch
+    `PV.run_callbacks` called directly in a loop, with 10 (trivial)
+    callbacks, for keyword callbacks (the default) and for event callbacks
+    (``add_callback(..., as_event=True)``), next to the former dispatch
+    (re-sorting the indices and copying all of the PV's data for every
+    callback) emulated here for comparison.
+
+live
+    10 callbacks on a PV the server updates at 100 Hz, for a few seconds:
+    the events received per second, and the process CPU time used per
+    event and as a fraction of the elapsed time.
+
+The PV defaults to the 100 Hz one served by the bundled server
+(pvasync.server) when started by run.py.
+
+Usage::
+
+    python bench_callbacks.py [PV [seconds]]
+'''
+import asyncio
+import copy
+import json
+import sys
+import time
+
+
+PVNAME = 'Py:fast100'
+NCALLBACKS = 10
+
+
+def _legacy_run_callbacks(pv):
+    '''run_callbacks as it was: sort, then copy the PV's data per callback'''
+    for index in sorted(list(pv.callbacks.keys())):
+        fcn, kwargs = pv.callbacks[index]
+        kwd = copy.copy(pv._args)
+        kwd.update(kwargs)
+        kwd['cb_info'] = (index, pv)
+        fcn(**kwd)
+
+
+def _add_callbacks(pv, as_event):
+    calls = []
+    if as_event:
+        def callback(event):
+            calls.append(None)
+    else:
+        def callback(**kwargs):
+            calls.append(None)
+
+    pv.clear_callbacks()
+    for i in range(NCALLBACKS):
+        pv.add_callback(callback, with_ctrlvars=False, as_event=as_event)
+    return calls
+
+
+def dispatch(pv, events=20000):
+    run_methods = [('legacy', False, _legacy_run_callbacks),
+                   ('kwargs', False, type(pv).run_callbacks),
+                   ('event', True, type(pv).run_callbacks),
+                   ]
+    results = {}
+    for name, as_event, run_callbacks in run_methods:
+        calls = _add_callbacks(pv, as_event)
+        t0 = time.perf_counter()
+        for i in range(events):
+            run_callbacks(pv)
+        elapsed = time.perf_counter() - t0
+        assert len(calls) == events * NCALLBACKS
+
+        results[name] = dict(events_per_second=events / elapsed,
+                             seconds_per_event=elapsed / events,
+                             )
+    pv.clear_callbacks()
+    return results
+
+
+def live(pv, seconds):
+    loop = asyncio.get_event_loop()
+    results = {}
+    for name, as_event in (('kwargs', False), ('event', True)):
+        calls = _add_callbacks(pv, as_event)
+        loop.run_until_complete(asyncio.sleep(0.5))
+        del calls[:]
+
+        cpu0, t0 = time.process_time(), time.perf_counter()
+        loop.run_until_complete(asyncio.sleep(seconds))
+        cpu, elapsed = (time.process_time() - cpu0,
+                        time.perf_counter() - t0)
+
+        events = len(calls) // NCALLBACKS
+        results[name] = dict(events_per_second=events / elapsed,
+                             cpu_fraction=cpu / elapsed,
+                             cpu_seconds_per_event=cpu / max(events, 1),
+                             )
+    pv.clear_callbacks()
+    return results
+
+
+def run(pvname=PVNAME, seconds=5.0):
+    from pvasync import PV
+
+    loop = asyncio.get_event_loop()
+    pv = PV(pvname, form='time', auto_monitor=True)
+    loop.run_until_complete(pv.wait_for_connection(timeout=5.0))
+    # let the initial monitor event arrive
+    loop.run_until_complete(asyncio.sleep(0.5))
+
+    return dict(callbacks=NCALLBACKS,
+                dispatch=dispatch(pv),
+                live=live(pv, float(seconds)),
+                )
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(*sys.argv[1:3])))
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+'''Time to create and connect many channels
+
+Connects the first N names of tests/fastconn_pvlist.txt with
+`connect_many`, measuring the time until all of them are connected, and
+until 50%, 90% and 99% of them are. Run once per N, in a fresh process,
+since channels are cached by the context. The bundled server
+(pvasync.server) serves the list when started by `run.py`.
+
+Usage::
+
+    python bench_connect.py [N ...]
+'''
+import asyncio
+import json
+import os
+import sys
+import time
+
+
+COUNTS = (1000, 10000, 20000)
+PVLIST = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      os.pardir, 'tests', 'fastconn_pvlist.txt')
+
+
+def read_pvlist(fn=PVLIST):
+    with open(fn, 'rt') as f:
+        names = [line.strip() for line in f]
+    return [name for name in names if name and not name.startswith('#')]
+
+
+def run(count, timeout=60.0):
+    from pvasync import coroutines
+
+    pvnames = read_pvlist()[:count]
+    loop = asyncio.get_event_loop()
+    connect_times = []
+
+    def connection_update(pvname=None, connected=None):
+        if connected:
+            connect_times.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    result = loop.run_until_complete(
+        coroutines.connect_many(pvnames, timeout=timeout,
+                                callback=connection_update))
+    elapsed = time.perf_counter() - t0
+
+    connected = sum(result.values())
+    # time until the given fraction of all of the channels had connected
+    until = {}
+    for pct in (50, 90, 99):
+        nth = len(pvnames) * pct // 100
+        if 0 < nth <= len(connect_times):
+            until['p{}'.format(pct)] = connect_times[nth - 1]
+
+    return dict(channels=len(pvnames),
+                connected=connected,
+                seconds=elapsed,
+                seconds_until=until,
+                channels_per_second=connected / elapsed,
+                )
+
+
+if __name__ == '__main__':
+    counts = [int(count) for count in sys.argv[1:]] or COUNTS
+    if len(counts) > 1:
+        print('Each count should be run in its own process',
+              file=sys.stderr)
+    print(json.dumps({count: run(count) for count in counts}))
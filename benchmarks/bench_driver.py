@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+'''Compare the thread and selector libca drivers and the asyncio backend
+
+Each driver is run in its own subprocess, since the driver is chosen when
+the CA context is created on import (see config.PREEMPTIVE_CALLBACK and
+config.CA_BACKEND). For each, this measures:
+
+* idle CPU use, with channels connected but no traffic expected
+* monitor latency: receive time minus the EPICS timestamp of each update
+  (meaningful when the server shares this host's clock)
+* monitor throughput: events per second over the given PVs
+
+Usage::
+
+    python bench_driver.py PV [PV ...]
+'''
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from stats import percentiles
+
+
+# environment selecting each driver
+DRIVERS = {'thread': dict(PVASYNC_PREEMPTIVE_CALLBACK='1'),
+           'selector': dict(PVASYNC_PREEMPTIVE_CALLBACK='0'),
+           'asyncio': dict(PVASYNC_BACKEND='asyncio'),
+           }
+
+
+def measure(pvnames, idle_time=5.0, monitor_time=5.0):
+    '''Run the measurements with the driver of this process'''
+    from pvasync import PV
+    from pvasync.context import get_current_context
+
+    loop = asyncio.get_event_loop()
+    latencies = []
+
+    def on_update(timestamp=None, **kwargs):
+        latencies.append(time.time() - timestamp)
+
+    @asyncio.coroutine
+    def connect():
+        pvs = [PV(pvname, form='time', auto_monitor=True)
+               for pvname in pvnames]
+        for pv in pvs:
+            yield from pv.wait_for_connection(timeout=5.0)
+        return pvs
+
+    pvs = loop.run_until_complete(connect())
+
+    cpu0 = time.process_time()
+    loop.run_until_complete(asyncio.sleep(idle_time))
+    idle_cpu = (time.process_time() - cpu0) / idle_time
+
+    for pv in pvs:
+        pv.add_callback(on_update, with_ctrlvars=False)
+
+    cpu0 = time.process_time()
+    loop.run_until_complete(asyncio.sleep(monitor_time))
+    monitor_cpu = (time.process_time() - cpu0) / monitor_time
+
+    return dict(driver=get_current_context().driver,
+                idle_cpu_fraction=idle_cpu,
+                monitor_cpu_fraction=monitor_cpu,
+                events_per_second=len(latencies) / monitor_time,
+                latency=percentiles(latencies),
+                )
+
+
+def run(pvnames, idle_time=5.0, monitor_time=5.0):
+    results = {}
+    for driver, driver_env in DRIVERS.items():
+        env = dict(os.environ, **driver_env)
+        args = [sys.executable, __file__, '--measure',
+                str(idle_time), str(monitor_time)] + list(pvnames)
+        output = subprocess.check_output(args, env=env)
+        results[driver] = json.loads(output.decode('utf-8'))
+    return results
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--measure']:
+        idle_time, monitor_time = map(float, sys.argv[2:4])
+        result = measure(sys.argv[4:], idle_time=idle_time,
+                         monitor_time=monitor_time)
+        print(json.dumps(result))
+    else:
+        print(json.dumps(run(sys.argv[1:]), indent=2))
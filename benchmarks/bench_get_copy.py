@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+'''Cost of copying get replies out of libca-owned memory
+
+Compares the previous get path (deepcopy of the casted ctypes arguments,
+then a copy into numpy) with `cast.copy_args`, which copies the values
+once into a pooled buffer. Callback arguments are simulated, so no IOC is
+needed. Bytes copied are measured as the peak bytes allocated for a get
+from an empty pool, since every copy then lands in a new allocation.
+'''
+import copy
+import ctypes
+import json
+import time
+import tracemalloc
+
+from pvasync import (cast, dbr)
+from pvasync.buffers import BufferPool
+
+
+SIZES = (1000, 100000, 4000000)
+
+
+def _make_args(count, ftype=dbr.ChannelType.DOUBLE):
+    ctype = dbr._ftype_to_ctype[ftype]
+    raw = (count * ctype)()
+    args = dbr.EventHandlerArgs()
+    args.type = ftype
+    args.count = count
+    args.raw_dbr = ctypes.addressof(raw)
+    # the raw buffer must outlive the arguments
+    return raw, args
+
+
+def _deepcopy_get(args, pool):
+    header, values = copy.deepcopy(cast.cast_args(args))
+    unpacked = cast.unpack(None, values, count=args.count, ftype=args.type)
+    if isinstance(unpacked, ctypes.Array):
+        unpacked = cast.to_numpy_array(unpacked, count=len(unpacked),
+                                       ntype=dbr.native_type(args.type))
+    return unpacked
+
+
+def _pooled_get(args, pool):
+    header, values = cast.copy_args(args, pool)
+    return cast.unpack_values(values, 0, dbr.native_type(args.type),
+                              pool=pool)
+
+
+def _measure(func, args, pool, repeat):
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        value = func(args, pool)
+        times.append(time.perf_counter() - t0)
+        # the caller is done with the array: hand it back, as a consumer
+        # that converts or discards values would
+        pool.release(value)
+
+    # with an empty pool, so that every copy needs a fresh allocation
+    tracemalloc.start()
+    try:
+        value = func(args, BufferPool())
+        _, allocated = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    times.sort()
+    return dict(median_latency=times[len(times) // 2],
+                min_latency=times[0],
+                bytes_copied=allocated,
+                )
+
+
+def run(sizes=SIZES, repeat=20):
+    results = {}
+    for count in sizes:
+        raw, args = _make_args(count)
+        nbytes = ctypes.sizeof(raw)
+        results[count] = dict(
+            payload_bytes=nbytes,
+            deepcopy=_measure(_deepcopy_get, args, BufferPool(), repeat),
+            pooled=_measure(_pooled_get, args, BufferPool(), repeat),
+        )
+    return results
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2))
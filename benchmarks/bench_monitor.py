@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+'''Monitor events per second through `PV._monitor_update`
+
+Feeds updates directly to `PV._monitor_update`, which runs the PV's
+callbacks via `run_callbacks`, as the subscription callback does for each
+monitor event. This isolates the Python-side cost of delivering an event
+from the network and the server. Measured for scalar and array values, with
+0, 1, 4 and 16 (trivial) callbacks.
+
+The PV is connected first so that its state is that of a monitored PV; it
+defaults to one served by the bundled server (pvasync.server).
+
+Usage::
+
+    python bench_monitor.py [PV]
+'''
+import asyncio
+import json
+import sys
+import time
+
+import numpy as np
+
+
+PVNAME = 'Py:ao4'
+CALLBACK_COUNTS = (0, 1, 4, 16)
+VALUES = {'scalar': 1.0,
+          'array2k': np.arange(2048, dtype=np.float64),
+          }
+
+
+def run(pvname=PVNAME, events=20000, callback_counts=CALLBACK_COUNTS):
+    from pvasync import PV
+
+    loop = asyncio.get_event_loop()
+    pv = PV(pvname, form='time', auto_monitor=True)
+    loop.run_until_complete(pv.wait_for_connection(timeout=5.0))
+    # let the initial monitor event arrive
+    loop.run_until_complete(asyncio.sleep(0.5))
+
+    calls = []
+
+    def callback(**kwargs):
+        calls.append(None)
+
+    results = {}
+    for name, value in VALUES.items():
+        results[name] = {}
+        for ncallbacks in callback_counts:
+            pv.clear_callbacks()
+            for i in range(ncallbacks):
+                pv.add_callback(callback, with_ctrlvars=False)
+
+            kwargs = dict(status=0, severity=0, timestamp=time.time())
+            del calls[:]
+            t0 = time.perf_counter()
+            for i in range(events):
+                pv._monitor_update(value=value, **kwargs)
+            elapsed = time.perf_counter() - t0
+            assert len(calls) == events * ncallbacks
+
+            results[name][ncallbacks] = dict(
+                events_per_second=events / elapsed,
+                callbacks_per_second=events * ncallbacks / elapsed,
+                seconds_per_event=elapsed / events,
+            )
+
+    pv.clear_callbacks()
+    return results
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(*sys.argv[1:2])))
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+'''Scaling of waveform post-processing over the workers of a CAPool
+
+Reads WAVEFORMS waveforms of 64k doubles with `CAPool.map_pvs`, computing
+the peak of each one's power spectrum in the workers, with 1, 2 and 4 of
+them. Each pool is warmed up by a first call, so that the timed calls reuse
+the workers' channels. Also reports the time to bring the waveforms back
+themselves (`snapshot`, through shared memory).
+'''
+import json
+import time
+
+import numpy as np
+
+from pvasync import CAPool
+
+
+WAVEFORMS = 32
+PVNAMES = ['Py:bench:wave{}'.format(i) for i in range(WAVEFORMS)]
+COUNT = 65536
+
+
+def spectrum_peak(pvname, value):
+    spectrum = np.abs(np.fft.rfft(value)) ** 2
+    for i in range(4):
+        # (heavier processing)
+        spectrum = np.abs(np.fft.rfft(np.fft.irfft(spectrum))) ** 2
+    return int(np.argmax(spectrum))
+
+
+def _timed(func, repeat):
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def run(processes=(1, 2, 4), repeat=5):
+    results = {}
+    for count in processes:
+        with CAPool(count) as pool:
+            pool.map_pvs(spectrum_peak, PVNAMES, timeout=5.0)
+            map_time = _timed(
+                lambda: pool.map_pvs(spectrum_peak, PVNAMES, timeout=5.0),
+                repeat)
+            snapshot_time = _timed(
+                lambda: pool.snapshot(PVNAMES, timeout=5.0), repeat)
+
+        nbytes = WAVEFORMS * COUNT * 8
+        results[count] = dict(map_seconds=map_time,
+                              waveforms_per_second=WAVEFORMS / map_time,
+                              snapshot_seconds=snapshot_time,
+                              snapshot_bytes_per_second=nbytes / snapshot_time,
+                              )
+    return results
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+'''Recording many PVs updating at 10 Hz, and what it costs the event loop
+
+Records PVS PVs (the bundled server updates each 10 times a second, when
+started by run.py) for a few seconds with a `recorder.Recorder`, while
+measuring the lag of a 50 ms timer on the event loop. Reports the updates
+received and written per second, the writer thread's longest flush, the
+event loop's lag (mean and maximum) with and without the recorder, the
+time to read back all of the records of one PV, and the rate at which the
+recording is replayed into PV callbacks (as fast as possible).
+
+Usage::
+
+    python bench_recorder.py [seconds]
+'''
+import asyncio
+import json
+import shutil
+import sys
+import tempfile
+import time
+
+
+PVS = 1000
+RATE = 10.0
+PVNAMES = ['Py:bench:rec{}'.format(i) for i in range(PVS)]
+
+
+def _loop_lag(loop, seconds):
+    from pvasync.exporter import LoopLag
+
+    lags = []
+    lag = LoopLag(loop, interval=0.05)
+    tick = lag._tick
+
+    def record_tick(expected):
+        tick(expected)
+        lags.append(lag.lag)
+
+    lag._tick = record_tick
+    lag.start()
+    loop.run_until_complete(asyncio.sleep(seconds))
+    lag.stop()
+    return dict(mean_loop_lag=sum(lags) / max(len(lags), 1),
+                max_loop_lag=max(lags, default=0.0))
+
+
+def _replay(loop, directory):
+    from pvasync.context import get_contexts
+    from pvasync.pv import PV
+
+    delivered = [0]
+
+    def callback(**kwargs):
+        delivered[0] += 1
+
+    ctx = get_contexts().start_replay(directory)
+    try:
+        pvs = [PV(pvname) for pvname in PVNAMES]
+        for pv in pvs:
+            loop.run_until_complete(pv.wait_for_connection(timeout=5.0))
+        loop.run_until_complete(asyncio.sleep(0.1))
+        for pv in pvs:
+            pv.add_callback(callback)
+
+        stats = loop.run_until_complete(ctx.replay())
+    finally:
+        get_contexts().stop_replay()
+    return dict(updates=stats['updates'], delivered=delivered[0],
+                seconds=stats['seconds'],
+                updates_per_second=stats['updates_per_second'])
+
+
+def run(seconds=5.0):
+    from pvasync import coroutines
+    from pvasync.recorder import (Recorder, Recording)
+
+    seconds = float(seconds)
+    loop = asyncio.get_event_loop()
+    connected = loop.run_until_complete(
+        coroutines.connect_many(PVNAMES, timeout=10.0))
+    results = dict(pvs=PVS, connected=sum(connected.values()),
+                   idle=_loop_lag(loop, seconds))
+
+    directory = tempfile.mkdtemp()
+    try:
+        with Recorder(PVNAMES, directory) as recorder:
+            # subscribed, and past the initial updates
+            loop.run_until_complete(asyncio.sleep(1.0))
+            received, written = recorder.received, recorder.written
+            t0 = time.perf_counter()
+            recording = _loop_lag(loop, seconds)
+            elapsed = time.perf_counter() - t0
+            recording.update(
+                received_per_second=(recorder.received - received) / elapsed,
+                written_per_second=(recorder.written - written) / elapsed,
+                max_write_time=recorder.max_write_time,
+                )
+        recording['lost'] = recorder.lost
+        results['recording'] = recording
+
+        t0 = time.perf_counter()
+        records = len(Recording(directory).read(PVNAMES[0])['value'])
+        results['read'] = dict(records=records,
+                               seconds=time.perf_counter() - t0)
+        results['replay'] = _replay(loop, directory)
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(*sys.argv[1:2])))
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+'''Latency of single get and put requests
+
+Measures, per PV:
+
+* `coroutines.get` and `coroutines.put` (with completion) on a connected
+  channel, run on the event loop
+* `caget` and `caput` through `sync.blocking_wrapper`, with the event loop
+  in a background thread (`sync.blocking_mode`), as a script would use them
+
+The PVs default to those of the bundled server (pvasync.server), which
+`run.py` starts.
+
+Usage::
+
+    python bench_requests.py [PV ...]
+'''
+import asyncio
+import json
+import sys
+
+from stats import (summarize, time_calls)
+
+
+PVNAMES = ('Py:ao4', 'Py:long2k', 'Py:double64k')
+
+
+def _put_value(value):
+    # a different value each time, so the server posts an update
+    if hasattr(value, '__len__'):
+        return value[::-1]
+    return value + 1
+
+
+def run(pvnames=PVNAMES, repeat=500):
+    from pvasync import (coroutines, sync, PV)
+
+    loop = asyncio.get_event_loop()
+
+    @asyncio.coroutine
+    def connect():
+        pvs = [PV(pvname, auto_monitor=False) for pvname in pvnames]
+        for pv in pvs:
+            yield from pv.wait_for_connection(timeout=5.0)
+        return pvs
+
+    @asyncio.coroutine
+    def time_requests(chid, times, put_times):
+        for i in range(repeat):
+            t0 = loop.time()
+            value = yield from coroutines.get(chid)
+            t1 = loop.time()
+            yield from coroutines.put(chid, _put_value(value))
+            times.append(t1 - t0)
+            put_times.append(loop.time() - t1)
+
+    pvs = loop.run_until_complete(connect())
+    results = {}
+    for pv in pvs:
+        get_times, put_times = [], []
+        loop.run_until_complete(time_requests(pv.chid, get_times, put_times))
+        results[pv.pvname] = dict(count=pv.count,
+                                  get=summarize(get_times),
+                                  put=summarize(put_times))
+
+    # the blocking interface needs the event loop running in a thread, so
+    # it is measured last
+    sync.blocking_mode(loop)
+    for pvname in pvnames:
+        value = sync.caget(pvname)
+        results[pvname]['caget'] = summarize(
+            time_calls(sync.caget, repeat, pvname))
+        results[pvname]['caput'] = summarize(
+            time_calls(sync.caput, repeat, pvname, _put_value(value)))
+    return results
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(sys.argv[1:] or PVNAMES)))
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+'''Cost of `cast.unpack` by native type and element count
+
+`cast.unpack` converts the ctypes array of a libca reply or event to its
+Python value. For comparison, `cast.unpack_values` does the same from a
+numpy array (as used by the pooled get path). No server is needed.
+'''
+import ctypes
+import json
+
+import numpy as np
+
+from pvasync import (cast, dbr)
+from pvasync.dbr import ChannelType
+
+from stats import (summarize, time_calls)
+
+
+SIZES = (1, 1000, 100000)
+NATIVE_TYPES = (ChannelType.STRING, ChannelType.SHORT, ChannelType.FLOAT,
+                ChannelType.ENUM, ChannelType.CHAR, ChannelType.LONG,
+                ChannelType.DOUBLE)
+
+
+def run(sizes=SIZES, repeat=200):
+    results = {}
+    for ntype in NATIVE_TYPES:
+        ctype = dbr._ftype_to_ctype[ntype]
+        type_results = results[ntype.name.lower()] = {}
+        for count in sizes:
+            data = (count * ctype)()
+            values = np.zeros(count, dtype=cast.native_dtype(ntype))
+            # strings are converted element by element: keep them short
+            n = repeat if ntype != ChannelType.STRING or count < 1000 else 5
+
+            unpack = summarize(time_calls(cast.unpack, n, None, data,
+                                          count=count, ftype=ntype))
+            unpack_values = summarize(time_calls(cast.unpack_values, n,
+                                                 values, count, ntype))
+            type_results[count] = dict(
+                unpack=unpack,
+                unpack_ns_per_element=unpack['p50'] * 1e9 / count,
+                unpack_values=unpack_values,
+            )
+    return results
+
+
+if __name__ == '__main__':
+    print(json.dumps(run()))
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+'''Run the benchmark suite, writing the results as JSON
+
+Each benchmark runs in its own process (the CA context, its driver and its
+channels are per-process), against the bundled server (pvasync.server)
+started here on a free loopback port, so that results are comparable
+between releases and machines. With --no-server, the EPICS_CA_* settings
+of the environment are used instead, and the server's PVs must be served
+by some IOC.
+
+The client backend follows PVASYNC_BACKEND, as usual.
+
+Usage::
+
+    python run.py [--suite NAME ...] [--output results.json]
+'''
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+from collections import OrderedDict
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# suite name to (script, list of argument lists: one process each)
+SUITES = OrderedDict([
+    ('requests', ('bench_requests.py', [[]])),
+    ('monitor', ('bench_monitor.py', [[]])),
+    ('callbacks', ('bench_callbacks.py', [[]])),
+    ('connect', ('bench_connect.py', [['1000'], ['10000'], ['20000']])),
+    ('unpack', ('bench_unpack.py', [[]])),
+    ('get_copy', ('bench_get_copy.py', [[]])),
+    ('multiproc', ('bench_multiproc.py', [[]])),
+    ('recorder', ('bench_recorder.py', [[]])),
+])
+
+
+def run_suite(name, env):
+    script, arg_lists = SUITES[name]
+    results = {}
+    for args in arg_lists:
+        output = subprocess.check_output(
+            [sys.executable, os.path.join(HERE, script)] + args, env=env,
+            cwd=HERE)
+        results.update(json.loads(output.decode('utf-8')))
+    return results
+
+
+def start_server(latency=0.0):
+    '''Start the bundled server in a thread, serving the test PVs and the
+    connection benchmark's list, a PV updating at 100 Hz for the callback
+    benchmark, the waveforms of the multiprocessing benchmark and the PVs
+    updating at 10 Hz of the recorder benchmark'''
+    import numpy as np
+    from pvasync.server import (CAServer, ServedPV, default_pvs,
+                                pvs_from_file)
+    from bench_connect import PVLIST
+    from bench_callbacks import PVNAME as FAST_PVNAME
+    from bench_multiproc import (PVNAMES as WAVEFORM_PVNAMES,
+                                 COUNT as WAVEFORM_COUNT)
+    from bench_recorder import (PVNAMES as RECORDED_PVNAMES,
+                                RATE as RECORDED_RATE)
+
+    pvs = default_pvs() + pvs_from_file(PVLIST)
+    pvs.append(ServedPV(FAST_PVNAME, 0.0, update_rate=100.0))
+    for idx, pvname in enumerate(WAVEFORM_PVNAMES):
+        waveform = np.sin(np.arange(WAVEFORM_COUNT) * (idx + 1) * 1e-3)
+        pvs.append(ServedPV(pvname, waveform.tolist()))
+    for pvname in RECORDED_PVNAMES:
+        pvs.append(ServedPV(pvname, 0.0, update_rate=RECORDED_RATE))
+    server = CAServer(pvs, latency=latency)
+    server.start_in_thread()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--suite', action='append', choices=list(SUITES),
+                        help='suites to run (default: all)')
+    parser.add_argument('--output', help='file to write (default: stdout)')
+    parser.add_argument('--no-server', action='store_true',
+                        help='use the IOCs found through the environment')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="server's artificial reply delay (s)")
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    server = None
+    if not args.no_server:
+        server = start_server(latency=args.latency)
+        env.update(server.env)
+
+    import pvasync
+    from pvasync import config
+
+    report = OrderedDict()
+    report['info'] = dict(version=pvasync.__version__,
+                          backend=config.CA_BACKEND,
+                          python=platform.python_version(),
+                          platform=platform.platform(),
+                          date=datetime.datetime.now().isoformat(),
+                          server=('bundled' if server is not None
+                                  else 'environment'),
+                          )
+    try:
+        for name in (args.suite or SUITES):
+            print('Running {}...'.format(name), file=sys.stderr)
+            report[name] = run_suite(name, env)
+    finally:
+        if server is not None:
+            server.stop()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'wt') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
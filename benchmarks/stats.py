@@ -0,0 +1,32 @@
+'''Summary statistics shared by the benchmarks'''
+import time
+
+
+def percentiles(values, pcts=(50, 90, 99)):
+    '''Nearest-rank percentiles of a list of measurements'''
+    if not values:
+        return {}
+    values = sorted(values)
+    return {'p{}'.format(pct): values[min(len(values) - 1,
+                                          len(values) * pct // 100)]
+            for pct in pcts}
+
+
+def summarize(times):
+    '''Percentiles, minimum and mean of a list of durations (seconds)'''
+    if not times:
+        return {}
+    summary = percentiles(times)
+    summary.update(min=min(times), mean=sum(times) / len(times),
+                   count=len(times))
+    return summary
+
+
+def time_calls(func, repeat, *args, **kwargs):
+    '''Time `repeat` calls of func(*args, **kwargs), returning each duration'''
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func(*args, **kwargs)
+        times.append(time.perf_counter() - t0)
+    return times
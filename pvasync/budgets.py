@@ -0,0 +1,172 @@
+'''Time and error budgets of subscription callbacks
+
+Callbacks run one after another on the event loop, with the context's
+subscription lock held: one slow callback delays the delivery of every
+channel's events, and one which raises on each event floods the log with
+tracebacks. Each callback registered with a context therefore has a
+`CallbackHealth`, counting its calls, errors and slow calls (those over
+config.CALLBACK_TIME_BUDGET).
+
+Warnings are rate-limited per callback: after one is logged, those for the
+same callback in the following config.CALLBACK_LOG_INTERVAL seconds are only
+counted, and the count is reported with the next one logged.
+
+A callback over budget - with config.CALLBACK_ERROR_LIMIT errors or
+config.CALLBACK_SLOW_LIMIT slow calls in a row - is quarantined according to
+config.CALLBACK_QUARANTINE:
+
+'warn'
+    it is only warned about (the default)
+'suspend'
+    it is no longer called, until resumed
+'thread'
+    it is called from a worker thread (one for the context, so that the
+    events of each callback stay in order), off the event loop, with a copy
+    of each event; callbacks marked `loop_only` are only warned about
+
+See `CAContextHandler.callback_health`, `suspend_callback`,
+`offload_callback` and `resume_callback`.
+'''
+import time
+import logging
+
+from . import config
+
+
+logger = logging.getLogger(__name__)
+
+QUARANTINE_POLICIES = ('warn', 'suspend', 'thread')
+# states of a callback
+ACTIVE = 'active'
+SUSPENDED = 'suspended'
+THREADED = 'threaded'
+
+
+def quarantine_policy():
+    '''config.CALLBACK_QUARANTINE, checked against QUARANTINE_POLICIES'''
+    policy = config.CALLBACK_QUARANTINE
+    if policy not in QUARANTINE_POLICIES:
+        raise ValueError('CALLBACK_QUARANTINE is {!r}, not one of {}'
+                         ''.format(policy, ', '.join(QUARANTINE_POLICIES)))
+    return policy
+
+
+def loop_only(func):
+    '''Mark a callback which has to run on the event loop
+
+    Such a callback (a PV's monitor callback, say) changes state read on the
+    event loop, so it is never moved to the worker thread.
+    '''
+    func.loop_only = True
+    return func
+
+
+def _describe(func):
+    '''A short name for a callback, for the log'''
+    name = getattr(func, '__qualname__', None)
+    if name is None:
+        return repr(func)
+    module = getattr(func, '__module__', None)
+    return '{}.{}'.format(module, name) if module else name
+
+
+class CallbackHealth:
+    '''The calls, errors and slow calls of one callback'''
+    def __init__(self, cbid, sig, pvname, func):
+        self.cbid = cbid
+        self.sig = sig
+        self.pvname = pvname
+        self.name = _describe(func)
+        self.loop_only = getattr(func, 'loop_only', False)
+        self.state = ACTIVE
+        self.reason = None
+        self.calls = 0
+        self.errors = 0
+        self.slow_calls = 0
+        self.skipped = 0
+        self.consecutive_errors = 0
+        self.consecutive_slow = 0
+        self.timed_calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_error = None
+        self._next_log = 0.0
+        self._suppressed = 0
+
+    def record(self, elapsed, ex=None):
+        '''Record a call which took `elapsed` seconds, raising `ex` if set
+
+        `elapsed` is None for a call which was not timed. Returns the reason
+        the callback is over budget, if it now is.
+        '''
+        self.calls += 1
+        if elapsed is not None:
+            self.timed_calls += 1
+            self.total_time += elapsed
+            if elapsed > self.max_time:
+                self.max_time = elapsed
+
+        if ex is not None:
+            self.errors += 1
+            self.consecutive_errors += 1
+            self.last_error = repr(ex)
+            self._log(logging.ERROR, 'Unhandled callback exception '
+                      '(%s on %s, cbid %d)', self.name, self.pvname,
+                      self.cbid, exc_info=ex)
+        else:
+            self.consecutive_errors = 0
+
+        budget = config.CALLBACK_TIME_BUDGET
+        if budget is not None and elapsed is not None and elapsed > budget:
+            self.slow_calls += 1
+            self.consecutive_slow += 1
+            self._log(logging.WARNING, 'Slow callback %s on %s (cbid %d): '
+                      '%.3f s, over its budget of %.3f s', self.name,
+                      self.pvname, self.cbid, elapsed, budget)
+        else:
+            self.consecutive_slow = 0
+
+        if self.consecutive_errors >= config.CALLBACK_ERROR_LIMIT:
+            return 'errors'
+        elif self.consecutive_slow >= config.CALLBACK_SLOW_LIMIT:
+            return 'slow'
+
+    def _log(self, level, msg, *args, exc_info=None):
+        now = time.monotonic()
+        if now < self._next_log:
+            self._suppressed += 1
+            return
+
+        if self._suppressed:
+            msg += ' (%d similar messages suppressed)'
+            args += (self._suppressed, )
+        self._suppressed = 0
+        self._next_log = now + config.CALLBACK_LOG_INTERVAL
+        logger.log(level, msg, *args, exc_info=exc_info)
+
+    def reset_counts(self):
+        '''Count errors and slow calls in a row afresh'''
+        self.consecutive_errors = 0
+        self.consecutive_slow = 0
+
+    def set_state(self, state, reason=None):
+        self.state = state
+        self.reason = reason
+        self.reset_counts()
+
+    def to_dict(self):
+        return dict(cbid=self.cbid,
+                    sig=self.sig,
+                    pvname=self.pvname,
+                    name=self.name,
+                    state=self.state,
+                    reason=self.reason,
+                    calls=self.calls,
+                    errors=self.errors,
+                    slow_calls=self.slow_calls,
+                    skipped=self.skipped,
+                    mean_time=(self.total_time / self.timed_calls
+                               if self.timed_calls else None),
+                    max_time=self.max_time,
+                    last_error=self.last_error,
+                    )
@@ -0,0 +1,168 @@
+"""
+Reusable and preallocated numpy buffers for data copied out of libca
+callbacks (or out of the receive buffers of the asyncio client)
+"""
+import collections
+import ctypes
+
+import numpy as np
+
+
+class BufferPool:
+    '''A pool of reusable byte buffers, bucketed by power-of-two size
+
+    Buffers are acquired on the libca callback thread and released on the
+    event loop thread. Each bucket is a deque, so neither side needs a lock.
+
+    Parameters
+    ----------
+    max_per_bucket : int, optional
+        maximum number of free buffers kept for each bucket size
+    min_size : int, optional
+        smallest bucket size, in bytes
+    '''
+    def __init__(self, max_per_bucket=4, min_size=64):
+        self.max_per_bucket = max_per_bucket
+        self.min_size = min_size
+        self._buckets = {}
+        # statistics
+        self.allocated = 0
+        self.reused = 0
+
+    def _bucket(self, size):
+        try:
+            return self._buckets[size]
+        except KeyError:
+            return self._buckets.setdefault(size, collections.deque())
+
+    def bucket_size(self, nbytes):
+        '''The bucket size used for a request of `nbytes`'''
+        return max(self.min_size, 1 << max(0, nbytes - 1).bit_length())
+
+    def acquire(self, dtype, count):
+        '''Get an uninitialized array of `count` elements of `dtype`
+
+        The array is a view on a (possibly reused) pooled buffer.
+        '''
+        dtype = np.dtype(dtype)
+        nbytes = dtype.itemsize * count
+        size = self.bucket_size(nbytes)
+        try:
+            buf = self._bucket(size).pop()
+        except IndexError:
+            buf = np.empty(size, dtype=np.uint8)
+            self.allocated += 1
+        else:
+            self.reused += 1
+
+        return buf[:nbytes].view(dtype)
+
+    def release(self, array):
+        '''Return an array from `acquire` to the pool
+
+        Neither the array nor any other view of its buffer may be used after
+        it has been released.
+        '''
+        buf = array.base
+        if buf is None or buf.dtype != np.uint8 or buf.ndim != 1:
+            return
+
+        bucket = self._bucket(buf.nbytes)
+        if len(bucket) < self.max_per_bucket:
+            bucket.append(buf)
+
+    def clear(self):
+        '''Drop all free buffers'''
+        self._buckets.clear()
+
+
+class MonitorBuffer:
+    '''A preallocated ring of arrays for the values of a waveform monitor
+
+    Each update is copied into the next slot of the ring, and consumers are
+    given a read-only view of that slot along with the update's sequence
+    number. A view stays valid until `nslots - 1` further updates have been
+    written: check with `valid(seq)`, and copy the data to keep it longer.
+
+    Parameters
+    ----------
+    dtype : numpy.dtype
+        native data type of the channel
+    count : int
+        element count of the channel
+    nslots : int, optional
+        number of arrays in the ring (default 2, double buffering)
+
+    Attributes
+    ----------
+    seq : int
+        sequence number of the most recently written update
+    overruns : int
+        number of updates overwritten before they were delivered, that is,
+        the number of times a consumer was too slow
+    '''
+    def __init__(self, dtype, count, nslots=2):
+        if nslots < 2:
+            raise ValueError('At least two slots are required')
+
+        self.dtype = np.dtype(dtype)
+        self.count = int(count)
+        self.nslots = int(nslots)
+        self._slots = [np.zeros(self.count, dtype=self.dtype)
+                       for i in range(self.nslots)]
+        self._views = []
+        for slot in self._slots:
+            view = slot.view()
+            view.flags.writeable = False
+            self._views.append(view)
+
+        self.seq = 0
+        self.delivered = 0
+        self.overruns = 0
+
+    def write(self, address, count):
+        '''Copy `count` elements from `address` into the next slot
+
+        This is called on the libca callback thread.
+
+        Returns
+        -------
+        seq : int
+            sequence number of the update
+        view : numpy.ndarray
+            read-only view of the slot holding the update
+        '''
+        count = min(count, self.count)
+        seq, idx = self._next_slot()
+        slot = self._slots[idx]
+        ctypes.memmove(slot.ctypes.data, address, count * self.dtype.itemsize)
+        self.seq = seq
+        return seq, self._views[idx][:count]
+
+    def write_array(self, values):
+        '''Copy an array of values into the next slot
+
+        As `write`, for values given as an array, which is converted to the
+        buffer's dtype (e.g. from network byte order) as it is copied.
+        '''
+        count = min(len(values), self.count)
+        seq, idx = self._next_slot()
+        self._slots[idx][:count] = values[:count]
+        self.seq = seq
+        return seq, self._views[idx][:count]
+
+    def _next_slot(self):
+        seq = self.seq + 1
+        if seq - self.nslots > self.delivered:
+            # the slot still holds an update which was never delivered
+            self.overruns += 1
+        return seq, seq % self.nslots
+
+    def valid(self, seq):
+        '''Whether the update `seq` has not yet been overwritten'''
+        return 0 < seq and (self.seq - seq) < self.nslots
+
+    def mark_delivered(self, seq):
+        '''Record that update `seq` was delivered to the consumers'''
+        if seq > self.delivered:
+            self.delivered = seq
@@ -170,6 +170,25 @@ def context_create(ctx=None):
     return libca.ca_context_create(ctx)
 
 
+@withCA
+def new_context(ctx=None):
+    """Create a new context, leaving the current one attached to this thread
+
+    Returns the new context, to be attached by the threads which use it.
+    """
+    initial = current_context()
+    if initial:
+        detach_context()
+    try:
+        context_create(ctx)
+        context = current_context()
+        detach_context()
+    finally:
+        if initial:
+            attach_context(initial)
+    return context
+
+
 @withCA
 def context_destroy():
     "destroy current context"
@@ -277,6 +296,34 @@ def pend_event(timeout=1.e-5):
         return ret
 
 
+@withCA
+def poll():
+    """process pending events without waiting (the ca_poll macro)"""
+    return pend_event(1.e-12)
+
+
+# void CAFDHANDLER(void *parg, int fd, int opened)
+fd_handler_t = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.c_int,
+                                ctypes.c_int)
+
+
+@withCA
+@withSEVCHK
+def add_fd_registration(handler, arg=None):
+    """register a function to be called whenever libca opens or closes a
+    file descriptor, so that it can be watched by an event loop.
+
+    Parameters
+    ----------
+    handler : fd_handler_t
+        called with (arg, fd, opened). A reference to it must be kept for as
+        long as it is registered.
+    arg : int, optional
+        user argument
+    """
+    return libca.ca_add_fd_registration(handler, arg)
+
+
 @withCA
 def test_io():
     """test if IO is complete: returns True if it is"""
@@ -358,5 +405,6 @@ class CAThread(Thread):
     """
 
     def run(self):
-        use_initial_context()
+        if config.CA_BACKEND == 'libca':
+            use_initial_context()
         super().run()
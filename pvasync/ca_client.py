@@ -0,0 +1,687 @@
+"""
+A pure-Python Channel Access client engine, on asyncio
+
+AsyncioContextHandler provides the interface of context.CAContextHandler
+without libca: names are searched for over UDP, channels are created on TCP
+virtual circuits to the servers, and all replies are parsed on the event loop
+as they are received. There are no helper threads, and no events cross
+threads.
+
+Select it by setting config.CA_BACKEND to 'asyncio' (or the environment
+variable PVASYNC_BACKEND) before pvasync is imported. The usual EPICS
+environment variables EPICS_CA_ADDR_LIST, EPICS_CA_AUTO_ADDR_LIST and
+EPICS_CA_SERVER_PORT configure the name search.
+"""
+import asyncio
+import getpass
+import itertools
+import logging
+import os
+import socket
+import struct
+import time
+
+from . import ca
+from . import ca_protocol as proto
+from . import cast
+from . import config
+from . import context
+from . import dbr
+from . import errors
+from .ca_protocol import Command
+from .callback_registry import ChannelCallbackBase
+from .context import (CAContextHandler, ConnectionCallback, MonitorCallback)
+
+
+logger = logging.getLogger(__name__)
+# channel ids are unique across contexts, so that those of a context pool can
+# be told apart
+_cids = itertools.count(1)
+
+_access_names = ('no access', 'read-only', 'write-only', 'read/write')
+
+
+def search_addresses():
+    '''The (host, port) addresses name searches are sent to'''
+    port = int(os.environ.get('EPICS_CA_SERVER_PORT', proto.CA_SERVER_PORT))
+    addresses = []
+    for item in os.environ.get('EPICS_CA_ADDR_LIST', '').split():
+        host, _, item_port = item.partition(':')
+        addresses.append((socket.gethostbyname(host),
+                          int(item_port) if item_port else port))
+
+    auto = os.environ.get('EPICS_CA_AUTO_ADDR_LIST', 'YES')
+    if auto.upper() != 'NO':
+        addresses.append(('255.255.255.255', port))
+    return addresses
+
+
+def _user_name():
+    try:
+        return getpass.getuser()
+    except Exception:
+        return 'pvasync'
+
+
+class Channel:
+    '''State of a channel of the asyncio client'''
+    def __init__(self, name, cid):
+        self.name = name
+        self.cid = cid
+        # server id, native type and element count, from CREATE_CHAN
+        self.sid = None
+        self.native_type = -1
+        self.count = 0
+        self.access_rights = 0
+        self.circuit = None
+        self.connected = False
+        self.search_period = config.SEARCH_PERIOD
+        self.next_search = 0.0
+
+    def __repr__(self):
+        return ('{0.__class__.__name__}({0.name!r}, cid={0.cid}, '
+                'connected={0.connected})'.format(self))
+
+
+class VirtualCircuit(asyncio.Protocol):
+    '''A TCP connection to one server, shared by all of its channels
+
+    Messages are queued with `send`, and written together once per event
+    loop iteration (or on `flush`).
+    '''
+    def __init__(self, handler, address):
+        self.handler = handler
+        self.address = address
+        self.transport = None
+        self.channels = {}
+        self._buffer = bytearray()
+        self._outgoing = []
+        self._flush_scheduled = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        sock = transport.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        self._outgoing[:0] = [proto.version(),
+                              proto.host_name(socket.gethostname()),
+                              proto.client_name(_user_name())]
+        self.flush()
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self.handler._circuit_lost(self, exc)
+
+    def data_received(self, data):
+        buf = self._buffer
+        buf += data
+
+        offset = 0
+        events = []
+        latest = {}
+        handle = self.handler._handle_message
+        while True:
+            message, offset = proto.unpack(buf, offset)
+            if message is None:
+                break
+            try:
+                handle(self, message, events, latest)
+            except Exception as ex:
+                logger.error('Failed to handle %s from %s:%d', message[:5],
+                             self.address[0], self.address[1], exc_info=ex)
+
+        message = None
+        try:
+            del buf[:offset]
+        except BufferError:
+            # a view of the buffer is still referenced somewhere
+            self._buffer = buf[offset:]
+
+        if events:
+            self.handler._process_batch(events)
+
+    def send(self, message):
+        '''Queue a message, to be written on the next loop iteration'''
+        self._outgoing.append(message)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.handler._loop.call_soon_threadsafe(self.flush)
+
+    def flush(self):
+        '''Write all queued messages now'''
+        self._flush_scheduled = False
+        if self.transport is None or not self._outgoing:
+            return
+
+        outgoing, self._outgoing = self._outgoing, []
+        self.transport.write(b''.join(outgoing))
+
+    def close(self):
+        if self.transport is not None:
+            self.flush()
+            self.transport.close()
+
+
+class SearchProtocol(asyncio.DatagramProtocol):
+    '''The UDP socket name searches are sent from'''
+    def __init__(self, handler):
+        self.handler = handler
+
+    def datagram_received(self, data, address):
+        try:
+            self.handler._search_reply(data, address)
+        except Exception as ex:
+            logger.error('Failed to handle search reply from %s', address,
+                         exc_info=ex)
+
+    def error_received(self, exc):
+        logger.debug('Search socket error', exc_info=exc)
+
+
+class AsyncioMonitorCallback(MonitorCallback):
+    '''Callback type 'monitor', subscribed with EVENT_ADD
+
+    The handler id doubles as the subscription id on the wire, and the
+    subscription is (re)sent whenever the channel connects.
+    '''
+    def create(self):
+        logger.debug('Creating a subscription on %s (ftype=%s mask=%s)',
+                     self.pvname, dbr.ChType(self.ftype).name, self.mask)
+        self._create_buffer()
+        self.evid = self.handler_id
+        self.context._add_subscription(self)
+
+    def destroy(self):
+        ChannelCallbackBase.destroy(self)
+        if self.evid is not None:
+            self.context._cancel_subscription(self)
+            self.evid = None
+
+
+class AsyncioContextHandler(CAContextHandler):
+    '''A context handler speaking Channel Access itself, on the event loop
+
+    The handler runs entirely in the event loop's thread. Channels may be
+    created and subscribed to from other threads (as with blocking_mode):
+    the resulting network I/O is scheduled onto the loop.
+    '''
+    backend = 'asyncio'
+    callback_classes = {'connection': ConnectionCallback,
+                        'monitor': AsyncioMonitorCallback,
+                        }
+
+    def __init__(self, ctx=0):
+        super().__init__(ctx)
+        self.driver = 'asyncio'
+
+        self._channels = {}
+        self._ioids = itertools.count(1)
+        # ioid to (future, circuit) of reads and writes in flight
+        self._requests = {}
+        # subscription id (handler id) to its handler
+        self._subscriptions = {}
+        self._circuits = {}
+        self._search_addresses = search_addresses()
+        self._search_transport = None
+        self._search_timer = None
+        # channels waiting for a search reply, by cid
+        self._unanswered = {}
+        # channels created since the last flush, not yet searched for
+        self._new_channels = []
+
+    # channel information
+    def _channel(self, chid):
+        return self._channels[ca.channel_id_to_int(chid)]
+
+    def _connected_channel(self, chid):
+        channel = self._channels.get(ca.channel_id_to_int(chid), None)
+        if channel is None or not channel.connected:
+            raise errors.ChannelAccessException('Channel not connected')
+        return channel
+
+    def field_type(self, chid):
+        return self._channel(chid).native_type
+
+    def element_count(self, chid):
+        return self._channel(chid).count
+
+    def host_name(self, chid):
+        channel = self._channel(chid)
+        if not channel.connected:
+            return '<disconnected>'
+        return '{}:{}'.format(*channel.circuit.address)
+
+    def read_access(self, chid):
+        return int(bool(self._channel(chid).access_rights &
+                        proto.ACCESS_READ))
+
+    def write_access(self, chid):
+        return int(bool(self._channel(chid).access_rights &
+                        proto.ACCESS_WRITE))
+
+    def access(self, chid):
+        return _access_names[self.read_access(chid) +
+                             2 * self.write_access(chid)]
+
+    def is_connected(self, chid):
+        return self._channel(chid).connected
+
+    # channels
+    def _add_channel(self, pvname):
+        cid = next(_cids)
+        channel = Channel(pvname, cid)
+        self._channels[cid] = channel
+        self.channel_to_pv[cid] = pvname
+        self.pv_to_channel[pvname] = cid
+        self._new_channels.append(channel)
+        return cid
+
+    def request_flush(self):
+        '''Start searching for the channels created since the last flush'''
+        with self._sub_lock:
+            if self._new_channels:
+                channels, self._new_channels = self._new_channels, []
+                self._loop.call_soon_threadsafe(self._search, *channels)
+
+    def clear_channel(self, pvname):
+        with self._sub_lock:
+            cid = self.pv_to_channel[pvname]
+            super().clear_channel(pvname)
+
+            channel = self._channels.pop(cid)
+            self._unanswered.pop(cid, None)
+            circuit = channel.circuit
+            if circuit is not None:
+                if channel.connected:
+                    circuit.send(proto.clear_channel(channel.sid, cid))
+                circuit.channels.pop(cid, None)
+
+            channel.connected = False
+            channel.circuit = None
+
+    # requests
+    def _new_request(self, circuit):
+        ioid = next(self._ioids)
+        future = asyncio.Future()
+        self._requests[ioid] = (future, circuit)
+        future.add_done_callback(lambda fut: self._requests.pop(ioid, None))
+        return ioid, future
+
+    def pending_requests(self):
+        return len(self._requests)
+
+    def get_request(self, chid, ftype, count):
+        channel = self._connected_channel(chid)
+        ioid, future = self._new_request(channel.circuit)
+        if self.metrics is not None:
+            self._track_request('get', chid, future)
+        channel.circuit.send(proto.read_notify(ftype, count, channel.sid,
+                                               ioid))
+        return future
+
+    def put_request(self, chid, value, *, wait=True):
+        channel = self._connected_channel(chid)
+        ftype, count, data = cast.put_info(channel.native_type, channel.count,
+                                           value)
+        payload = proto.encode_values(ftype, data)
+        if not wait:
+            channel.circuit.send(proto.write(ftype, count, channel.sid, 0,
+                                             payload))
+            return None
+
+        ioid, future = self._new_request(channel.circuit)
+        if self.metrics is not None:
+            self._track_request('put', chid, future)
+        channel.circuit.send(proto.write_notify(ftype, count, channel.sid,
+                                                ioid, payload))
+        return future
+
+    def flush(self):
+        for circuit in list(self._circuits.values()):
+            circuit.flush()
+
+    # subscriptions
+    def _add_subscription(self, handler):
+        self._subscriptions[handler.handler_id] = handler
+        channel = self._channels.get(handler.chid, None)
+        if channel is not None and channel.connected:
+            self._send_event_add(channel, handler)
+
+    def _send_event_add(self, channel, handler):
+        # a count of 0 asks for the current (variable) element count
+        channel.circuit.send(proto.event_add(handler.ftype, handler.count,
+                                             channel.sid, handler.handler_id,
+                                             handler.mask))
+
+    def _cancel_subscription(self, handler):
+        self._subscriptions.pop(handler.handler_id, None)
+        channel = self._channels.get(handler.chid, None)
+        if channel is not None and channel.connected:
+            channel.circuit.send(proto.event_cancel(handler.ftype,
+                                                    handler.count,
+                                                    channel.sid,
+                                                    handler.handler_id))
+
+    # name search
+    def _search(self, *channels):
+        '''Start searching for channels (on the event loop)'''
+        for channel in channels:
+            if channel.cid not in self._channels or channel.connected:
+                continue
+
+            channel.search_period = config.SEARCH_PERIOD
+            channel.next_search = 0.0
+            self._unanswered[channel.cid] = channel
+        self._search_tick()
+
+    def _search_tick(self):
+        '''Send the search requests which are due, and schedule the next'''
+        if self._search_timer is not None:
+            self._search_timer.cancel()
+            self._search_timer = None
+
+        if (not self._running or not self._unanswered or
+                self._search_transport is None):
+            return
+
+        now = self._loop.time()
+        datagrams = []
+        messages = [proto.version()]
+        size = len(messages[0])
+        # channels due, but left for the next tick
+        deferred = False
+        for channel in self._unanswered.values():
+            if channel.next_search > now:
+                continue
+
+            message = proto.search(channel.name, channel.cid)
+            if size + len(message) > proto.MAX_UDP_SEND:
+                datagrams.append(b''.join(messages))
+                messages = [messages[0]]
+                size = len(messages[0])
+                if len(datagrams) >= config.MAX_SEARCH_DATAGRAMS:
+                    deferred = True
+                    break
+
+            messages.append(message)
+            size += len(message)
+            channel.next_search = now + channel.search_period
+            channel.search_period = min(2 * channel.search_period,
+                                        config.MAX_SEARCH_PERIOD)
+
+        if len(messages) > 1 and not deferred:
+            datagrams.append(b''.join(messages))
+
+        for datagram in datagrams:
+            for address in self._search_addresses:
+                try:
+                    self._search_transport.sendto(datagram, address)
+                except OSError as ex:
+                    logger.debug('Search to %s failed', address, exc_info=ex)
+
+        if deferred:
+            next_search = now + config.SEARCH_PERIOD
+        else:
+            next_search = min(channel.next_search
+                              for channel in self._unanswered.values())
+        self._search_timer = self._loop.call_at(next_search,
+                                                self._search_tick)
+
+    def _search_reply(self, data, address):
+        offset = 0
+        while True:
+            message, offset = proto.unpack(data, offset)
+            if message is None:
+                break
+            if message.command != Command.SEARCH:
+                continue
+
+            channel = self._unanswered.pop(message.param2, None)
+            if channel is None:
+                # answered already, or cleared
+                continue
+
+            if message.param1 == proto.INADDR_ANY_REPLY:
+                host = address[0]
+            else:
+                host = socket.inet_ntoa(struct.pack('>I', message.param1))
+            self._create_on_circuit(channel, (host, message.data_type))
+
+    # virtual circuits
+    def _create_on_circuit(self, channel, address):
+        circuit = self._circuits.get(address, None)
+        if circuit is None:
+            circuit = VirtualCircuit(self, address)
+            self._circuits[address] = circuit
+            asyncio.ensure_future(self._open_circuit(circuit))
+
+        channel.circuit = circuit
+        circuit.channels[channel.cid] = channel
+        circuit.send(proto.create_chan(channel.name, channel.cid))
+
+    @asyncio.coroutine
+    def _open_circuit(self, circuit):
+        try:
+            yield from self._loop.create_connection(lambda: circuit,
+                                                    *circuit.address)
+        except OSError as ex:
+            logger.warning('Failed to connect to %s:%d', circuit.address[0],
+                           circuit.address[1], exc_info=ex)
+            self._circuit_lost(circuit, ex)
+
+    def _circuit_lost(self, circuit, exc):
+        '''A virtual circuit closed: disconnect its channels and search again
+        '''
+        if self._circuits.get(circuit.address, None) is circuit:
+            del self._circuits[circuit.address]
+
+        now = time.monotonic()
+        events = []
+        channels = list(circuit.channels.values())
+        circuit.channels.clear()
+        for channel in channels:
+            if channel.connected:
+                events.append(('connection',
+                               dict(chid=channel.cid, connected=False), now))
+            self._disconnect_channel(channel, search=False)
+
+        if self._running:
+            self._search(*channels)
+
+        for ioid, (future, fut_circuit) in list(self._requests.items()):
+            if fut_circuit is circuit and not future.done():
+                msg = 'Virtual circuit to {}:{} lost'.format(*circuit.address)
+                future.set_exception(errors.ChannelAccessException(msg))
+
+        if events:
+            self._process_batch(events)
+
+    def _disconnect_channel(self, channel, search=True):
+        channel.connected = False
+        channel.sid = None
+        channel.circuit = None
+        if search and self._running:
+            self._search(channel)
+
+    # received messages
+    def _handle_message(self, circuit, message, events, latest):
+        '''Handle a message received on a virtual circuit
+
+        Connection and monitor events are appended to `events`, to be
+        dispatched together once the received data is parsed. `latest` maps
+        the handler id of coalescing subscriptions to the index of their
+        event in `events`.
+        '''
+        command = message.command
+        if command == Command.EVENT_ADD:
+            self._on_event(message, events, latest)
+        elif command == Command.READ_NOTIFY:
+            self._on_read_notify(message)
+        elif command == Command.WRITE_NOTIFY:
+            self._on_write_notify(message)
+        elif command == Command.CREATE_CHAN:
+            self._on_create_chan(circuit, message, events)
+        elif command == Command.ACCESS_RIGHTS:
+            channel = circuit.channels.get(message.param1, None)
+            if channel is not None:
+                channel.access_rights = message.param2
+        elif command == Command.ECHO:
+            circuit.send(proto.echo())
+        elif command == Command.ERROR:
+            self._on_error(message)
+        elif command in (Command.SERVER_DISCONN, Command.CREATE_CH_FAIL):
+            channel = circuit.channels.pop(message.param1, None)
+            if channel is not None:
+                if channel.connected:
+                    events.append(('connection',
+                                   dict(chid=channel.cid, connected=False),
+                                   time.monotonic()))
+                self._disconnect_channel(channel)
+        elif command not in (Command.VERSION, Command.EVENT_CANCEL):
+            logger.debug('Unhandled message %s', message[:5])
+
+    def _on_create_chan(self, circuit, message, events):
+        channel = circuit.channels.get(message.param1, None)
+        if channel is None:
+            return
+
+        channel.native_type = message.data_type
+        channel.count = message.data_count
+        channel.sid = message.param2
+        channel.connected = True
+
+        for handler in list(self._subscriptions.values()):
+            if handler.chid == channel.cid:
+                self._send_event_add(channel, handler)
+
+        events.append(('connection', dict(chid=channel.cid, connected=True),
+                       time.monotonic()))
+
+    def _on_event(self, message, events, latest):
+        handler_id = message.param2
+        handler = self._subscriptions.get(handler_id, None)
+        if handler is None or not message.payload:
+            # cancelled, or the final reply to EVENT_CANCEL
+            return
+
+        if message.param1 != dbr.ECA.NORMAL:
+            logger.warning('Subscription on %s failed (status %d)',
+                           handler.pvname, message.param1)
+            return
+
+        ftype = message.data_type
+        header, offset = proto.decode_header(ftype, message.payload)
+        if handler.buffer is not None:
+            values = proto.wire_values(ftype, message.data_count,
+                                       message.payload, offset)
+            seq, value = handler.buffer.write_array(values)
+            count = len(value)
+            values = None
+        else:
+            _, values = proto.decode_dbr(ftype, message.data_count,
+                                         message.payload)
+            count = len(values)
+            value = cast.unpack_values(values, count, dbr.native_type(ftype))
+
+        info = dict(ftype=ftype, count=count, chid=handler.chid,
+                    status=message.param1, value=value,
+                    handler_id=handler_id)
+        if handler.buffer is not None:
+            info['seq'] = seq
+        if header is not None:
+            info.update(header.to_dict())
+
+        event = ('monitor', info, time.monotonic())
+        if handler.coalesce:
+            idx = latest.get(handler_id, None)
+            if idx is not None:
+                # latest value wins: replace the pending update
+                events[idx] = event
+                handler.dropped += 1
+                return
+            latest[handler_id] = len(events)
+
+        events.append(event)
+
+    def _pop_request(self, ioid):
+        future, _ = self._requests.pop(ioid, (None, None))
+        if future is None or future.done():
+            return None
+        return future
+
+    def _on_read_notify(self, message):
+        future = self._pop_request(message.param2)
+        if future is None:
+            return
+
+        if message.param1 != dbr.ECA.NORMAL:
+            ex = errors.CASeverityException('get', str(message.param1))
+            future.set_exception(ex)
+            return
+
+        header, values = proto.decode_dbr(message.data_type,
+                                          message.data_count,
+                                          message.payload,
+                                          pool=context.buffer_pool)
+        future.set_result([header, values])
+
+    def _on_write_notify(self, message):
+        future = self._pop_request(message.param2)
+        if future is None:
+            return
+
+        if message.param1 != dbr.ECA.NORMAL:
+            ex = errors.CASeverityException('put', str(message.param1))
+            future.set_exception(ex)
+        else:
+            future.set_result(True)
+
+    def _on_error(self, message):
+        request, text = proto.decode_error(bytes(message.payload))
+        if request is not None and request.command in (Command.READ_NOTIFY,
+                                                       Command.WRITE_NOTIFY):
+            future = self._pop_request(request.param2)
+            if future is not None:
+                name = ('get' if request.command == Command.READ_NOTIFY
+                        else 'put')
+                future.set_exception(errors.CASeverityException(name, text))
+                return
+
+        logger.warning('Server error (status %d): %s', message.param2, text)
+
+    # life cycle
+    @asyncio.coroutine
+    def _open_search_socket(self):
+        transport, _ = yield from self._loop.create_datagram_endpoint(
+            lambda: SearchProtocol(self), local_addr=('0.0.0.0', 0),
+            allow_broadcast=True)
+        self._search_transport = transport
+        self._search_tick()
+
+    def start(self):
+        # the event loop may already be running in another thread
+        asyncio.run_coroutine_threadsafe(self._open_search_socket(),
+                                         self._loop)
+
+    def stop(self):
+        if not self._running:
+            return
+
+        for chid, pvname in list(self.channel_to_pv.items()):
+            logger.debug('Destroying channel %s (%d)', pvname, chid)
+            self.clear_channel(pvname)
+
+        self._cbreg.shutdown()
+        self._running = False
+        if self._search_timer is not None:
+            self._search_timer.cancel()
+            self._search_timer = None
+
+        for circuit in list(self._circuits.values()):
+            circuit.close()
+        self._circuits.clear()
+
+        if self._search_transport is not None:
+            self._search_transport.close()
+            self._search_transport = None
@@ -0,0 +1,431 @@
+"""
+Channel Access wire protocol
+
+Encoding and decoding of CA messages and DBR payloads, for the pure-Python
+client (ca_client) and test server (server). All protocol fields are
+big-endian. The layouts here follow caProto.h and db_access.h (CA protocol
+version 4.13).
+"""
+import collections
+import struct
+from enum import IntEnum
+
+import numpy as np
+
+from . import dbr
+from .dbr import ChannelType
+from .utils import decode_bytes
+
+
+# minor protocol version implemented
+CA_MINOR_PROTOCOL_REVISION = 13
+CA_SERVER_PORT = 5064
+CA_REPEATER_PORT = 5065
+# maximum size of a search datagram
+MAX_UDP_SEND = 1024
+# maximum payload size of a message with a standard header
+MAX_STANDARD_PAYLOAD = 0xffff - 8
+
+# search reply: the server address is the address the reply came from
+INADDR_ANY_REPLY = 0xffffffff
+# search request: only servers with the channel reply
+DONT_REPLY = 5
+
+ACCESS_READ = 1
+ACCESS_WRITE = 2
+
+
+class Command(IntEnum):
+    VERSION = 0
+    EVENT_ADD = 1
+    EVENT_CANCEL = 2
+    READ = 3
+    WRITE = 4
+    SEARCH = 6
+    EVENTS_OFF = 8
+    EVENTS_ON = 9
+    ERROR = 11
+    CLEAR_CHANNEL = 12
+    RSRV_IS_UP = 13
+    NOT_FOUND = 14
+    READ_NOTIFY = 15
+    REPEATER_CONFIRM = 17
+    CREATE_CHAN = 18
+    WRITE_NOTIFY = 19
+    CLIENT_NAME = 20
+    HOST_NAME = 21
+    ACCESS_RIGHTS = 22
+    ECHO = 23
+    REPEATER_REGISTER = 24
+    CREATE_CH_FAIL = 26
+    SERVER_DISCONN = 27
+
+
+_header = struct.Struct('>HHHHII')
+_extended = struct.Struct('>II')
+_event_add = struct.Struct('>fffHH')
+
+Message = collections.namedtuple('Message', 'command data_type data_count '
+                                            'param1 param2 payload')
+
+
+def padded(payload):
+    '''Pad a payload with nulls to a multiple of 8 bytes'''
+    return payload + b'\0' * (-len(payload) % 8)
+
+
+def pack(command, payload=b'', data_type=0, data_count=0, param1=0,
+         param2=0):
+    '''Encode a message
+
+    The payload is padded to a multiple of 8 bytes, and the extended header
+    is used when the payload size or data count do not fit the standard one.
+    '''
+    payload = padded(payload)
+    size = len(payload)
+    if size > MAX_STANDARD_PAYLOAD or data_count >= 0xffff:
+        return b''.join((_header.pack(command, 0xffff, data_type, 0, param1,
+                                      param2),
+                         _extended.pack(size, data_count), payload))
+
+    return _header.pack(command, size, data_type, data_count, param1,
+                        param2) + payload
+
+
+def unpack(buffer, offset=0):
+    '''Decode the message at `offset` in `buffer`
+
+    Returns
+    -------
+    message : Message or None
+        None if the buffer does not yet hold all of the message. The payload
+        is a memoryview of `buffer`.
+    offset : int
+        offset of the next message
+    '''
+    end = offset + _header.size
+    if len(buffer) < end:
+        return None, offset
+
+    (command, size, data_type, data_count, param1,
+     param2) = _header.unpack_from(buffer, offset)
+    if size == 0xffff and data_count == 0:
+        if len(buffer) < end + _extended.size:
+            return None, offset
+        size, data_count = _extended.unpack_from(buffer, end)
+        end += _extended.size
+
+    if len(buffer) < end + size:
+        return None, offset
+
+    payload = memoryview(buffer)[end:end + size]
+    return (Message(command, data_type, data_count, param1, param2, payload),
+            end + size)
+
+
+def encode_string(value):
+    return padded(value.encode('latin-1') + b'\0')
+
+
+def version(priority=0):
+    return pack(Command.VERSION, data_type=priority,
+                data_count=CA_MINOR_PROTOCOL_REVISION)
+
+
+def client_name(name):
+    return pack(Command.CLIENT_NAME, encode_string(name))
+
+
+def host_name(name):
+    return pack(Command.HOST_NAME, encode_string(name))
+
+
+def search(pvname, cid):
+    return pack(Command.SEARCH, encode_string(pvname), data_type=DONT_REPLY,
+                data_count=CA_MINOR_PROTOCOL_REVISION, param1=cid,
+                param2=cid)
+
+
+def create_chan(pvname, cid):
+    return pack(Command.CREATE_CHAN, encode_string(pvname), param1=cid,
+                param2=CA_MINOR_PROTOCOL_REVISION)
+
+
+def clear_channel(sid, cid):
+    return pack(Command.CLEAR_CHANNEL, param1=sid, param2=cid)
+
+
+def read_notify(ftype, count, sid, ioid):
+    return pack(Command.READ_NOTIFY, data_type=ftype, data_count=count,
+                param1=sid, param2=ioid)
+
+
+def write(ftype, count, sid, ioid, payload):
+    return pack(Command.WRITE, payload, data_type=ftype, data_count=count,
+                param1=sid, param2=ioid)
+
+
+def write_notify(ftype, count, sid, ioid, payload):
+    return pack(Command.WRITE_NOTIFY, payload, data_type=ftype,
+                data_count=count, param1=sid, param2=ioid)
+
+
+def event_add(ftype, count, sid, subid, mask):
+    return pack(Command.EVENT_ADD, _event_add.pack(0.0, 0.0, 0.0, mask, 0),
+                data_type=ftype, data_count=count, param1=sid, param2=subid)
+
+
+def event_cancel(ftype, count, sid, subid):
+    return pack(Command.EVENT_CANCEL, data_type=ftype, data_count=count,
+                param1=sid, param2=subid)
+
+
+def echo():
+    return pack(Command.ECHO)
+
+
+def error(request, cid, status, text):
+    '''An ERROR reply to `request` (a Message)'''
+    original = _header.pack(request.command, 0, request.data_type,
+                            min(request.data_count, 0xffff), request.param1,
+                            request.param2)
+    return pack(Command.ERROR, original + encode_string(text), param1=cid,
+                param2=status)
+
+
+def search_reply(cid, port):
+    '''A reply to a search, naming the TCP port of the replying server'''
+    return pack(Command.SEARCH, struct.pack('>H', CA_MINOR_PROTOCOL_REVISION),
+                data_type=port, param1=INADDR_ANY_REPLY, param2=cid)
+
+
+def decode_event_add(payload):
+    '''The subscription mask of an EVENT_ADD request'''
+    return _event_add.unpack_from(payload)[3]
+
+
+def decode_error(payload):
+    '''Decode an ERROR payload: the failed request and the error message'''
+    request, _ = unpack(payload)
+    message = decode_bytes(bytes(payload[_header.size:]))
+    return request, message
+
+
+# DBR payloads
+_wire_types = {
+    ChannelType.STRING: np.dtype((np.bytes_, dbr.MAX_STRING_SIZE)),
+    ChannelType.SHORT: np.dtype('>i2'),
+    ChannelType.FLOAT: np.dtype('>f4'),
+    ChannelType.ENUM: np.dtype('>u2'),
+    ChannelType.CHAR: np.dtype('u1'),
+    ChannelType.LONG: np.dtype('>i4'),
+    ChannelType.DOUBLE: np.dtype('>f8'),
+}
+
+_limit_names = ('upper_disp_limit', 'lower_disp_limit', 'upper_alarm_limit',
+                'upper_warning_limit', 'lower_warning_limit',
+                'lower_alarm_limit', 'upper_ctrl_limit', 'lower_ctrl_limit')
+
+
+def _limits(dtype):
+    return [(name, dtype) for name in _limit_names]
+
+
+_status = [('status', '>i2'), ('severity', '>i2')]
+_time = _status + [('secs', '>u4'), ('nsec', '>u4')]
+_units = [('units', 'S{}'.format(dbr.MAX_UNITS_SIZE))]
+_precision = [('precision', '>i2'), ('RISC_pad', '>i2')] + _units
+
+# header layouts, including the padding before the first value
+_header_layouts = {
+    ChannelType.STS_STRING: _status,
+    ChannelType.STS_SHORT: _status,
+    ChannelType.STS_FLOAT: _status,
+    ChannelType.STS_ENUM: _status,
+    ChannelType.STS_CHAR: _status + [('RISC_pad', 'u1')],
+    ChannelType.STS_LONG: _status,
+    ChannelType.STS_DOUBLE: _status + [('RISC_pad', '>i4')],
+
+    ChannelType.TIME_STRING: _time,
+    ChannelType.TIME_SHORT: _time + [('RISC_pad', '>i2')],
+    ChannelType.TIME_FLOAT: _time,
+    ChannelType.TIME_ENUM: _time + [('RISC_pad', '>i2')],
+    ChannelType.TIME_CHAR: _time + [('RISC_pad0', '>i2'), ('RISC_pad1', 'u1')],
+    ChannelType.TIME_LONG: _time,
+    ChannelType.TIME_DOUBLE: _time + [('RISC_pad', '>i4')],
+
+    # there is no CTRL_STRING structure: it is sent as STS_STRING
+    ChannelType.CTRL_STRING: _status,
+    ChannelType.CTRL_SHORT: _status + _units + _limits('>i2'),
+    ChannelType.CTRL_FLOAT: _status + _precision + _limits('>f4'),
+    ChannelType.CTRL_ENUM: _status + [
+        ('no_str', '>i2'),
+        ('strs', 'S{}'.format(dbr.MAX_ENUM_STRING_SIZE),
+         (dbr.MAX_ENUM_STATES, ))],
+    ChannelType.CTRL_CHAR: (_status + _units + _limits('u1') +
+                            [('RISC_pad', 'u1')]),
+    ChannelType.CTRL_LONG: _status + _units + _limits('>i4'),
+    ChannelType.CTRL_DOUBLE: _status + _precision + _limits('>f8'),
+}
+
+_header_types = {ftype: np.dtype(layout)
+                 for ftype, layout in _header_layouts.items()}
+
+
+def wire_dtype(ftype):
+    '''numpy dtype of the values of a DBR type, as sent'''
+    return _wire_types[dbr.native_type(ftype)]
+
+
+def value_offset(ftype):
+    '''Offset of the first value in a DBR payload'''
+    try:
+        return _header_types[ftype].itemsize
+    except KeyError:
+        return 0
+
+
+class DBRHeader:
+    '''The status, time or control fields of a DBR payload
+
+    This stands in for the dbr.TimeType and dbr.ControlTypeBase structures
+    which libca returns, and gives the same dictionary from `to_dict`.
+    '''
+    __slots__ = ('dbr_type', 'fields')
+
+    def __init__(self, dbr_type, fields):
+        self.dbr_type = dbr_type
+        self.fields = fields
+
+    def to_dict(self):
+        fields = self.fields
+        if self.dbr_type in dbr.time_types:
+            secs, nsec = int(fields['secs']), int(fields['nsec'])
+            return dict(status=int(fields['status']),
+                        severity=int(fields['severity']),
+                        timestamp=dbr.epics_to_unixtime(secs, nsec),
+                        timestamp_ns=dbr.epics_to_unix_ns(secs, nsec),
+                        )
+
+        kwds = dict(status=int(fields['status']),
+                    severity=int(fields['severity']))
+        names = fields.dtype.names
+        if 'precision' in names:
+            kwds['precision'] = int(fields['precision'])
+        if 'units' in names:
+            kwds['units'] = decode_bytes(fields['units'])
+        if 'no_str' in names:
+            no_str = int(fields['no_str'])
+            if no_str > 0:
+                kwds['enum_strs'] = tuple(decode_bytes(fields['strs'][i])
+                                          for i in range(no_str))
+        if 'upper_disp_limit' in names:
+            kwds.update((name, fields[name].item()) for name in _limit_names)
+        return kwds
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__,
+                               ChannelType(self.dbr_type).name)
+
+
+def decode_header(ftype, payload):
+    '''Decode the fields before the values of a DBR payload
+
+    Returns
+    -------
+    header : DBRHeader or None
+        for TIME and CTRL types; None for native and STS types
+    offset : int
+        offset of the first value
+    '''
+    header_type = _header_types.get(ftype, None)
+    if header_type is None:
+        return None, 0
+
+    if ftype in dbr.time_types or ftype in dbr.control_types:
+        fields = np.frombuffer(payload, dtype=header_type, count=1)
+        return DBRHeader(ftype, fields.copy()[0]), header_type.itemsize
+    return None, header_type.itemsize
+
+
+def wire_values(ftype, count, payload, offset):
+    '''A view of (up to) `count` values in a DBR payload, as sent
+
+    The view references the payload, so it should be copied (for example,
+    into a native array) and dropped before the receive buffer is reused.
+    '''
+    wire = wire_dtype(ftype)
+    count = min(count, (len(payload) - offset) // wire.itemsize)
+    return np.frombuffer(payload, dtype=wire, count=count, offset=offset)
+
+
+def decode_dbr(ftype, count, payload, pool=None):
+    '''Decode a DBR payload, as `cast.copy_args` does for libca
+
+    The values are copied once, straight from the payload into a native
+    (byte-swapped) array, taken from `pool` if given.
+
+    Returns
+    -------
+    header : DBRHeader or None
+        for TIME and CTRL types; None for native and STS types
+    values : numpy.ndarray
+        native values
+    '''
+    header, offset = decode_header(ftype, payload)
+    wire = wire_values(ftype, count, payload, offset)
+    native = wire.dtype.newbyteorder('=')
+    if pool is not None:
+        values = pool.acquire(native, len(wire))
+    else:
+        values = np.empty(len(wire), dtype=native)
+    values[:] = wire
+    return header, values
+
+
+def encode_values(ftype, values):
+    '''Encode native values (a ctypes array or numpy array) for a put'''
+    wire = wire_dtype(ftype)
+    native = wire.newbyteorder('=')
+    values = np.frombuffer(values, dtype=native)
+    return padded(values.astype(wire).tobytes())
+
+
+def encode_dbr(ftype, values, **fields):
+    '''Encode a DBR payload, as a server sends it
+
+    Parameters
+    ----------
+    ftype : int
+        DBR type requested
+    values : numpy.ndarray
+        native values
+    **fields
+        the header fields: status, severity, timestamp (UNIX time), units,
+        precision, enum_strs and the limits, as in `DBRHeader.to_dict`.
+        Missing fields are zero.
+    '''
+    parts = []
+    header_type = _header_types.get(ftype, None)
+    if header_type is not None:
+        header = np.zeros(1, dtype=header_type)
+        names = header_type.names
+        for name in ('status', 'severity', 'precision') + _limit_names:
+            if name in names and fields.get(name, None) is not None:
+                header[name] = fields[name]
+        if 'secs' in names:
+            secs, nsec = dbr.unixtime_to_epics(fields.get('timestamp', 0.0))
+            header['secs'] = secs
+            header['nsec'] = nsec
+        if 'units' in names:
+            header['units'] = fields.get('units', '').encode('latin-1')
+        if 'no_str' in names:
+            enum_strs = fields.get('enum_strs', None) or ()
+            enum_strs = enum_strs[:dbr.MAX_ENUM_STATES]
+            header['no_str'] = len(enum_strs)
+            for i, enum_str in enumerate(enum_strs):
+                header['strs'][0, i] = enum_str.encode('latin-1')
+        parts.append(header.tobytes())
+
+    parts.append(np.asarray(values).astype(wire_dtype(ftype)).tobytes())
+    return padded(b''.join(parts))
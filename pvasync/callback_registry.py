@@ -1,16 +1,27 @@
+import time
 import asyncio
 import sys
 import logging
 import functools
+import itertools
+import concurrent.futures
 
 from collections import OrderedDict
 
+import numpy as np
+
 from . import ca
+from . import config
 from . import dbr
+from .budgets import (CallbackHealth, quarantine_policy, ACTIVE, SUSPENDED,
+                      THREADED)
 
 
 logger = logging.getLogger(__name__)
 loop = asyncio.get_event_loop()
+# callback ids are unique across contexts, so that those of a context pool
+# can be told apart
+_cbids = itertools.count(1)
 
 
 def _locked(func):
@@ -37,17 +48,40 @@ class ChannelCallbackBase:
 
         self.callbacks = OrderedDict()
         self.oneshots = []
+        # budgets of each callback, by cbid (see budgets)
+        self.health = {}
+        # what the callbacks served by a handler doing more than they asked
+        # for asked for, by cbid (see `request` and `derive`)
+        self.requests = {}
 
     def create(self):
         pass
 
+    def request(self):
+        '''What a subscriber of this handler asks for (None if it cannot be
+        served by a handler doing more)'''
+        return None
+
+    def derive(self, request, kwargs):
+        '''The event of a callback which asked for `request`, from this
+        handler's event'''
+        return kwargs
+
+    def union(self, other):
+        '''The arguments of a handler serving both this one and `other` (of
+        the same class), or None if they cannot be merged'''
+        return None
+
     def destroy(self):
         for cbid in list(self.callbacks.keys()):
             self.remove_callback(cbid, destroy_if_empty=False)
 
     @_locked
-    def add_callback(self, cbid, func, *, oneshot=False):
+    def add_callback(self, cbid, func, *, oneshot=False, request=None):
         self.callbacks[cbid] = func
+        self.health[cbid] = CallbackHealth(cbid, self.sig, self.pvname, func)
+        if request is not None and request != self.request():
+            self.requests[cbid] = request
         if oneshot:
             self.oneshots.append(cbid)
         return cbid
@@ -59,6 +93,8 @@ class ChannelCallbackBase:
     @_locked
     def remove_callback(self, cbid, *, destroy_if_empty=True):
         del self.callbacks[cbid]
+        del self.health[cbid]
+        self.requests.pop(cbid, None)
 
         try:
             self.oneshots.remove(cbid)
@@ -72,13 +108,60 @@ class ChannelCallbackBase:
     def process(self, **kwargs):
         with self.context._sub_lock:
             exceptions = []
-            for cbid, func in self.callbacks.items():
+            metrics = self.context.metrics
+            # calls are only timed for a time budget or the metrics
+            timed = (config.CALLBACK_TIME_BUDGET is not None or
+                     metrics is not None)
+            requests = self.requests
+            event = kwargs
+            # (callbacks may subscribe others to this channel)
+            for cbid, func in list(self.callbacks.items()):
+                health = self.health.get(cbid, None)
+                if health is None:
+                    # removed by a callback run before it
+                    continue
+                elif health.state == SUSPENDED:
+                    health.skipped += 1
+                    continue
+
+                if requests:
+                    request = requests.get(cbid, None)
+                    event = (kwargs if request is None
+                             else self.derive(request, kwargs))
+                    if event is None:
+                        # not an event this callback asked for
+                        continue
+
+                if health.state == THREADED:
+                    self.registry._run_threaded(health, func, self.chid,
+                                                event)
+                    continue
+
+                ex = None
+                if timed:
+                    t0 = time.perf_counter()
                 try:
-                    func(chid=self.chid, **kwargs)
-                except Exception as ex:
+                    func(chid=self.chid, **event)
+                except Exception as ex_:
+                    ex = ex_
                     exceptions.append((ex, sys.exc_info()[2]))
-                    logger.error('Unhandled callback exception (chid: %s kw: '
-                                 '%s)', self.chid, kwargs, exc_info=ex)
+
+                if not timed:
+                    if ex is None:
+                        health.calls += 1
+                        continue
+                    elapsed = None
+                else:
+                    elapsed = time.perf_counter() - t0
+
+                if metrics is not None:
+                    metrics.record('callback', elapsed)
+                    if ex is not None:
+                        metrics.count_error(self.pvname)
+
+                over_budget = health.record(elapsed, ex)
+                if over_budget is not None:
+                    self.registry._quarantine(health, over_budget)
 
             for cbid in list(self.oneshots):
                 self.remove_callback(cbid)
@@ -96,9 +179,13 @@ class ChannelCallbackRegistry:
         self.handlers_by_chid = {}
         self.handlers = {}
         self.cbid_owner = {}
-        self._cbid = 0
         self._handler_id = 0
         self._sub_lock = context._sub_lock
+        # runs the callbacks moved off the event loop (see budgets)
+        self._executor = None
+        # (a misconfigured PVASYNC_CALLBACK_QUARANTINE fails here, not on the
+        # first callback over budget)
+        quarantine_policy()
 
     def __getstate__(self):
         # We cannot currently pickle the callables in the registry, so
@@ -115,8 +202,7 @@ class ChannelCallbackRegistry:
             raise ValueError("Allowed signals are {0}".format(
                 tuple(self.sig_classes.keys())))
 
-        self._cbid += 1
-        cbid = self._cbid
+        cbid = next(_cbids)
         chid = ca.channel_id_to_int(chid)
 
         if chid not in self.handlers_by_chid:
@@ -127,6 +213,7 @@ class ChannelCallbackRegistry:
 
         handler_class = self.sig_classes[sig]
         new_handler = handler_class(self, chid, **kwargs)
+        request = new_handler.request()
 
         # fair warning to anyone looking to make this more efficient (you know
         # who you are): there shouldn't be enough entries in the callback list
@@ -135,11 +222,21 @@ class ChannelCallbackRegistry:
             if handler >= new_handler:
                 new_handler = handler
                 break
+        else:
+            # one serving both, merged with those it can be
+            for handler in sig_handlers:
+                merged = new_handler.union(handler)
+                if merged is not None:
+                    new_handler = handler_class(self, chid, **merged)
 
         self.cbid_owner[cbid] = new_handler
-        new_handler.add_callback(cbid, func, oneshot=oneshot)
+        new_handler.add_callback(cbid, func, oneshot=oneshot, request=request)
 
         if new_handler not in sig_handlers:
+            # the existing handlers it can serve too are replaced by it
+            served = [handler for handler in sig_handlers
+                      if request is not None and new_handler >= handler]
+
             self._handler_id += 1
             new_handler.handler_id = self._handler_id
 
@@ -147,8 +244,30 @@ class ChannelCallbackRegistry:
             sig_handlers.append(new_handler)
             new_handler.create()
 
+            for handler in served:
+                self._replace_handler(handler, new_handler)
+
         return new_handler, cbid
 
+    def _replace_handler(self, old, new):
+        '''Move the callbacks of `old` to `new`, which can serve them, and
+        destroy `old` (with the subscription lock held)'''
+        for cbid, func in list(old.callbacks.items()):
+            new.add_callback(cbid, func, oneshot=(cbid in old.oneshots),
+                             request=old.requests.get(cbid, old.request()))
+            # (keeping its record)
+            new.health[cbid] = old.health[cbid]
+            self.cbid_owner[cbid] = new
+
+        old.callbacks.clear()
+        old.health.clear()
+        old.requests.clear()
+        del old.oneshots[:]
+
+        self.handlers_by_chid[old.chid][old.sig].remove(old)
+        self.handlers.pop(old.handler_id, None)
+        old.destroy()
+
     @_locked
     def unsubscribe(self, cbid):
         """Disconnect the callback registered with callback id *cbid*
@@ -167,8 +286,80 @@ class ChannelCallbackRegistry:
             # TODO here is where chid can be checked to see if it's in use
             # anywhere and can potentially be cleared
             subs = list(self.subscriptions_by_chid(chid))
-            if not subs:
-                self.context.clear_channel(chid)
+            pvname = self.context.channel_to_pv.get(chid, None)
+            if not subs and pvname is not None:
+                self.context.clear_channel(pvname)
+
+    def _quarantine(self, health, reason):
+        '''A callback is over its budget: apply config.CALLBACK_QUARANTINE'''
+        policy = quarantine_policy()
+        if policy == 'suspend':
+            health.set_state(SUSPENDED, reason)
+            logger.warning('Suspended callback %s on %s (cbid %d): %s',
+                           health.name, health.pvname, health.cbid, reason)
+        elif policy == 'thread' and not health.loop_only:
+            health.set_state(THREADED, reason)
+            logger.warning('Moved callback %s on %s (cbid %d) to a worker '
+                           'thread: %s', health.name, health.pvname,
+                           health.cbid, reason)
+        else:
+            # only warn, again after as many errors or slow calls (and
+            # callbacks which have to run on the event loop are not moved)
+            health.reset_counts()
+            logger.warning('Callback %s on %s (cbid %d) is over its budget: '
+                           '%s', health.name, health.pvname, health.cbid,
+                           reason)
+
+    def _run_threaded(self, health, func, chid, kwargs):
+        # the event is only valid until the callback returns: with nbuffers,
+        # its arrays are views of a ring of buffers which later events reuse
+        kwargs = {key: value.copy() if isinstance(value, np.ndarray)
+                  else value
+                  for key, value in kwargs.items()}
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1)
+        self._executor.submit(self._call_threaded, health, func, chid,
+                              kwargs)
+
+    def _call_threaded(self, health, func, chid, kwargs):
+        ex = None
+        t0 = time.perf_counter()
+        try:
+            func(chid=chid, **kwargs)
+        except Exception as ex_:
+            ex = ex_
+        health.record(time.perf_counter() - t0, ex)
+
+    def _health(self, cbid):
+        try:
+            return self.cbid_owner[cbid].health[cbid]
+        except KeyError:
+            raise ValueError('Unknown callback id {}'.format(cbid)) from None
+
+    @_locked
+    def callback_health(self):
+        '''The health of every callback, by callback id'''
+        return {cbid: handler.health[cbid].to_dict()
+                for cbid, handler in self.cbid_owner.items()
+                if cbid in handler.health}
+
+    @_locked
+    def set_callback_state(self, cbid, state, reason=None):
+        '''Set a callback active, suspended or threaded'''
+        if state not in (ACTIVE, SUSPENDED, THREADED):
+            raise ValueError('Unknown callback state {!r}'.format(state))
+        health = self._health(cbid)
+        if state == THREADED and health.loop_only:
+            raise ValueError('Callback {} has to run on the event loop'
+                             ''.format(cbid))
+        health.set_state(state, reason)
+
+    def shutdown(self):
+        '''Stop the worker thread of the threaded callbacks'''
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
 
     @_locked
     def process(self, sig, chid, *, cbid=None, handler_id=None, **kwargs):
@@ -189,6 +380,13 @@ class ChannelCallbackRegistry:
 
         return handler.process(**kwargs)
 
+    @_locked
+    def process_batch(self, events):
+        '''Process a batch of (sig, chid, kwargs) events, in order'''
+        process = self.process
+        for sig, chid, kwargs in events:
+            process(sig, chid, **kwargs)
+
     def subscriptions_by_chid(self, chid):
         for sig, handlers in self.handlers_by_chid[chid].items():
             for handler in handlers:
@@ -33,6 +33,54 @@ def to_numpy_array(data, count, ntype):
         return ret
 
 
+def native_dtype(ntype):
+    "numpy dtype for a native field type"
+    if ntype == ChannelType.STRING:
+        return _string_dtype
+    return dbr._numpy_map[ntype]
+
+
+_string_dtype = numpy.dtype((numpy.bytes_, dbr.MAX_STRING_SIZE))
+
+
+def unpack_values(values, count, ntype, as_numpy=True, pool=None):
+    """unpack a numpy array of native values, as returned by `copy_args`
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        native values
+    count : int
+        number of elements to return (0 or None for all)
+    ntype : int
+        native data type
+    as_numpy : bool
+        return array data as a numpy array, instead of a list
+    pool : buffers.BufferPool, optional
+        if the values are converted to a scalar, list or string, the array is
+        released back to this pool. A numpy array returned to the caller is
+        owned by the caller.
+    """
+    if not count or count > len(values):
+        count = len(values)
+
+    if ntype == ChannelType.STRING:
+        if count == 1:
+            value = decode_bytes(values[0])
+        else:
+            value = [decode_bytes(elem) for elem in values[:count]]
+    elif count == 1:
+        value = values.item(0)
+    elif as_numpy:
+        return values[:count]
+    else:
+        value = values[:count].tolist()
+
+    if pool is not None:
+        pool.release(values)
+    return value
+
+
 def unpack_simple(data, count, ntype, use_numpy):
     "simple, native data type"
     if count == 1 and ntype != ChannelType.STRING:
@@ -99,16 +147,25 @@ def get_string_put_info(count, value, encoding='latin-1'):
 
 @withConnectedCHID
 def get_put_info(chid, value, encoding='latin-1'):
-    ftype = field_type(chid)
-    nativecount = element_count(chid)
+    return put_info(field_type(chid), element_count(chid), value,
+                    encoding=encoding)
+
+
+def put_info(ftype, nativecount, value, encoding='latin-1'):
+    """ftype, count and ctypes data to put `value` to a channel of native
+    type `ftype` and element count `nativecount`"""
     count = nativecount
-    try:
-        count = len(value)
-    except TypeError:
-        if nativecount > 1:
-            raise ValueError('value put to array PV must be an array or '
-                             'sequence')
+    if ftype == ChannelType.STRING and isinstance(value, str):
+        # a single string, not a sequence of characters
         count = 1
+    else:
+        try:
+            count = len(value)
+        except TypeError:
+            if nativecount > 1:
+                raise ValueError('value put to array PV must be an array or '
+                                 'sequence')
+            count = 1
 
     if ftype == ChannelType.STRING:
         return get_string_put_info(count, value, encoding=encoding)
@@ -145,13 +202,22 @@ def get_put_info(chid, value, encoding='latin-1'):
     return ftype, count, data
 
 
-def cast_monitor_args(event_args):
-    """make a dictionary from monitor callback arguments"""
-    promoted_val, nvalues = cast_args(event_args)
-    value = unpack(event_args.chid, nvalues, count=event_args.count,
-                   ftype=event_args.type)
+def cast_monitor_args(event_args, buffer=None):
+    """make a dictionary from monitor callback arguments
 
+    If a buffers.MonitorBuffer is given, the values are copied into it and
+    the value is a read-only view, with its sequence number in `seq`.
+    """
+    promoted_val, nvalues = cast_args(event_args)
     kwds = event_args.to_dict()
+
+    if buffer is not None:
+        seq, value = buffer.write(ctypes.addressof(nvalues), event_args.count)
+        kwds['seq'] = seq
+    else:
+        value = unpack(event_args.chid, nvalues, count=event_args.count,
+                       ftype=event_args.type)
+
     kwds['value'] = value
     kwds['handler_id'] = event_args.usr
 
@@ -186,3 +252,32 @@ def cast_args(args):
                 ctypes.cast(args.raw_dbr,
                             ctypes.POINTER(args.count * ftype_c)).contents
                 ]
+
+
+def copy_args(args, pool):
+    """copy callback arguments out of libca-owned memory
+
+    The TIME/CTRL header (if any) is copied into its own small structure and
+    the native values are copied exactly once, into an array from `pool`.
+
+    returns: [dbr_ctrl or dbr_time struct,
+              numpy array of count native values]
+
+    If data is already of a native_type, the first value in the list will be
+    None.
+    """
+    ftype = args.type
+    ntype = native_type(ftype)
+    if ftype != ntype:
+        header_c = dbr._ftype_to_ctype[ftype]
+        header = header_c()
+        ctypes.memmove(ctypes.addressof(header), args.raw_dbr,
+                       ctypes.sizeof(header_c))
+        native_start = args.raw_dbr + dbr.value_offset[ftype]
+    else:
+        header = None
+        native_start = args.raw_dbr
+
+    values = pool.acquire(native_dtype(ntype), args.count)
+    ctypes.memmove(values.ctypes.data, native_start, values.nbytes)
+    return [header, values]
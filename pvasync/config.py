@@ -1,7 +1,41 @@
+import os
 import sys
 
-# PREEMPTIVE_CALLBACK determines the CA context
-PREEMPTIVE_CALLBACK = True
+# PREEMPTIVE_CALLBACK determines the CA context, and with it how libca is
+# driven:
+#   True  - preemptive callbacks, with libca polled by executor threads
+#   False - non-preemptive callbacks, with libca polled from the asyncio event
+#           loop when one of its sockets is readable. The event loop must run
+#           in the thread which imported pvasync.
+# As the context is created on import, this can also be set with the
+# environment variable PVASYNC_PREEMPTIVE_CALLBACK (0 or 1).
+PREEMPTIVE_CALLBACK = (os.environ.get('PVASYNC_PREEMPTIVE_CALLBACK', '1')
+                       not in ('0', 'no', 'false'))
+
+# CA_BACKEND selects the Channel Access implementation:
+#   'libca'   - the EPICS CA client library, through ctypes
+#   'asyncio' - a pure-Python client speaking the CA protocol from the
+#               asyncio event loop (see ca_client). libca is never loaded, and
+#               the event loop must run in the thread which imported pvasync.
+# This can also be set with the environment variable PVASYNC_BACKEND.
+CA_BACKEND = os.environ.get('PVASYNC_BACKEND', 'libca').lower()
+
+# CONTEXT_POOL_SIZE contexts share out the channels when over 1 (see pool),
+# each with its own poll and event queue threads. PV names are assigned to
+# contexts by CONTEXT_POOL_SHARD: 'hash' (of the whole name) or 'prefix' (of
+# the name up to its first ':'). Also set by PVASYNC_CONTEXTS and
+# PVASYNC_CONTEXT_SHARD.
+CONTEXT_POOL_SIZE = int(os.environ.get('PVASYNC_CONTEXTS', '1'))
+CONTEXT_POOL_SHARD = os.environ.get('PVASYNC_CONTEXT_SHARD', 'hash').lower()
+
+# timing of name searches with the asyncio backend: the first retry is sent
+# after SEARCH_PERIOD seconds, then the period doubles up to
+# MAX_SEARCH_PERIOD
+SEARCH_PERIOD = 0.03
+MAX_SEARCH_PERIOD = 5.0
+# at most this many search datagrams are sent every SEARCH_PERIOD, so that a
+# burst of new channels does not overrun the servers' receive buffers
+MAX_SEARCH_DATAGRAMS = 50
 
 # maximum element count for auto-monitoring of PVs in epics.pv and for
 # automatic conversion of numerical array data to numpy arrays
@@ -11,3 +45,53 @@ AUTOMONITOR_MAXLENGTH = 65536  # 16384
 #   This should be kept fairly short --
 #   as connection will be tried repeatedly
 DEFAULT_CONNECTION_TIMEOUT = 2.0
+
+# default get and put timeouts are estimated from the round-trip times and
+# bandwidth measured for each server (see rtt), but are never shorter than
+# MIN_REQUEST_TIMEOUT: the round trips are timed to when their replies are
+# handled, and so include any lag of a busy event loop. A put waits for the
+# record to process as well, for up to PUT_PROCESSING_TIMEOUT more.
+MIN_REQUEST_TIMEOUT = 1.0
+PUT_PROCESSING_TIMEOUT = 30.0
+# the default timeout of a bulk get (caget_many) is 1.0 + log10(number of
+# PVs) seconds, plus the time to transfer what each server sends at its
+# estimated bandwidth, or at BULK_GET_BANDWIDTH bytes per second until it has
+# one
+BULK_GET_BANDWIDTH = 1e6
+
+# METRICS enables the latency histograms and per-channel counters of each
+# context on creation (see metrics). They can also be enabled at any time
+# with CAContextHandler.enable_metrics(). Also set by PVASYNC_METRICS (0 or 1).
+METRICS = (os.environ.get('PVASYNC_METRICS', '0')
+           not in ('0', 'no', 'false', ''))
+
+# budgets of subscription callbacks (see budgets): a call over
+# CALLBACK_TIME_BUDGET seconds is slow (None, the default, does not time
+# callbacks at all, so only errors count against them), and a callback
+# with CALLBACK_ERROR_LIMIT errors or CALLBACK_SLOW_LIMIT slow calls in a row
+# is quarantined as CALLBACK_QUARANTINE says:
+#   'warn'    - only warn about it
+#   'suspend' - stop calling it, until resumed
+#   'thread'  - call it from a worker thread, off the event loop
+# Also set by PVASYNC_CALLBACK_QUARANTINE. Warnings about each callback are
+# logged at most once every CALLBACK_LOG_INTERVAL seconds.
+CALLBACK_TIME_BUDGET = None
+CALLBACK_ERROR_LIMIT = 10
+CALLBACK_SLOW_LIMIT = 10
+CALLBACK_QUARANTINE = os.environ.get('PVASYNC_CALLBACK_QUARANTINE',
+                                     'warn').lower()
+CALLBACK_LOG_INTERVAL = 10.0
+
+# the workers of a multiproc.CAPool return arrays of at least this many bytes
+# through shared memory, rather than pickling them
+SHARED_MEMORY_MIN_BYTES = 65536
+
+# a recorder.Recorder hands the updates it received to its writer thread
+# every RECORDER_FLUSH_INTERVAL seconds, and starts a new chunk of files for
+# a PV every RECORDER_CHUNK_RECORDS records
+RECORDER_FLUSH_INTERVAL = 1.0
+RECORDER_CHUNK_RECORDS = 100000
+
+# with non-preemptive callbacks, the interval at which libca is polled even
+# when none of its sockets are readable (for search retries and beacons)
+POLL_INTERVAL = 0.1
@@ -1,24 +1,91 @@
+import os
 import time
 import asyncio
 import logging
 import atexit
-import queue
+import collections
 import functools
 import threading
 import ctypes
-import copy
+import concurrent.futures
 from functools import partial
 
+import numpy as np
+
 from . import ca
 from . import dbr
+from . import config
 from . import utils
 from . import cast
 from . import errors
+from .buffers import (BufferPool, MonitorBuffer)
+from .rtt import RoundTripStats
+from .budgets import loop_only
+from .metrics import Metrics
 from .callback_registry import (ChannelCallbackRegistry, ChannelCallbackBase,
                                 _locked as _cb_locked)
 
 logger = logging.getLogger(__name__)
 loop = asyncio.get_event_loop()
+# reusable buffers for the values of get replies
+buffer_pool = BufferPool()
+_pending_futures = {}
+
+# the cached CTRL fields of a channel, and the events which update them
+metadata_fields = ('severity', 'precision', 'units', 'enum_strs',
+                   'upper_disp_limit', 'lower_disp_limit',
+                   'upper_alarm_limit', 'lower_alarm_limit',
+                   'upper_warning_limit', 'lower_warning_limit',
+                   'upper_ctrl_limit', 'lower_ctrl_limit')
+metadata_mask = (dbr.SubscriptionType.DBE_PROPERTY |
+                 dbr.SubscriptionType.DBE_ALARM)
+# the fields of a monitor event which only the TIME and CTRL types carry
+header_fields = metadata_fields + ('timestamp', 'timestamp_ns')
+# the CTRL fields changes to which are posted as DBE_PROPERTY
+property_fields = tuple(key for key in metadata_fields if key != 'severity')
+
+
+def _distinct_mask(ftype):
+    '''The mask bits which updates of type `ftype` show to have changed
+
+    DBE_ALARM, for the STS, TIME and CTRL types (status and severity), and
+    DBE_PROPERTY, for the CTRL types (the control fields). DBE_VALUE and
+    DBE_LOG updates cannot be told apart.
+    '''
+    if ftype in dbr.control_types:
+        return (dbr.SubscriptionType.DBE_ALARM |
+                dbr.SubscriptionType.DBE_PROPERTY)
+    elif ftype != dbr.native_type(ftype):
+        return dbr.SubscriptionType.DBE_ALARM
+    return 0
+
+# what a monitor callback subscribed for (see MonitorCallback.derive)
+MonitorRequest = collections.namedtuple('MonitorRequest', 'mask ftype')
+
+
+class CAFuture(asyncio.Future):
+    def __init__(self):
+        super().__init__()
+        _pending_futures[self] = ctypes.py_object(self)
+
+    @property
+    def py_object(self):
+        return _pending_futures[self]
+
+    def ca_callback_done(self):
+        del _pending_futures[self]
+        # TODO GC will definitely be important... not sure about py_object ref
+        # counting
+
+        # import gc
+        # gc.collect()
+
+        # print('referrers:', )
+        # for i, ref in enumerate(gc.get_referrers(self)):
+        #     info = str(ref)
+        #     if hasattr(ref, 'f_code'):
+        #         info = '[frame] {}'.format(ref.f_code.co_name)
+        #     print(i, '\t', info)
 
 
 class ConnectionCallback(ChannelCallbackBase):
@@ -37,7 +104,7 @@ class ConnectionCallback(ChannelCallbackBase):
         return True
 
     @_cb_locked
-    def add_callback(self, cbid, func, *, oneshot=False):
+    def add_callback(self, cbid, func, *, oneshot=False, request=None):
         # since callbacks are locked on the context throughout this, it's only
         # necessary to check if it's connected prior to adding the callback. if
         # a connection callback comes in somewhere during the process of adding
@@ -50,7 +117,7 @@ class ConnectionCallback(ChannelCallbackBase):
             if oneshot:
                 return
 
-        super().add_callback(cbid, func, oneshot=oneshot)
+        super().add_callback(cbid, func, oneshot=oneshot, request=request)
 
     @_cb_locked
     def process(self, **kwargs):
@@ -68,21 +135,41 @@ class MonitorCallback(ChannelCallbackBase):
         default is (DBE_VALUE | DBE_ALARM)
     ftype : int, optional
         Field type to request, maybe promoted from the native type
+    nbuffers : int, optional
+        For array channels, copy each update into a preallocated ring of this
+        many arrays (see buffers.MonitorBuffer). Callbacks then receive a
+        read-only view of the update and its sequence number, `seq`.
+    coalesce : bool, optional
+        Latest value wins: if updates arrive faster than the event loop
+        delivers them, only the newest pending update is delivered. The
+        number of updates skipped is counted in `dropped`.
+    count : int, optional
+        Number of elements to request, 0 (the default) for the channel's
+        current element count
     '''
     # a monitor can be reused if:
     #   amask = available_mask / atype = available_type
     #   rmask = requested_mask / rtype = requested_type
     #   (amask & rmask) == rmask
     #   rtype == atype or rtype is native_type(atype)
+    # and a new monitor which can serve existing ones replaces them (see
+    # ChannelCallbackRegistry.subscribe). A native request is served by a TIME
+    # or CTRL monitor, dropping the fields it did not ask for. A TIME request
+    # is not served by a CTRL monitor: CTRL updates carry no timestamp.
+    # Otherwise, monitors whose masks differ only by bits which updates show
+    # to have changed (see `_distinct_mask`) are merged into one with the
+    # union of the masks, each callback getting the updates its own mask would
+    # have (see `derive`). Other monitors stay separate subscriptions.
     default_mask = (dbr.SubscriptionType.DBE_VALUE |
                     dbr.SubscriptionType.DBE_ALARM)
     sig = 'monitor'
 
-    def __init__(self, registry, chid, *, mask=default_mask, ftype=None):
+    def __init__(self, registry, chid, *, mask=default_mask, ftype=None,
+                 nbuffers=None, coalesce=False, count=0):
         super().__init__(registry=registry, chid=chid)
 
         if ftype is None:
-            ftype = ca.field_type(chid)
+            ftype = self.context.field_type(chid)
 
         if mask is None:
             mask = self.default_mask
@@ -92,7 +179,23 @@ class MonitorCallback(ChannelCallbackBase):
         self.mask = int(mask)
         self.ftype = int(ftype)
         self.native_type = dbr.native_type(self.ftype)
-        self._hash_tuple = (self.chid, self.mask, self.ftype)
+
+        if self.native_type == dbr.ChannelType.STRING:
+            # string arrays are always unpacked to lists
+            nbuffers = None
+
+        self.nbuffers = nbuffers
+        self.buffer = None
+        self.coalesce = bool(coalesce)
+        self.count = int(count)
+        self.dropped = 0
+        self._hash_tuple = (self.chid, self.mask, self.ftype, self.nbuffers,
+                            self.coalesce, self.count)
+        # mask bits which updates show to have changed (see derive), what
+        # the previous update showed, and what changed since
+        self._distinct = _distinct_mask(self.ftype) & self.mask
+        self._previous = None
+        self._changes = 0
 
         # monitor information for when it's created:
         # python object referencing the callback id
@@ -103,14 +206,116 @@ class MonitorCallback(ChannelCallbackBase):
     def create(self):
         logger.debug('Creating a subscription on %s (ftype=%s mask=%s)',
                      self.pvname, dbr.ChType(self.ftype).name, self.mask)
+        self._create_buffer()
+
         self.evid = ctypes.c_void_p()
         ca_callback = _on_monitor_event.ca_callback
         self.py_handler_id = ctypes.py_object(self.handler_id)
-        ret = ca.libca.ca_create_subscription(self.ftype, 0, self.chid,
+        ret = ca.libca.ca_create_subscription(self.ftype, self.count,
+                                              self.chid,
                                               self.mask, ca_callback,
                                               self.py_handler_id,
                                               ctypes.byref(self.evid))
         ca.PySEVCHK('create_subscription', ret)
+        self.context.request_flush()
+
+    def request(self):
+        return MonitorRequest(self.mask, self.ftype)
+
+    def union(self, other):
+        '''The arguments of a monitor serving both this one and `other`, or
+        None if there is none'''
+        if (self.nbuffers, self.coalesce, self.count) != (other.nbuffers,
+                                                          other.coalesce,
+                                                          other.count):
+            return None
+
+        if self.ftype == other.ftype or self.native_type == other.ftype:
+            ftype = self.ftype
+        elif other.native_type == self.ftype:
+            ftype = other.ftype
+        else:
+            return None
+
+        if self.mask != other.mask:
+            if self.nbuffers is not None:
+                # the previous update is overwritten in the ring of buffers
+                return None
+            elif (self.mask ^ other.mask) & ~_distinct_mask(ftype):
+                # updates of one mask could not be told from the other's
+                return None
+
+        return dict(mask=self.mask | other.mask, ftype=ftype,
+                    nbuffers=self.nbuffers, coalesce=self.coalesce,
+                    count=self.count)
+
+    def _event_changes(self, kwargs):
+        '''The mask bits which could have triggered an update
+
+        Updates do not say what triggered them: compare them with the
+        previous one. If no alarm or property field changed, the update was
+        posted for the other bits of the mask, and 0 is returned (as for the
+        first update). Only then is the value compared, which is kept by
+        reference: without buffers, updates are not reused.
+        '''
+        ST = dbr.SubscriptionType
+        value = kwargs.get('value', None)
+        alarm = properties = None
+        if self._distinct & ST.DBE_ALARM:
+            alarm = (kwargs.get('status', None), kwargs.get('severity', None))
+        if self._distinct & ST.DBE_PROPERTY:
+            properties = tuple(kwargs.get(key, None)
+                               for key in property_fields)
+
+        previous, self._previous = self._previous, (value, alarm, properties)
+        if previous is None:
+            return 0
+
+        prev_value, prev_alarm, prev_properties = previous
+        changes = 0
+        if alarm != prev_alarm:
+            changes |= ST.DBE_ALARM
+        if properties != prev_properties:
+            changes |= ST.DBE_PROPERTY
+        if not changes:
+            return 0
+
+        try:
+            if isinstance(value, np.ndarray):
+                same = np.array_equal(value, prev_value)
+            else:
+                same = bool(value == prev_value)
+        except (TypeError, ValueError):
+            same = False
+        if not same:
+            changes |= ST.DBE_VALUE | ST.DBE_LOG
+        return changes
+
+    def derive(self, request, kwargs):
+        '''The update a callback asked for, from this monitor's
+
+        None, if it would not have been posted for the callback's mask. The
+        native type update is derived from that of the TIME or CTRL type.
+        '''
+        if (request.mask != self.mask and self._changes and
+                not (self._changes & request.mask)):
+            return None
+
+        if request.ftype == self.ftype:
+            return kwargs
+
+        event = {key: value for key, value in kwargs.items()
+                 if key not in header_fields}
+        event['ftype'] = request.ftype
+        # (the TIME types' alarm status replaced that of the request)
+        event['status'] = dbr.ECA.NORMAL
+        return event
+
+    def _create_buffer(self):
+        if self.nbuffers is not None:
+            dtype = cast.native_dtype(self.native_type)
+            count = self.count or self.context.element_count(self.chid)
+            self.buffer = MonitorBuffer(dtype, count, nslots=self.nbuffers)
 
     def destroy(self):
         logger.debug('Clearing subscription on %s (ftype=%s mask=%s) evid=%s',
@@ -136,6 +341,26 @@ class MonitorCallback(ChannelCallbackBase):
             self.py_handler_id = None
             self.evid = None
 
+    @_cb_locked
+    def process(self, **kwargs):
+        if self.buffer is not None:
+            seq = kwargs['seq']
+            if not self.buffer.valid(seq):
+                # overwritten before it could be delivered; this was counted
+                # as an overrun when the newer update was written
+                return
+            self.buffer.mark_delivered(seq)
+
+        if self._distinct and self.buffer is None and any(
+                request.mask != self.mask
+                for request in self.requests.values()):
+            self._changes = self._event_changes(kwargs)
+        else:
+            self._previous = None
+            self._changes = 0
+
+        return super().process(**kwargs)
+
     def __repr__(self):
         return ('{0.__class__.__name__}(chid={0.chid}, mask={0.mask:04b}, '
                 'ftype={0.ftype})'.format(self))
@@ -160,26 +385,93 @@ class MonitorCallback(ChannelCallbackBase):
         has_req_mask = (other.mask & self.mask) == other.mask
         type_ok = ((self.ftype == other.ftype) or
                    (self.native_type == other.ftype))
-        return has_req_mask and type_ok
+        delivery_ok = (self.nbuffers == other.nbuffers and
+                       self.coalesce == other.coalesce and
+                       self.count == other.count)
+        return has_req_mask and type_ok and delivery_ok
 
 
 def _in_context(func):
-    '''Ensure function is executed in the correct CA context'''
+    '''Ensure function is executed in the correct CA context
+
+    A thread is attached to one context at a time (libca refuses to attach
+    another with ECA_ISATTACHED), so the current one is detached first.
+    '''
     @functools.wraps(func)
     def inner(self, *args, **kwargs):
-        if ca.current_context() != self._ctx:
-            ca.attach_context(self._ctx)
+        current = ca.current_context()
+        if current != self._ctx:
+            if current:
+                ca.detach_context()
+            ca.PySEVCHK('attach_context', ca.attach_context(self._ctx))
         return func(self, *args, **kwargs)
 
     return inner
 
 
+class DeliveryStats:
+    '''Counters for the hand-off of events from libca to the event loop
+
+    Queue wait is the time from an event being queued on the libca callback
+    thread until its batch is dispatched on the event loop.
+    '''
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.batches = 0
+        self.events = 0
+        self.max_batch_size = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, batch_size, total_wait, max_wait):
+        self.batches += 1
+        self.events += batch_size
+        self.total_wait += total_wait
+        if batch_size > self.max_batch_size:
+            self.max_batch_size = batch_size
+        if max_wait > self.max_wait:
+            self.max_wait = max_wait
+
+    @classmethod
+    def combined(cls, stats):
+        '''The counters of several contexts, added together'''
+        total = cls()
+        for other in stats:
+            total.batches += other.batches
+            total.events += other.events
+            total.total_wait += other.total_wait
+            total.max_batch_size = max(total.max_batch_size,
+                                       other.max_batch_size)
+            total.max_wait = max(total.max_wait, other.max_wait)
+        return total
+
+    def snapshot(self):
+        batches = max(self.batches, 1)
+        events = max(self.events, 1)
+        return dict(batches=self.batches,
+                    events=self.events,
+                    mean_batch_size=self.events / batches,
+                    max_batch_size=self.max_batch_size,
+                    mean_queue_wait=self.total_wait / events,
+                    max_queue_wait=self.max_wait,
+                    )
+
+
 class CAContextHandler:
+    # the Channel Access implementation: libca, through ctypes
+    backend = 'libca'
     # Default mask for subscriptions (means update on value changes exceeding
     # MDEL, and on alarm level changes.) Other option is DBE_LOG for archive
     # changes (ie exceeding ADEL)
     default_mask = (dbr.SubscriptionType.DBE_VALUE |
                     dbr.SubscriptionType.DBE_ALARM)
+    # maximum number of events handed to the event loop in one callback
+    event_batch_size = 4096
+    callback_classes = {'connection': ConnectionCallback,
+                        'monitor': MonitorCallback,
+                        }
 
     def __init__(self, ctx):
         self._sub_lock = threading.RLock()
@@ -188,19 +480,70 @@ class CAContextHandler:
         self._ctx = ctx
         self._loop = asyncio.get_event_loop()
         self._tasks = None
-        self._event_queue = queue.Queue()
-
-        callback_classes = {'connection': ConnectionCallback,
-                            'monitor': MonitorCallback
-                            }
-        self._cbreg = ChannelCallbackRegistry(self, callback_classes)
+        # runs the poll and event queue threads of the thread driver
+        self._executor = None
+
+        # 'thread' - libca is polled by executor threads
+        # 'selector' - libca's sockets are watched by the event loop
+        if config.PREEMPTIVE_CALLBACK:
+            self.driver = 'thread'
+        else:
+            self.driver = 'selector'
+
+        self._fds = set()
+        self._fd_handler = None
+        self._poll_timer = None
+        self._flush_pending = False
+        self._event_queue = collections.deque()
+        self._event_ready = threading.Event()
+        self.delivery_stats = DeliveryStats()
+        # round-trip time and bandwidth estimates, by server host name
+        self.round_trips = RoundTripStats()
+        # latency histograms and per-channel counters; None when disabled
+        self.metrics = None
+        if config.METRICS:
+            self.enable_metrics()
+        # latest pending event of each coalescing subscription, by handler id
+        self._coalesced = {}
+        self._coalesce_lock = threading.Lock()
+
+        self._cbreg = ChannelCallbackRegistry(self,
+                                              dict(self.callback_classes))
         self.channel_to_pv = {}
         self.pv_to_channel = {}
         self.ch_monitors = {}
         self.evid = {}
+        # CTRL fields by channel, the futures of their first update, and the
+        # number of users and callback ids of the subscriptions keeping them
+        # current (see track_metadata)
+        self._metadata = {}
+        self._metadata_futures = {}
+        self._metadata_users = {}
+        self._metadata_cbids = {}
 
     def add_event(self, type_, info):
-        self._event_queue.put((type_, info), block=False)
+        if type_ == 'monitor':
+            handler_id = info['handler_id']
+            handler = self._cbreg.handlers.get(handler_id, None)
+            if handler is not None and handler.coalesce:
+                with self._coalesce_lock:
+                    pending = handler_id in self._coalesced
+                    self._coalesced[handler_id] = info
+
+                if pending:
+                    # replaced the update already waiting in the queue
+                    handler.dropped += 1
+                    return
+
+                # the queue holds a placeholder; the latest update is picked
+                # up when it is dispatched
+                type_, info = 'coalesced', handler_id
+
+        self._event_queue.append((type_, info, time.monotonic()))
+        # the event thread clears the flag before draining the queue, so this
+        # event is either drained in that pass or wakes the next one
+        if not self._event_ready.is_set():
+            self._event_ready.set()
 
     def create_channel(self, pvname, *, callback=None):
         try:
@@ -209,17 +552,8 @@ class CAContextHandler:
             pass
 
         with self._sub_lock:
-            chid = dbr.chid_t()
-            ret = ca.libca.ca_create_channel(pvname.encode('ascii'),
-                                             _on_connection_event.ca_callback,
-                                             0, 0, ctypes.byref(chid))
-
-            ca.PySEVCHK('create_channel', ret)
-
-            chid = ca.channel_id_to_int(chid)
-
-            self.channel_to_pv[chid] = pvname
-            self.pv_to_channel[pvname] = chid
+            chid = self._add_channel(pvname)
+            self.request_flush()
 
             if callback is not None:
                 self.subscribe(sig='connection', chid=chid, func=callback,
@@ -227,10 +561,71 @@ class CAContextHandler:
 
         return chid
 
+    def create_channels(self, pvnames, *, callback=None):
+        '''Create the channels of many PVs at once
+
+        All of the channels are created under one acquisition of the
+        subscription lock, and their searches sent with a single flush.
+
+        Parameters
+        ----------
+        pvnames : list of str
+            PV names; the channels of those already created are reused
+        callback : callable, optional
+            Subscribed, as a oneshot connection callback, once to each of the
+            distinct channels
+
+        Returns
+        -------
+        chids : list
+            channel IDs, in the order of `pvnames`
+        '''
+        chids = []
+        with self._sub_lock:
+            pv_to_channel = self.pv_to_channel
+            for pvname in pvnames:
+                chid = pv_to_channel.get(pvname, None)
+                if chid is None:
+                    chid = self._add_channel(pvname)
+                chids.append(chid)
+
+            self.request_flush()
+            if callback is not None:
+                for chid in set(chids):
+                    self.subscribe(sig='connection', chid=chid, func=callback,
+                                   oneshot=True)
+
+        return chids
+
+    @_in_context
+    def _add_channel(self, pvname):
+        '''Create a channel (with the subscription lock held)
+
+        Its search is sent on the next flush.
+        '''
+        chid = dbr.chid_t()
+        ret = ca.libca.ca_create_channel(pvname.encode('ascii'),
+                                         _on_connection_event.ca_callback,
+                                         0, 0, ctypes.byref(chid))
+
+        ca.PySEVCHK('create_channel', ret)
+
+        chid = ca.channel_id_to_int(chid)
+
+        self.channel_to_pv[chid] = pvname
+        self.pv_to_channel[pvname] = chid
+        return chid
+
     def clear_channel(self, pvname):
         with self._sub_lock:
             chid = self.pv_to_channel.pop(pvname)
             del self.channel_to_pv[chid]
+            self._metadata.pop(chid, None)
+            self._metadata_users.pop(chid, None)
+            self._metadata_cbids.pop(chid, None)
+            future = self._metadata_futures.pop(chid, None)
+            if future is not None:
+                future.cancel()
 
             # TODO: investigate segfault
             # ca.clear_channel(chid)
@@ -250,13 +645,221 @@ class CAContextHandler:
     def unsubscribe(self, cid):
         self._cbreg.unsubscribe(cid)
 
-    def _queue_loop(self, q):
-        ca.attach_context(self._ctx)
-        while self._running:
-            try:
-                yield q.get(block=True, timeout=0.1)
-            except queue.Empty:
-                pass
+    def subscription(self, cbid):
+        '''The subscription handler which owns callback id `cbid`'''
+        return self._cbreg.cbid_owner[cbid]
+
+    def monitor_buffer(self, handler_id):
+        '''The MonitorBuffer of a subscription, if it has one
+
+        This is called on the libca callback thread.
+        '''
+        handler = self._cbreg.handlers.get(handler_id, None)
+        return getattr(handler, 'buffer', None)
+
+    def subscribe_metadata(self, chid, func):
+        '''Subscribe `func` to updates of a channel's CTRL fields
+
+        All subscribers share one subscription (for the first element only),
+        on property changes (DBE_PROPERTY: units, limits, enum strings, ...)
+        and alarm changes, so that the severity stays current too. The
+        channel must be connected.
+
+        Returns
+        -------
+        handler, cbid
+            as from `subscribe`
+        '''
+        ftype = dbr.promote_type(self.field_type(chid), use_ctrl=True)
+        return self.subscribe(sig='monitor', func=func, chid=chid,
+                              ftype=ftype, mask=metadata_mask, count=1)
+
+    def track_metadata(self, chid):
+        '''Keep the CTRL fields of a connected channel cached
+
+        The cache is filled by the first update of the subscription (as the
+        server sends the current fields on subscribing) and kept current from
+        then on, so that `metadata` needs no network I/O. Every call must be
+        paired with one of `untrack_metadata`, which drops the subscription
+        once the last user is done with it.
+
+        Returns
+        -------
+        future : asyncio.Future
+            done, with the fields, once the cache is filled
+        '''
+        chid = ca.channel_id_to_int(chid)
+        with self._sub_lock:
+            users = self._metadata_users.get(chid, 0)
+            if not users:
+                self._metadata_futures[chid] = asyncio.Future(loop=self._loop)
+                handler, meta_cbid = self.subscribe_metadata(
+                    chid, self._metadata_update)
+                handler, conn_cbid = self.subscribe(
+                    sig='connection', chid=chid,
+                    func=self._metadata_connection)
+                self._metadata_cbids[chid] = (meta_cbid, conn_cbid)
+            self._metadata_users[chid] = users + 1
+            return self._metadata_futures[chid]
+
+    def untrack_metadata(self, chid):
+        '''Release the CTRL fields of a channel, kept by `track_metadata`
+
+        Once every user has released them, the subscriptions are removed
+        (clearing the channel, if nothing else subscribes to it) and the
+        cache dropped.
+        '''
+        chid = ca.channel_id_to_int(chid)
+        with self._sub_lock:
+            users = self._metadata_users.pop(chid) - 1
+            if users:
+                self._metadata_users[chid] = users
+                return
+
+            self._metadata.pop(chid, None)
+            future = self._metadata_futures.pop(chid, None)
+            if future is not None:
+                future.cancel()
+            for cbid in self._metadata_cbids.pop(chid):
+                self.unsubscribe(cbid)
+
+    def metadata_future(self, chid):
+        '''The future of the cached CTRL fields of a channel, or None if they
+        are not tracked
+
+        See `track_metadata`.
+        '''
+        return self._metadata_futures.get(ca.channel_id_to_int(chid), None)
+
+    def metadata(self, chid):
+        '''The cached CTRL fields of a channel, or None if not (yet) cached
+
+        See `track_metadata`.
+        '''
+        return self._metadata.get(ca.channel_id_to_int(chid), None)
+
+    @loop_only
+    def _metadata_update(self, chid=None, **kwargs):
+        info = {key: kwargs[key] for key in ('status',) + metadata_fields
+                if key in kwargs}
+        self._metadata[chid] = info
+        future = self._metadata_futures.get(chid, None)
+        if future is not None and not future.done():
+            future.set_result(info)
+
+    @loop_only
+    def _metadata_connection(self, chid=None, pvname=None, connected=None):
+        if not connected:
+            # refilled by the subscription's first update on reconnection
+            self._metadata.pop(chid, None)
+            future = self._metadata_futures.get(chid, None)
+            if future is not None and future.done():
+                self._metadata_futures[chid] = asyncio.Future(loop=self._loop)
+
+    # Channel information and requests. PV and the coroutines only reach a
+    # channel through these, so that a context handler may implement them
+    # without libca (see ca_client).
+    def field_type(self, chid):
+        return ca.field_type(chid)
+
+    def element_count(self, chid):
+        return ca.element_count(chid)
+
+    def host_name(self, chid):
+        return ca.host_name(chid)
+
+    def access(self, chid):
+        return ca.access(chid)
+
+    def read_access(self, chid):
+        return ca.read_access(chid)
+
+    def write_access(self, chid):
+        return ca.write_access(chid)
+
+    def is_connected(self, chid):
+        return ca.is_connected(chid)
+
+    def enable_metrics(self):
+        '''Start recording latencies and counting events (see metrics)'''
+        if self.metrics is None:
+            self.metrics = Metrics()
+        return self.metrics
+
+    def disable_metrics(self):
+        '''Stop recording metrics, discarding those recorded'''
+        self.metrics = None
+
+    def metrics_snapshot(self):
+        '''The metrics recorded so far, as a dictionary (None if disabled)'''
+        metrics = self.metrics
+        if metrics is None:
+            return None
+        return metrics.snapshot()
+
+    def callback_health(self):
+        '''The calls, errors, slow calls and state of every callback, by
+        callback id (see budgets)'''
+        return self._cbreg.callback_health()
+
+    def suspend_callback(self, cbid):
+        '''Stop calling a callback, until resumed'''
+        self._cbreg.set_callback_state(cbid, 'suspended', 'manual')
+
+    def offload_callback(self, cbid):
+        '''Call a callback from a worker thread, off the event loop'''
+        self._cbreg.set_callback_state(cbid, 'threaded', 'manual')
+
+    def resume_callback(self, cbid):
+        '''Call a suspended or threaded callback on the event loop again'''
+        self._cbreg.set_callback_state(cbid, 'active')
+
+    def subscription_count(self):
+        '''The number of active subscription handlers'''
+        return len(self._cbreg.handlers)
+
+    def queued_events(self):
+        '''The number of events queued for the event loop'''
+        return len(self._event_queue)
+
+    def pending_requests(self):
+        '''The number of get and put requests awaiting their reply'''
+        return len(_pending_futures)
+
+    def _track_request(self, kind, chid, future):
+        pvname = self.channel_to_pv.get(ca.channel_id_to_int(chid))
+        self.metrics.track_request(kind, pvname, future)
+
+    def get_request(self, chid, ftype, count):
+        '''Queue a get request for a channel, returning its future
+
+        The future's result is [header, values], as from `cast.copy_args`.
+        The request is sent on the next flush, so that many requests can be
+        queued and sent together.
+        '''
+        future = _ca_get_request(chid, ftype, count)
+        if self.metrics is not None:
+            self._track_request('get', chid, future)
+        self.request_flush()
+        return future
+
+    def put_request(self, chid, value, *, wait=True):
+        '''Queue a put request for a channel
+
+        If `wait` is set, the put is requested with a completion callback and
+        its future is returned. Otherwise, a plain put is queued and None is
+        returned. The request is sent on the next flush.
+        '''
+        future = _ca_put_request(chid, value, wait=wait)
+        if future is not None and self.metrics is not None:
+            self._track_request('put', chid, future)
+        self.request_flush()
+        return future
+
+    @_in_context
+    def flush(self):
+        '''Send all queued requests now'''
+        ca.flush_io()
 
     @asyncio.coroutine
     def connect_channel(self, chid, timeout=1.0):
@@ -281,15 +884,66 @@ class CAContextHandler:
         yield from asyncio.wait_for(fut, timeout=timeout)
 
     def _event_queue_loop(self):
+        '''Hand batches of events to the event loop (in an executor thread)
+
+        All pending events are drained at once, and the loop is woken once
+        per batch.
+        '''
+        ca.attach_context(self._ctx)
         loop = self._loop
-        for event_type, info in self._queue_loop(self._event_queue):
-            with self._sub_lock:
+        queue = self._event_queue
+        ready = self._event_ready
+        batch_size = self.event_batch_size
+
+        while self._running:
+            if not ready.wait(0.1):
+                continue
+
+            ready.clear()
+            batch = []
+            try:
+                while len(batch) < batch_size:
+                    batch.append(queue.popleft())
+            except IndexError:
+                pass
+            else:
+                # more events are pending
+                ready.set()
+
+            if batch:
+                loop.call_soon_threadsafe(self._process_batch, batch)
+
+    def _process_batch(self, batch):
+        '''Dispatch a batch of events to their callbacks (on the event loop)'''
+        now = time.monotonic()
+        total_wait = 0.0
+        events = []
+        metrics = self.metrics
+        with self._sub_lock:
+            for event_type, info, queued_at in batch:
+                total_wait += now - queued_at
+                if metrics is not None:
+                    metrics.record('queue_wait', now - queued_at)
+                if event_type == 'coalesced':
+                    with self._coalesce_lock:
+                        info = self._coalesced.pop(info, None)
+                    if info is None:
+                        continue
+                    event_type = 'monitor'
+
                 chid = info.pop('chid')
-                pvname = self.channel_to_pv[chid]
-                loop.call_soon_threadsafe(partial(self._cbreg.process,
-                                                  event_type, chid,
-                                                  pvname=pvname,
-                                                  **info))
+                try:
+                    info['pvname'] = self.channel_to_pv[chid]
+                except KeyError:
+                    # channel cleared since the event was queued
+                    continue
+                if metrics is not None:
+                    metrics.count_event(info['pvname'])
+                events.append((event_type, chid, info))
+
+            self.delivery_stats.record(len(batch), total_wait,
+                                       now - batch[0][2])
+            self._cbreg.process_batch(events)
 
     @_in_context
     def _poll_thread(self):
@@ -304,16 +958,87 @@ class CAContextHandler:
             ca.detach_context()
             logger.debug('%s event poll thread exiting', self)
 
+    def _on_fd_registration(self, arg, fd, opened):
+        '''libca opened or closed a file descriptor (selector driver)'''
+        try:
+            if opened:
+                self._fds.add(fd)
+                self._loop.add_reader(fd, self._poll)
+            else:
+                self._fds.discard(fd)
+                self._loop.remove_reader(fd)
+        except Exception as ex:
+            logger.error('Failed to update libca file descriptor %d',
+                         fd, exc_info=ex)
+
+    @_in_context
+    def _poll(self):
+        '''Poll libca and dispatch its events (on the event loop)
+
+        With the selector driver, libca callbacks run in this call (in the
+        event loop thread), and only queue their events. Those are dispatched
+        once libca returns.
+        '''
+        self._flush_pending = False
+        ca.poll()
+
+        queue = self._event_queue
+        while queue:
+            batch = []
+            try:
+                while len(batch) < self.event_batch_size:
+                    batch.append(queue.popleft())
+            except IndexError:
+                pass
+            self._process_batch(batch)
+
+    def _poll_tick(self):
+        '''Periodic poll, for libca timers (selector driver)'''
+        if not self._running:
+            return
+
+        self._poll()
+        self._poll_timer = self._loop.call_later(config.POLL_INTERVAL,
+                                                 self._poll_tick)
+
+    def request_flush(self):
+        '''Ask for queued requests to be sent
+
+        With the thread driver, the poll thread sends them. With the selector
+        driver, one flush is scheduled per event loop iteration.
+        '''
+        if self.driver == 'selector' and not self._flush_pending:
+            self._flush_pending = True
+            self._loop.call_soon(self._poll)
+
     def start(self):
         loop = self._loop
-        self._tasks = [loop.run_in_executor(None, self._poll_thread),
-                       loop.run_in_executor(None, self._event_queue_loop),
+        if self.driver == 'selector':
+            self._fd_handler = ca.fd_handler_t(self._on_fd_registration)
+            ca.add_fd_registration(self._fd_handler, None)
+            self._poll_tick()
+            return
+
+        # (threads of their own, so that each context of a pool has its own)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        self._tasks = [loop.run_in_executor(self._executor,
+                                            self._poll_thread),
+                       loop.run_in_executor(self._executor,
+                                            self._event_queue_loop),
                        ]
 
     @_in_context
     def stop(self):
         self._running = False
 
+        if self._poll_timer is not None:
+            self._poll_timer.cancel()
+            self._poll_timer = None
+
+        for fd in list(self._fds):
+            self._loop.remove_reader(fd)
+        self._fds.clear()
+
         if self._tasks:
             for task in self._tasks:
                 logger.debug('Stopping task %s', task)
@@ -321,10 +1046,15 @@ class CAContextHandler:
                     self._loop.run_until_complete(task)
             del self._tasks[:]
 
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
         for chid, pvname in list(self.channel_to_pv.items()):
             logger.debug('Destroying channel %s (%d)', pvname, chid)
             self.clear_channel(pvname)
 
+        self._cbreg.shutdown()
         ca.flush_io()
         ca.detach_context()
 
@@ -340,22 +1070,38 @@ class CAContexts:
         CAContexts.instance = self
 
         self.running = True
+        # (a forked process has to start over, see multiproc)
+        self.pid = os.getpid()
         self.contexts = {}
+        # with a pool, channels are spread over several contexts (see pool)
+        self.pool = None
+        # replaying a recording in place of Channel Access (see replay)
+        self.replay = None
         self.add_context()
+        if config.CONTEXT_POOL_SIZE > 1:
+            self.create_pool()
         atexit.register(self.stop)
 
     def __iter__(self):
         yield from self.contexts.items()
 
     def add_context(self, ctx=None):
-        if ctx is None:
-            ctx = ca.current_context()
+        if config.CA_BACKEND == 'asyncio':
+            # a single context, which does not load libca
+            from .ca_client import AsyncioContextHandler
+            handler_class = AsyncioContextHandler
+            if ctx is None:
+                ctx = 0
+        else:
+            handler_class = CAContextHandler
+            if ctx is None:
+                ctx = ca.current_context()
 
         ctx_id = int(ctx)
         if ctx_id in self.contexts:
             return self.contexts[ctx_id]
 
-        handler = CAContextHandler(ctx=ctx)
+        handler = handler_class(ctx=ctx)
         self.contexts[ctx_id] = handler
         handler.start()
         return handler
@@ -363,11 +1109,79 @@ class CAContexts:
     def __getitem__(self, ctx):
         return self.add_context(ctx)
 
+    def _new_ctx(self):
+        '''A new CA context, not attached to this thread'''
+        if config.CA_BACKEND == 'asyncio':
+            return max(self.contexts) + 1
+        return ca.new_context()
+
+    def create_pool(self, size=None, *, shard=None):
+        '''Spread the channels created from now on over several contexts
+
+        The current context is the first of the pool, and the others are
+        created. From then on, `get_current_context` returns the pool.
+
+        Parameters
+        ----------
+        size : int, optional
+            the number of contexts (default: config.CONTEXT_POOL_SIZE)
+        shard : {'hash', 'prefix'} or callable, optional
+            how PV names are assigned to contexts (default:
+            config.CONTEXT_POOL_SHARD, see pool.ContextPool)
+        '''
+        from .pool import ContextPool
+
+        if self.pool is not None:
+            raise RuntimeError('A context pool was already created')
+        if size is None:
+            size = config.CONTEXT_POOL_SIZE
+        if shard is None:
+            shard = config.CONTEXT_POOL_SHARD
+
+        contexts = [self.add_context()]
+        for i in range(1, size):
+            contexts.append(self.add_context(self._new_ctx()))
+
+        self.pool = ContextPool(contexts, shard=shard)
+        return self.pool
+
+    def start_replay(self, recording):
+        '''Replay a recording in place of Channel Access
+
+        From then on, `get_current_context` returns the replay context, so
+        that new PVs and channels are those of the recording (until
+        `stop_replay`).
+
+        Parameters
+        ----------
+        recording : recorder.Recording or str
+            the recording, or its directory
+
+        Returns
+        -------
+        handler : replay.ReplayContextHandler
+        '''
+        from .replay import ReplayContextHandler
+
+        if self.replay is not None:
+            raise RuntimeError('A recording is already being replayed')
+
+        self.replay = ReplayContextHandler(recording)
+        self.replay.start()
+        return self.replay
+
+    def stop_replay(self):
+        '''Stop replaying, clearing the channels of the replay'''
+        replay, self.replay = self.replay, None
+        if replay is not None:
+            replay.stop()
+
     def stop(self):
         if not self.running:
             return
 
         self.running = False
+        self.stop_replay()
 
         for ctx_id, context in list(self.contexts.items()):
             context.stop()
@@ -384,6 +1198,13 @@ class CAContexts:
         ctx_id = int(ctx)
         self.contexts[ctx_id].add_event(event_type, info)
 
+    def monitor_buffer(self, ctx, handler_id):
+        if not self.running:
+            return None
+
+        ctx_id = int(ctx)
+        return self.contexts[ctx_id].monitor_buffer(handler_id)
+
 
 def get_contexts():
     '''The global context handler'''
@@ -392,6 +1213,12 @@ def get_contexts():
 
 
 def get_current_context():
+    '''The handler of the current context, or the context pool if any (or
+    the replay context, while replaying)'''
+    if _cm.replay is not None:
+        return _cm.replay
+    if _cm.pool is not None:
+        return _cm.pool
     return _cm[None]
 
 
@@ -448,7 +1275,8 @@ def _on_monitor_event(args):
     global _cm
 
     ctx = ca.current_context()
-    args = cast.cast_monitor_args(args)
+    buffer = _cm.monitor_buffer(ctx, args.usr)
+    args = cast.cast_monitor_args(args, buffer=buffer)
     _cm.add_event(ctx, 'monitor', args)
 
 
@@ -470,13 +1298,59 @@ def _on_get_event(args):
         ex = errors.CASeverityException('get', str(args.status))
         loop.call_soon_threadsafe(future.set_exception, ex)
     else:
-        data = copy.deepcopy(cast.cast_args(args))
-        loop.call_soon_threadsafe(future.set_result, data)
+        data = cast.copy_args(args, buffer_pool)
+        loop.call_soon_threadsafe(_set_get_result, future, data)
 
     # TODO
     # ctypes.pythonapi.Py_DecRef(args.usr)
 
 
+def _set_get_result(future, data):
+    '''Set the result of a get future (on the event loop)'''
+    if future.done():
+        # cancelled or timed out since the reply arrived
+        header, values = data
+        buffer_pool.release(values)
+    else:
+        future.set_result(data)
+
+
+@ca.withConnectedCHID
+def _ca_get_request(chid, ftype, count):
+    future = CAFuture()
+    ret = ca.libca.ca_array_get_callback(ftype, count, chid,
+                                         _on_get_event.ca_callback,
+                                         future.py_object)
+    try:
+        ca.PySEVCHK('get', ret)
+    except Exception:
+        future.ca_callback_done()
+        raise
+
+    return future
+
+
+@ca.withConnectedCHID
+def _ca_put_request(chid, value, *, wait=True):
+    ftype, count, data = cast.get_put_info(chid, value)
+    if not wait:
+        ret = ca.libca.ca_array_put(ftype, count, chid, data)
+        ca.PySEVCHK('put', ret)
+        return None
+
+    future = CAFuture()
+    ret = ca.libca.ca_array_put_callback(ftype, count, chid, data,
+                                         _on_put_event.ca_callback,
+                                         future.py_object)
+    try:
+        ca.PySEVCHK('put', ret)
+    except Exception:
+        future.ca_callback_done()
+        raise
+
+    return future
+
+
 @ca_callback_event
 def _on_put_event(args, **kwds):
     """set put-has-completed for this channel"""
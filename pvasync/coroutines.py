@@ -1,46 +1,22 @@
+import time
 import asyncio
-import ctypes
-import ctypes.util
 
+import numpy as np
 from math import log10
 from functools import partial
+from collections import OrderedDict
 
-from . import ca
 from . import dbr
 from . import config
 from . import context
 from . import cast
-from .ca import (PySEVCHK, withConnectedCHID)
+from .errors import ChannelAccessException
+# the futures of requests in flight
+from .context import (CAFuture, _pending_futures)
 
-_pending_futures = {}
 loop = asyncio.get_event_loop()
 
 
-class CAFuture(asyncio.Future):
-    def __init__(self):
-        super().__init__()
-        _pending_futures[self] = ctypes.py_object(self)
-
-    @property
-    def py_object(self):
-        return _pending_futures[self]
-
-    def ca_callback_done(self):
-        del _pending_futures[self]
-        # TODO GC will definitely be important... not sure about py_object ref
-        # counting
-
-        # import gc
-        # gc.collect()
-
-        # print('referrers:', )
-        # for i, ref in enumerate(gc.get_referrers(self)):
-        #     info = str(ref)
-        #     if hasattr(ref, 'f_code'):
-        #         info = '[frame] {}'.format(ref.f_code.co_name)
-        #     print(i, '\t', info)
-
-
 @asyncio.coroutine
 def _as_string(val, chid, count, ftype):
     '''primitive conversion of value to a string
@@ -50,7 +26,8 @@ def _as_string(val, chid, count, ftype):
     if (ftype in dbr.char_types and count < config.AUTOMONITOR_MAXLENGTH):
         val = ''.join(chr(i) for i in val if i > 0).rstrip()
     elif ftype == dbr.ChannelType.ENUM and count == 1:
-        val = yield from get_enum_strings(chid)[val]
+        enum_strs = yield from get_enum_strings(chid)
+        val = enum_strs[val]
     elif count > 1:
         val = '<array count=%d, type=%d>' % (count, ftype)
 
@@ -58,7 +35,14 @@ def _as_string(val, chid, count, ftype):
     return val
 
 
-@withConnectedCHID
+def _connected_context(chid):
+    '''The current context, raising if the channel is not connected'''
+    ctx = context.get_current_context()
+    if not ctx.is_connected(chid):
+        raise ChannelAccessException('Channel not connected')
+    return ctx
+
+
 @asyncio.coroutine
 def get(chid, ftype=None, count=None, timeout=None, as_string=False,
         as_numpy=True):
@@ -79,17 +63,21 @@ def get(chid, ftype=None, count=None, timeout=None, as_string=False,
     as_numpy : bool
        whether to return the Numerical Python representation
        for array / waveform data.
-    wait : bool
-        whether to wait for the data to be received, or return immediately.
     timeout : float
-        maximum time to wait for data before returning ``None``.
+        maximum time to wait for data before returning ``None``. By default,
+        this is estimated from the round-trip times and bandwidth measured
+        for the channel's server (see `CAContextHandler.round_trips`), or
+        ``1.0 + log10(count)`` before any get to that server has completed.
 
     Returns
     -------
     data : object
-       Normally, the value of the data.  Will return ``None`` if the
-       channel is not connected, `wait=False` was used, or the data
-       transfer timed out.
+       Normally, the value of the data.
+
+    Raises
+    ------
+    ChannelAccessException
+       if the channel is not connected
 
     Notes
     -----
@@ -104,16 +92,7 @@ def get(chid, ftype=None, count=None, timeout=None, as_string=False,
     3. The *as_numpy* option will convert waveform data to be returned as a
     numpy array.  This is only applied if numpy can be imported.
 
-    4. The *wait* option controls whether to wait for the data to be
-    received over the network and actually return the value, or to return
-    immediately after asking for it to be sent.  If `wait=False` (that is,
-    immediate return), the *get* operation is said to be *incomplete*.  The
-    data will be still be received (unless the channel is disconnected)
-    eventually but stored internally, and can be read later with
-    :func:`get_complete`.  Using `wait=False` can be useful in some
-    circumstances.
-
-    5. The *timeout* option sets the maximum time to wait for the data to
+    4. The *timeout* option sets the maximum time to wait for the data to
     be received over the network before returning ``None``.  Such a timeout
     could imply that the channel is disconnected or that the data size is
     larger or network slower than normal.  In that case, the *get*
@@ -122,8 +101,9 @@ def get(chid, ftype=None, count=None, timeout=None, as_string=False,
 
     """
 
+    ctx = _connected_context(chid)
     if ftype is None:
-        ftype = ca.field_type(chid)
+        ftype = ctx.field_type(chid)
     if ftype in (None, -1):
         return None
     if count is None:
@@ -132,42 +112,90 @@ def get(chid, ftype=None, count=None, timeout=None, as_string=False,
         # don't default to the element_count here - let EPICS tell us the size
         # in the _onGetEvent callback
     else:
-        count = min(count, ca.element_count(chid))
-
-    future = CAFuture()
-    ret = ca.libca.ca_array_get_callback(ftype, count, chid,
-                                         context._on_get_event.ca_callback,
-                                         future.py_object)
-    PySEVCHK('get', ret)
+        count = min(count, ctx.element_count(chid))
 
+    host = ctx.host_name(chid)
+    nbytes = _payload_size(ftype, count or ctx.element_count(chid))
     if timeout is None:
-        timeout = 1.0 + log10(max(1, count))
+        timeout = ctx.round_trips.timeout(
+            host, nbytes, default=1.0 + log10(max(1, count)))
 
+    t0 = time.monotonic()
+    future = _get_request(chid, ftype, count)
     try:
         data = yield from asyncio.wait_for(future, timeout=timeout)
     except asyncio.TimeoutError:
         future.cancel()
+        ctx.round_trips.record_timeout(host)
         raise
 
-    promoted_data, ntype_array = data
-    unpacked = cast.unpack(chid, ntype_array, count=count, ftype=ftype,
-                           as_numpy=as_numpy)
+    ctx.round_trips.record(host, time.monotonic() - t0, nbytes)
+
+    value = yield from _unpack_get(chid, data, count=count, ftype=ftype,
+                                   as_string=as_string, as_numpy=as_numpy)
+    return value
+
+
+def _payload_size(ftype, count):
+    '''Size in bytes of the values of a request'''
+    try:
+        itemsize = _itemsizes[ftype]
+    except KeyError:
+        dtype = np.dtype(cast.native_dtype(dbr.native_type(ftype)))
+        itemsize = _itemsizes[ftype] = dtype.itemsize
+    return count * itemsize
+
+
+# element size by field type
+_itemsizes = {}
+
+
+def _bulk_timeout(ctx, nbytes_by_host):
+    '''Default timeout of many get requests sent together
+
+    1.0 + log10(number of requests) seconds, plus the time the slowest
+    server takes to send its payloads: at its estimated bandwidth, or at
+    config.BULK_GET_BANDWIDTH until it has one.
+    '''
+    nrequests = sum(len(sizes) for sizes in nbytes_by_host.values())
+    transfer = 0.0
+    for host, sizes in nbytes_by_host.items():
+        estimate = ctx.round_trips.estimate(host) or {}
+        bandwidth = estimate.get('bandwidth') or config.BULK_GET_BANDWIDTH
+        transfer = max(transfer, sum(sizes) / bandwidth)
+    return 1.0 + log10(max(1, nrequests)) + transfer
+
+
+def _get_request(chid, ftype, count):
+    '''Queue a get request for a channel, returning its future
+
+    The request is not flushed here, so that many requests can be queued and
+    sent together.
+    '''
+    return context.get_current_context().get_request(chid, ftype, count)
+
+
+@asyncio.coroutine
+def _unpack_get(chid, data, count, ftype, as_string, as_numpy):
+    '''Convert the result of a get request to its Python value'''
+    header, values = data
+    if not count or count > len(values):
+        count = len(values)
+
+    unpacked = cast.unpack_values(values, count, dbr.native_type(ftype),
+                                  as_numpy=as_numpy, pool=context.buffer_pool)
 
     if as_string:
         try:
             unpacked = yield from _as_string(unpacked, chid, count, ftype)
         except ValueError:
             pass
-    elif isinstance(unpacked, ctypes.Array) and as_numpy:
-        return cast.to_numpy_array(unpacked, count=len(unpacked),
-                                   ntype=dbr.native_type(ftype))
 
     return unpacked
 
 
-@withConnectedCHID
 @asyncio.coroutine
-def put(chid, value, timeout=30, callback=None, callback_data=None):
+def put(chid, value, timeout=None, callback=None, callback_data=None):
     """sets the Channel to a value, with options to either wait (block) for the
     processing to complete, or to execute a supplied callback function when the
     process has completed.
@@ -178,22 +206,29 @@ def put(chid, value, timeout=30, callback=None, callback_data=None):
         Channel ID
     timeout : float
         maximum time to wait for processing to complete before returning
-        anyway.
+        anyway. By default, config.PUT_PROCESSING_TIMEOUT plus the time
+        estimated for the request itself, from the round-trip times and
+        bandwidth measured for the channel's server.
     callback : ``None`` of callable
         user-supplied function to run when processing has completed.
     """
-
-    ftype, count, data = cast.get_put_info(chid, value)
-    future = CAFuture()
+    ctx = _connected_context(chid)
+    if timeout is None:
+        count = ctx.element_count(chid)
+        if not isinstance(value, str):
+            try:
+                count = min(count, len(value))
+            except TypeError:
+                count = 1
+        nbytes = _payload_size(ctx.field_type(chid), count)
+        timeout = (config.PUT_PROCESSING_TIMEOUT +
+                   ctx.round_trips.timeout(ctx.host_name(chid), nbytes,
+                                           default=0.0))
+
+    future = _put_request(chid, value)
     if callable(callback):
         future.add_done_callback(partial(callback, data=callback_data))
 
-    ret = ca.libca.ca_array_put_callback(ftype, count, chid, data,
-                                         context._on_put_event.ca_callback,
-                                         future.py_object)
-
-    PySEVCHK('put', ret)
-
     try:
         ret = yield from asyncio.wait_for(future, timeout=timeout)
     except asyncio.TimeoutError:
@@ -203,7 +238,19 @@ def put(chid, value, timeout=30, callback=None, callback_data=None):
     return ret
 
 
-@withConnectedCHID
+def _put_request(chid, value, *, wait=True):
+    '''Queue a put request for a channel
+
+    If `wait` is set, the put is requested with a completion callback and its
+    future is returned. Otherwise, a plain put is queued and None is
+    returned. The request is not flushed here, so that many requests can be
+    queued and sent together.
+    '''
+    ctx = context.get_current_context()
+    return ctx.put_request(chid, value, wait=wait)
+
+
+@asyncio.coroutine
 def get_ctrlvars(chid, timeout=5.0):
     """return the CTRL fields for a Channel.
 
@@ -213,49 +260,52 @@ def get_ctrlvars(chid, timeout=5.0):
         *lower_alarm_limit*, upper_warning_limit*, *lower_warning_limit*,
         *upper_ctrl_limit*, *lower_ctrl_limit*
 
+    While a PV of the channel is connected, the fields are cached by the
+    context and kept current by a subscription to property changes (see
+    `CAContextHandler.track_metadata`), and no request is sent.
+
     Notes
     -----
     enum_strs will be a list of strings for the names of ENUM states.
 
     """
-    global _cache
-
-    future = CAFuture()
-    ftype = dbr.promote_type(ca.field_type(chid), use_ctrl=True)
-
-    ret = ca.libca.ca_array_get_callback(ftype, 1, chid,
-                                         context._on_get_event.ca_callback,
-                                         future.py_object)
-
-    PySEVCHK('get_ctrlvars', ret)
-
+    ctx = _connected_context(chid)
+    info = ctx.metadata(chid)
+    if info is not None:
+        return dict(info)
+
+    future = ctx.metadata_future(chid)
+    if future is not None:
+        # tracked, but not yet filled. The future is shared by all callers:
+        # do not cancel it on timeout
+        yield from asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        return dict(future.result())
+
+    ftype = dbr.promote_type(ctx.field_type(chid), use_ctrl=True)
+    future = _get_request(chid, ftype, 1)
     try:
-        ctrl_val, nval = yield from asyncio.wait_for(future, timeout=timeout)
+        ctrl_val, nvals = yield from asyncio.wait_for(future, timeout=timeout)
     except asyncio.TimeoutError:
         future.cancel()
         raise
 
-    if not isinstance(ctrl_val, dbr.ControlTypeBase):
+    context.buffer_pool.release(nvals)
+
+    if getattr(ctrl_val, 'dbr_type', None) != ftype:
         raise RuntimeError('Got back a non-ControlType struct. '
                            'Type: {}'.format(type(ctrl_val)))
 
     return ctrl_val.to_dict()
 
 
-@ca.withConnectedCHID
 @asyncio.coroutine
 def get_timevars(chid, timeout=5.0):
     """returns a dictionary of TIME fields for a Channel.
     This will contain keys of  *status*, *severity*, and *timestamp*.
     """
-    global _cache
-    future = CAFuture()
-    ftype = dbr.promote_type(ca.field_type(chid), use_time=True)
-    ret = ca.libca.ca_array_get_callback(ftype, 1, chid,
-                                         context._on_get_event.ca_callback,
-                                         future.py_object)
-
-    PySEVCHK('get_timevars', ret)
+    ctx = _connected_context(chid)
+    ftype = dbr.promote_type(ctx.field_type(chid), use_time=True)
+    future = _get_request(chid, ftype, 1)
 
     try:
         time_val, nvals = yield from asyncio.wait_for(future, timeout=timeout)
@@ -263,7 +313,9 @@ def get_timevars(chid, timeout=5.0):
         future.cancel()
         raise
 
-    if not isinstance(time_val, dbr.TimeType):
+    context.buffer_pool.release(nvals)
+
+    if getattr(time_val, 'dbr_type', None) not in dbr.time_types:
         raise RuntimeError('Got back a non-TimeType struct. '
                            'Type: {}'.format(type(time_val)))
 
@@ -287,7 +339,8 @@ def get_severity(chid):
 @asyncio.coroutine
 def get_precision(chid):
     """return the precision of a Channel."""
-    if ca.field_type(chid) not in dbr.native_float_types:
+    ctx = context.get_current_context()
+    if ctx.field_type(chid) not in dbr.native_float_types:
         raise ValueError('Not a floating point type')
 
     info = yield from get_ctrlvars(chid)
@@ -298,7 +351,8 @@ def get_precision(chid):
 def get_enum_strings(chid):
     """return list of names for ENUM states of a Channel.  Returns
     None for non-ENUM Channels"""
-    if ca.field_type(chid) != dbr.ChannelType.ENUM:
+    ctx = context.get_current_context()
+    if ctx.field_type(chid) != dbr.ChannelType.ENUM:
         raise ValueError('Not an enum type')
 
     info = yield from get_ctrlvars(chid)
@@ -370,22 +424,359 @@ def cainfo(pvname):
 
 
 @asyncio.coroutine
-def caget_many(pvlist):
-    """# TODO unimplemented
+def _connect_channels(ctx, pvlist, timeout=None, callback=None):
+    '''Create and concurrently connect the channels for a list of PV names
+
+    The channels are created together (see `create_channels`), and their
+    connections counted down by one shared callback, completing a single
+    future.
+
+    Returns
+    -------
+    chids : list
+        channel IDs, in the order of `pvlist`
+    connected : set
+        the channel IDs which connected within `timeout`
+    '''
+    if timeout is None:
+        timeout = config.DEFAULT_CONNECTION_TIMEOUT
+
+    all_done = asyncio.Future()
+    connected_chids = set()
+    # the number of channels yet to connect or fail, set once they exist
+    remaining = [None]
+
+    def connection_update(chid=None, pvname=None, connected=None):
+        if all_done.done():
+            return
+
+        if connected:
+            connected_chids.add(chid)
+        if callback is not None:
+            callback(pvname=pvname, connected=bool(connected))
 
-    get values for a list of PVs
-    This does not maintain PV objects, and works as fast
-    as possible to fetch many values.
+        remaining[0] -= 1
+        if remaining[0] == 0:
+            all_done.set_result(None)
+
+    with ctx._sub_lock:
+        chids = ctx.create_channels(pvlist, callback=connection_update)
+        # (connection callbacks are run on the event loop, so none has run
+        # yet)
+        remaining[0] = len(set(chids))
+
+    if remaining[0]:
+        try:
+            yield from asyncio.wait_for(all_done, timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    return chids, set(connected_chids)
+
+
+@asyncio.coroutine
+def connect_many(pvlist, *, timeout=None, callback=None):
+    """create and connect the channels for a list of PVs
+
+    This is much faster than connecting the channels one by one: every
+    channel is created at once and searched for in as few datagrams as
+    possible, and a single future waits for all of the connections.
+
+    Parameters
+    ----------
+    pvlist : list of str
+        PV names
+    timeout : float, optional
+        maximum time to wait for all channels to connect
+        (default = config.DEFAULT_CONNECTION_TIMEOUT)
+    callback : callable, optional
+        called as callback(pvname=..., connected=...) as each channel
+        connects (or fails to) within `timeout`
+
+    Returns
+    -------
+    connected : OrderedDict
+        whether each PV connected within `timeout`, keyed on PV name in the
+        order of `pvlist`
     """
-    chids, out = [], []
-    for name in pvlist:
-        chids.append(ca.create_channel(name, auto_cb=False))
-    for chid in chids:
-        ca.connect_channel(chid)
-    for chid in chids:
-        get(chid, wait=False)
-    for chid in chids:
-        # out.append(get_complete(chid))
-        # removed, necessary?
-        pass
-    return out
+    ctx = context.get_current_context()
+    pvlist = list(pvlist)
+    chids, connected = yield from _connect_channels(ctx, pvlist, timeout,
+                                                    callback=callback)
+    return OrderedDict((pvname, chid in connected)
+                       for pvname, chid in zip(pvlist, chids))
+
+
+@asyncio.coroutine
+def caget_many(pvlist, *, as_string=False, count=None, as_numpy=True,
+               timeout=None, connection_timeout=None, as_dict=False):
+    """get values for a list of PVs
+
+    This does not maintain PV objects, and works as fast as possible to fetch
+    many values: all channels are created and connected concurrently, then
+    every get request is queued and sent with a single flush.
+
+    Parameters
+    ----------
+    pvlist : list of str
+        PV names
+    as_string : bool, optional
+        whether to return the string representation of the values
+    count : int, optional
+        maximum element count to return for array PVs
+    as_numpy : bool, optional
+        use numpy arrays for array data
+    timeout : float, optional
+        maximum time to wait for all values once the channels are connected
+        (default = 1.0 + log10(number of PVs) seconds, plus the time to
+        transfer the values: see config.BULK_GET_BANDWIDTH)
+    connection_timeout : float, optional
+        maximum time to wait for all channels to connect
+        (default = config.DEFAULT_CONNECTION_TIMEOUT)
+    as_dict : bool, optional
+        return an OrderedDict keyed on PV name instead of a list
+
+    Returns
+    -------
+    values : list or OrderedDict
+        values in the order of `pvlist`. A PV which did not connect or whose
+        get failed or timed out has the exception instance in place of its
+        value, so that a single bad PV does not fail the whole batch.
+    """
+    ctx = context.get_current_context()
+    pvlist = list(pvlist)
+    chids, connected = yield from _connect_channels(ctx, pvlist,
+                                                    connection_timeout)
+
+    values = [None] * len(pvlist)
+    requests = {}
+    # payload sizes of the requests, by server
+    nbytes_by_host = {}
+    for idx, (pvname, chid) in enumerate(zip(pvlist, chids)):
+        if chid not in connected:
+            values[idx] = asyncio.TimeoutError('{} failed to connect'
+                                               ''.format(pvname))
+            continue
+
+        ftype = ctx.field_type(chid)
+        req_count = 0
+        if count is not None:
+            req_count = min(count, ctx.element_count(chid))
+
+        try:
+            future = _get_request(chid, ftype, req_count)
+        except Exception as ex:
+            values[idx] = ex
+        else:
+            requests[future] = (idx, chid, ftype, req_count)
+            nbytes = _payload_size(ftype,
+                                   req_count or ctx.element_count(chid))
+            nbytes_by_host.setdefault(ctx.host_name(chid), []).append(nbytes)
+
+    ctx.flush()
+
+    if requests:
+        if timeout is None:
+            timeout = _bulk_timeout(ctx, nbytes_by_host)
+
+        _, pending = yield from asyncio.wait(list(requests.keys()),
+                                             timeout=timeout)
+        for future in pending:
+            future.cancel()
+
+    for future, (idx, chid, ftype, req_count) in requests.items():
+        # (only ask a future for its exception once it is done: a cancelled
+        # task is not marked as cancelled until it next runs)
+        if not future.done() or future.cancelled():
+            values[idx] = asyncio.TimeoutError('{} get timed out'
+                                               ''.format(pvlist[idx]))
+        elif future.exception() is not None:
+            values[idx] = future.exception()
+        else:
+            values[idx] = yield from _unpack_get(chid, future.result(),
+                                                 count=req_count, ftype=ftype,
+                                                 as_string=as_string,
+                                                 as_numpy=as_numpy)
+
+    if as_dict:
+        return OrderedDict(zip(pvlist, values))
+    return values
+
+
+@asyncio.coroutine
+def get_timevars_many(pvlist, *, timeout=None, connection_timeout=None):
+    """get the TIME fields of a list of PVs, as columns
+
+    The channels are connected and read as with `caget_many`, requesting a
+    single element of each.
+
+    Parameters
+    ----------
+    pvlist : list of str
+        PV names
+    timeout : float, optional
+        maximum time to wait for all replies once the channels are connected
+        (default = 1.0 + log10(number of PVs) seconds)
+    connection_timeout : float, optional
+        maximum time to wait for all channels to connect
+        (default = config.DEFAULT_CONNECTION_TIMEOUT)
+
+    Returns
+    -------
+    columns : OrderedDict
+        numpy arrays in the order of `pvlist`: *status* and *severity*
+        (int16), *timestamp* (datetime64[ns], exact to the nanosecond) and
+        *ok* (bool). A PV which did not connect or whose get failed or timed
+        out is not ok, with a status and severity of -1 and a timestamp of
+        NaT.
+    """
+    ctx = context.get_current_context()
+    pvlist = list(pvlist)
+    chids, connected = yield from _connect_channels(ctx, pvlist,
+                                                    connection_timeout)
+
+    num = len(pvlist)
+    status = np.full(num, -1, dtype=np.int16)
+    severity = np.full(num, -1, dtype=np.int16)
+    # (NaT, as integer nanoseconds)
+    stamps = np.full(num, np.iinfo(np.int64).min, dtype=np.int64)
+    ok = np.zeros(num, dtype=bool)
+
+    requests = {}
+    for idx, chid in enumerate(chids):
+        if chid not in connected:
+            continue
+
+        ftype = dbr.promote_type(ctx.field_type(chid), use_time=True)
+        try:
+            future = _get_request(chid, ftype, 1)
+        except Exception:
+            continue
+        requests[future] = idx
+
+    ctx.flush()
+
+    if requests:
+        if timeout is None:
+            timeout = 1.0 + log10(len(requests))
+
+        _, pending = yield from asyncio.wait(list(requests.keys()),
+                                             timeout=timeout)
+        for future in pending:
+            future.cancel()
+
+    for future, idx in requests.items():
+        if future.cancelled() or future.exception() is not None:
+            continue
+
+        header, values = future.result()
+        context.buffer_pool.release(values)
+        if getattr(header, 'dbr_type', None) not in dbr.time_types:
+            continue
+
+        info = header.to_dict()
+        status[idx] = info['status']
+        severity[idx] = info['severity']
+        stamps[idx] = info['timestamp_ns']
+        ok[idx] = True
+
+    return OrderedDict([('status', status),
+                        ('severity', severity),
+                        ('timestamp', dbr.unix_ns_to_datetime64(stamps)),
+                        ('ok', ok),
+                        ])
+
+
+@asyncio.coroutine
+def caput_many(mapping, *, wait=True, timeout=30.0, connection_timeout=None):
+    """put values to many PVs
+
+    All channels are created and connected concurrently, then every put
+    request is queued and sent with a single flush.
+
+    Parameters
+    ----------
+    mapping : dict or sequence of (pvname, value) pairs
+        values to put, keyed on PV name
+    wait : bool, optional
+        request put-completion callbacks and wait for all of them together.
+        Otherwise, the puts are only sent.
+    timeout : float, optional
+        maximum time to wait for all puts to complete
+    connection_timeout : float, optional
+        maximum time to wait for all channels to connect
+        (default = config.DEFAULT_CONNECTION_TIMEOUT)
+
+    Returns
+    -------
+    status : OrderedDict
+        keyed on PV name, in the order of `mapping`. The status is True if
+        the put completed (or, with `wait=False`, was sent). Otherwise, it is
+        the exception raised for that PV.
+    """
+    ctx = context.get_current_context()
+    if hasattr(mapping, 'items'):
+        mapping = mapping.items()
+
+    pvlist, values = [], []
+    for pvname, value in mapping:
+        pvlist.append(pvname)
+        values.append(value)
+
+    chids, connected = yield from _connect_channels(ctx, pvlist,
+                                                    connection_timeout)
+
+    status = OrderedDict((pvname, None) for pvname in pvlist)
+    for pvname, chid in zip(pvlist, chids):
+        if chid not in connected:
+            status[pvname] = asyncio.TimeoutError('{} failed to connect'
+                                                  ''.format(pvname))
+
+    # enum string values are put by index
+    enum_chids = set(chid for chid, value in zip(chids, values)
+                     if chid in connected and isinstance(value, str) and
+                     ctx.field_type(chid) == dbr.ChannelType.ENUM)
+    if enum_chids:
+        enum_chids = list(enum_chids)
+        enum_strs = yield from asyncio.gather(*(get_enum_strings(chid)
+                                                for chid in enum_chids),
+                                              return_exceptions=True)
+        enum_strs = dict(zip(enum_chids, enum_strs))
+        for idx, (chid, value) in enumerate(zip(chids, values)):
+            strs = enum_strs.get(chid, None)
+            if isinstance(strs, (list, tuple)) and value in strs:
+                values[idx] = strs.index(value)
+
+    requests = {}
+    for pvname, chid, value in zip(pvlist, chids, values):
+        if status[pvname] is not None:
+            continue
+
+        try:
+            future = _put_request(chid, value, wait=wait)
+        except Exception as ex:
+            status[pvname] = ex
+        else:
+            if future is None:
+                status[pvname] = True
+            else:
+                requests[future] = pvname
+
+    ctx.flush()
+
+    if requests:
+        _, pending = yield from asyncio.wait(list(requests.keys()),
+                                             timeout=timeout)
+        for future in pending:
+            future.cancel()
+
+    for future, pvname in requests.items():
+        if future.cancelled():
+            status[pvname] = asyncio.TimeoutError('{} put timed out'
+                                                  ''.format(pvname))
+        elif future.exception() is not None:
+            status[pvname] = future.exception()
+        else:
+            status[pvname] = True
+
+    return status
@@ -40,6 +40,7 @@ MAX_ENUM_STATES = 16
 
 # EPICS2UNIX_EPOCH = 631173600.0 - time.timezone
 EPICS2UNIX_EPOCH = 631152000.0
+EPICS2UNIX_EPOCH_NS = 631152000 * 1000000000
 
 string_t = ctypes.c_char * MAX_STRING_SIZE
 # value_offset is set when the CA library connects, indicating the byte offset
@@ -51,6 +52,8 @@ value_offset = None
 class ECA(IntEnum):
     NORMAL = 1
     TIMEOUT = 80
+    BADTYPE = 114
+    PUTFAIL = 160
     IODONE = 339
     ISATTACHED = 424
     BADCHID = 410
@@ -132,6 +135,27 @@ char_types = (ChType.CHAR, ChType.TIME_CHAR, ChType.CTRL_CHAR)
 native_float_types = (ChType.FLOAT, ChType.DOUBLE)
 
 
+def epics_to_unixtime(secs, nsec):
+    "UNIX timestamp (seconds) from the fields of an Epics TimeStamp"
+    return (EPICS2UNIX_EPOCH + secs + 1.e-6 * int(1.e-3 * nsec))
+
+
+def epics_to_unix_ns(secs, nsec):
+    "UNIX timestamp (integer nanoseconds) from an Epics TimeStamp's fields"
+    return EPICS2UNIX_EPOCH_NS + secs * 1000000000 + nsec
+
+
+def unix_ns_to_datetime64(timestamps):
+    "numpy datetime64[ns] array from UNIX timestamps in integer nanoseconds"
+    return np.asarray(timestamps, dtype=np.int64).view('datetime64[ns]')
+
+
+def unixtime_to_epics(timestamp):
+    "(secs, nsec) of an Epics TimeStamp from a UNIX timestamp (seconds)"
+    secs, frac = divmod(timestamp - EPICS2UNIX_EPOCH, 1)
+    return max(0, int(secs)), int(frac * 1e9)
+
+
 class TimeStamp(ctypes.Structure):
     "emulate epics timestamp"
     _fields_ = [('secs', uint_t),
@@ -140,7 +164,12 @@ class TimeStamp(ctypes.Structure):
     @property
     def unixtime(self):
         "UNIX timestamp (seconds) from Epics TimeStamp structure"
-        return (EPICS2UNIX_EPOCH + self.secs + 1.e-6 * int(1.e-3 * self.nsec))
+        return epics_to_unixtime(self.secs, self.nsec)
+
+    @property
+    def unix_ns(self):
+        "UNIX timestamp (integer nanoseconds) from Epics TimeStamp structure"
+        return epics_to_unix_ns(self.secs, self.nsec)
 
 
 class TimeType(ctypes.Structure):
@@ -150,9 +179,11 @@ class TimeType(ctypes.Structure):
                 ]
 
     def to_dict(self):
+        stamp = self.stamp
         return dict(status=self.status,
                     severity=self.severity,
-                    timestamp=self.stamp.unixtime,
+                    timestamp=stamp.unixtime,
+                    timestamp_ns=stamp.unix_ns,
                     )
 
 
@@ -237,7 +268,8 @@ class ControlTypeBase(ctypes.Structure):
                 ]
 
     def to_dict(self):
-        return dict(severity=self.severity)
+        return dict(status=self.status,
+                    severity=self.severity)
 
 
 class ControlTypeUnits(ControlTypeBase):
@@ -0,0 +1,274 @@
+'''An HTTP endpoint exporting a context's state in Prometheus text format
+
+The exporter serves ``GET /metrics`` on a local TCP port or Unix socket,
+from the event loop of the context it reports on. Each scrape reports:
+
+- the channels of the context, and how many of them are connected
+- the active subscriptions (handlers of the callback registry)
+- the requests in flight (get and put futures not yet resolved)
+- the depth of the event queue, between CA callbacks and the event loop
+- the events and batches dispatched (as counters, to take rates of) and
+  the longest time an event has waited in the queue
+- the event loop's lag: how late a periodic timer runs
+- the errors and slow calls of callbacks, and how many are suspended or
+  moved to a worker thread (see budgets)
+- with metrics enabled on the context (see metrics), its latency
+  histograms
+
+Usage::
+
+    exporter = MetricsExporter(port=9464)
+    yield from exporter.start()
+    ...
+    exporter.stop()
+'''
+import asyncio
+import logging
+
+from .context import get_current_context
+
+
+logger = logging.getLogger(__name__)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# maximum size of a request's headers
+MAX_REQUEST_SIZE = 16384
+
+
+class LoopLag:
+    '''Measures how late the event loop runs a timer, every `interval` s'''
+    def __init__(self, loop, interval=0.5):
+        self.loop = loop
+        self.interval = interval
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.ticks = 0
+        self._handle = None
+
+    def start(self):
+        if self._handle is None:
+            self._schedule()
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _schedule(self):
+        expected = self.loop.time() + self.interval
+        self._handle = self.loop.call_at(expected, self._tick, expected)
+
+    def _tick(self, expected):
+        self.lag = max(0.0, self.loop.time() - expected)
+        if self.lag > self.max_lag:
+            self.max_lag = self.lag
+        self.ticks += 1
+        self._schedule()
+
+
+def _metric(lines, name, type_, help_, value):
+    lines.append('# HELP {} {}'.format(name, help_))
+    lines.append('# TYPE {} {}'.format(name, type_))
+    lines.append('{} {}'.format(name, _format(value)))
+
+
+def _format(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _histogram(lines, name, help_, histogram):
+    lines.append('# HELP {} {}'.format(name, help_))
+    lines.append('# TYPE {} histogram'.format(name))
+    cumulative = 0
+    for edge, count in zip(histogram.bin_edges(), histogram.bins):
+        cumulative += count
+        lines.append('{}_bucket{{le="{!r}"}} {}'.format(name, edge,
+                                                       cumulative))
+    lines.append('{}_bucket{{le="+Inf"}} {}'.format(name, histogram.count))
+    lines.append('{}_sum {}'.format(name, _format(histogram.total)))
+    lines.append('{}_count {}'.format(name, histogram.count))
+
+
+_histogram_help = {
+    'get': 'Time from a get request until its reply',
+    'put': 'Time from a put request until its completion',
+    'queue_wait': 'Time events waited between CA and the event loop',
+    'callback': 'Execution time of subscription callbacks',
+}
+
+
+def render(ctx=None, loop_lag=None):
+    '''The state of a context (by default, the current one) as Prometheus
+    text'''
+    if ctx is None:
+        ctx = get_current_context()
+
+    channels = list(ctx.channel_to_pv)
+    connected = 0
+    for chid in channels:
+        try:
+            connected += bool(ctx.is_connected(chid))
+        except Exception:
+            pass
+
+    stats = ctx.delivery_stats
+    lines = []
+    _metric(lines, 'pvasync_channels', 'gauge',
+            'Channels created by the context', len(channels))
+    _metric(lines, 'pvasync_channels_connected', 'gauge',
+            'Channels currently connected', connected)
+    _metric(lines, 'pvasync_subscriptions', 'gauge',
+            'Active subscription handlers', ctx.subscription_count())
+    _metric(lines, 'pvasync_requests_in_flight', 'gauge',
+            'Get and put requests awaiting their reply',
+            ctx.pending_requests())
+    _metric(lines, 'pvasync_event_queue_depth', 'gauge',
+            'Events queued for the event loop', ctx.queued_events())
+    _metric(lines, 'pvasync_events_total', 'counter',
+            'Events dispatched to callbacks', stats.events)
+    _metric(lines, 'pvasync_event_batches_total', 'counter',
+            'Batches of events dispatched', stats.batches)
+    _metric(lines, 'pvasync_event_queue_wait_max_seconds', 'gauge',
+            'Longest time an event waited in the queue', stats.max_wait)
+
+    callbacks = ctx.callback_health().values()
+    _metric(lines, 'pvasync_callback_errors_total', 'counter',
+            'Exceptions raised by callbacks',
+            sum(health['errors'] for health in callbacks))
+    _metric(lines, 'pvasync_callback_slow_calls_total', 'counter',
+            'Callback calls over their time budget',
+            sum(health['slow_calls'] for health in callbacks))
+    _metric(lines, 'pvasync_callbacks_suspended', 'gauge',
+            'Callbacks suspended',
+            sum(health['state'] == 'suspended' for health in callbacks))
+    _metric(lines, 'pvasync_callbacks_threaded', 'gauge',
+            'Callbacks moved to a worker thread',
+            sum(health['state'] == 'threaded' for health in callbacks))
+
+    if loop_lag is not None:
+        _metric(lines, 'pvasync_loop_lag_seconds', 'gauge',
+                'How late the event loop last ran a timer', loop_lag.lag)
+        _metric(lines, 'pvasync_loop_lag_max_seconds', 'gauge',
+                'Largest event loop lag measured', loop_lag.max_lag)
+
+    metrics = ctx.metrics
+    if metrics is not None:
+        for name, histogram in sorted(metrics.histograms.items()):
+            _histogram(lines, 'pvasync_{}_seconds'.format(name),
+                       _histogram_help.get(name, name), histogram)
+
+    return '\n'.join(lines) + '\n'
+
+
+class _HTTPProtocol(asyncio.Protocol):
+    '''Answers one HTTP request, then closes the connection'''
+    def __init__(self, exporter):
+        self.exporter = exporter
+        self.transport = None
+        self.buffer = bytearray()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.buffer.extend(data)
+        if b'\r\n\r\n' not in self.buffer and b'\n\n' not in self.buffer:
+            if len(self.buffer) > MAX_REQUEST_SIZE:
+                self._respond(431, 'Request Header Fields Too Large')
+            return
+
+        request_line = bytes(self.buffer).split(b'\n', 1)[0]
+        try:
+            method, target = request_line.decode('latin-1').split()[:2]
+        except ValueError:
+            self._respond(400, 'Bad Request')
+            return
+
+        if method not in ('GET', 'HEAD'):
+            self._respond(405, 'Method Not Allowed')
+        elif target.split('?', 1)[0] != self.exporter.path:
+            self._respond(404, 'Not Found')
+        else:
+            try:
+                body = render(self.exporter.context, self.exporter.loop_lag)
+            except Exception as ex:
+                logger.error('Failed to render metrics', exc_info=ex)
+                self._respond(500, 'Internal Server Error')
+            else:
+                self._respond(200, 'OK', body, head=(method == 'HEAD'))
+
+    def _respond(self, status, reason, body=None, head=False):
+        if body is None:
+            body = reason + '\n'
+        body = body.encode('utf-8')
+        header = ('HTTP/1.1 {} {}\r\n'
+                  'Content-Type: {}\r\n'
+                  'Content-Length: {}\r\n'
+                  'Connection: close\r\n\r\n'
+                  ''.format(status, reason, CONTENT_TYPE, len(body)))
+        self.transport.write(header.encode('latin-1'))
+        if not head:
+            self.transport.write(body)
+        self.transport.close()
+
+
+class MetricsExporter:
+    '''Serve a context's state in Prometheus text format
+
+    Parameters
+    ----------
+    context : CAContextHandler, optional
+        context to report on (default: the current one)
+    host : str, optional
+        address to listen on (default: loopback only)
+    port : int, optional
+        TCP port, 0 to pick a free one
+    unix_path : str, optional
+        listen on this Unix socket instead of TCP
+    path : str, optional
+        the HTTP path of the metrics
+    lag_interval : float, optional
+        period of the event loop lag measurement, in seconds
+    '''
+    def __init__(self, context=None, *, host='127.0.0.1', port=9464,
+                 unix_path=None, path='/metrics', lag_interval=0.5):
+        if context is None:
+            context = get_current_context()
+        self.context = context
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.path = path
+        self.loop_lag = LoopLag(context._loop, lag_interval)
+        self._server = None
+
+    @asyncio.coroutine
+    def start(self):
+        '''Start serving, on the context's event loop'''
+        loop = self.context._loop
+        if self.unix_path is not None:
+            self._server = yield from loop.create_unix_server(
+                lambda: _HTTPProtocol(self), self.unix_path)
+        else:
+            self._server = yield from loop.create_server(
+                lambda: _HTTPProtocol(self), self.host, self.port)
+            self.port = self._server.sockets[0].getsockname()[1]
+
+        self.loop_lag.start()
+        logger.info('Exporting metrics on %s', self.address)
+
+    @property
+    def address(self):
+        if self.unix_path is not None:
+            return self.unix_path
+        return 'http://{}:{}{}'.format(self.host, self.port, self.path)
+
+    def stop(self):
+        self.loop_lag.stop()
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
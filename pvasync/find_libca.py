@@ -150,6 +150,10 @@ def initialize_libca():
                                         ctypes.POINTER(ctypes.c_long),
                                         ]
 
+    # int ca_add_fd_registration(CAFDHANDLER *pHandler, void *pArg)
+    libca.ca_add_fd_registration.argtypes = [ctypes.c_void_p,
+                                             ctypes.c_void_p]
+
     libca.ca_name.argtypes    = [dbr.chid_t]
     libca.ca_state.argtypes   = [dbr.chid_t]
     libca.ca_clear_channel.argtypes = [dbr.chid_t]
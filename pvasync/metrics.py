@@ -0,0 +1,148 @@
+'''Latency histograms and per-channel counters of a context
+
+Instrumentation is off by default: the context's `metrics` is None, and
+each instrumented path then costs a single attribute test. Enable it with
+`CAContextHandler.enable_metrics` (or PVASYNC_METRICS=1, see config), and
+read it with `CAContextHandler.metrics_snapshot`.
+
+Recorded latencies, in seconds:
+
+get, put
+    from a request's future being created until it is resolved (not
+    counting those which timed out)
+queue_wait
+    from an event being queued by the CA callback until it is dispatched on
+    the event loop
+callback
+    the execution time of each subscription callback
+
+and, per channel (PV name), the number of events dispatched, of requests
+which timed out (their future was cancelled), and of errors (requests which
+failed and callbacks which raised).
+'''
+import math
+import time
+
+
+class Histogram:
+    '''A histogram with logarithmic (power of 2) bins
+
+    Bin i counts the values in [2 ** (i + min_exponent - 1),
+    2 ** (i + min_exponent)); the values below and above the bins' range are
+    counted in the first and last. With the defaults, that is from under a
+    microsecond to over 2 minutes.
+    '''
+    min_exponent = -20
+    max_exponent = 8
+
+    def __init__(self):
+        self.bins = [0] * (self.max_exponent - self.min_exponent + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+        if value > 0:
+            exponent = min(max(math.frexp(value)[1], self.min_exponent),
+                           self.max_exponent)
+        else:
+            exponent = self.min_exponent
+        self.bins[exponent - self.min_exponent] += 1
+
+    def bin_edges(self):
+        '''The upper edge of each bin'''
+        return [2.0 ** exponent for exponent in
+                range(self.min_exponent, self.max_exponent + 1)]
+
+    def percentile(self, pct):
+        '''The upper edge of the bin holding the pct-th percentile value
+
+        (capped at the maximum value recorded)
+        '''
+        if not self.count:
+            return None
+
+        rank = max(1, math.ceil(self.count * pct / 100))
+        seen = 0
+        for edge, count in zip(self.bin_edges(), self.bins):
+            seen += count
+            if seen >= rank:
+                return min(edge, self.max)
+        return self.max
+
+    def to_dict(self):
+        return dict(count=self.count,
+                    mean=(self.total / self.count if self.count else None),
+                    min=self.min,
+                    max=self.max,
+                    p50=self.percentile(50),
+                    p90=self.percentile(90),
+                    p99=self.percentile(99),
+                    bins={edge: count for edge, count in
+                          zip(self.bin_edges(), self.bins) if count},
+                    )
+
+
+class Metrics:
+    '''The histograms and per-channel counters of a context'''
+    histogram_names = ('get', 'put', 'queue_wait', 'callback')
+
+    def __init__(self):
+        self.started = time.time()
+        self.histograms = {name: Histogram()
+                           for name in self.histogram_names}
+        # PV name to [events, timeouts, errors]
+        self.channels = {}
+
+    def _counters(self, pvname):
+        try:
+            return self.channels[pvname]
+        except KeyError:
+            counters = self.channels[pvname] = [0, 0, 0]
+            return counters
+
+    def count_event(self, pvname):
+        self._counters(pvname)[0] += 1
+
+    def count_timeout(self, pvname):
+        self._counters(pvname)[1] += 1
+
+    def count_error(self, pvname):
+        self._counters(pvname)[2] += 1
+
+    def record(self, name, value):
+        self.histograms[name].record(value)
+
+    def track_request(self, kind, pvname, future):
+        '''Time a get or put request until its future is resolved'''
+        t0 = time.monotonic()
+
+        def resolved(future):
+            if future.cancelled():
+                self.count_timeout(pvname)
+                return
+
+            self.histograms[kind].record(time.monotonic() - t0)
+            if future.exception() is not None:
+                self.count_error(pvname)
+
+        future.add_done_callback(resolved)
+
+    def snapshot(self):
+        return dict(
+            since=self.started,
+            histograms={name: histogram.to_dict()
+                        for name, histogram in self.histograms.items()},
+            channels={pvname: dict(events=events, timeouts=timeouts,
+                                   errors=errors)
+                      for pvname, (events, timeouts, errors)
+                      in self.channels.items()},
+        )
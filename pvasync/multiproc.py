@@ -8,6 +8,12 @@ Channel Access or using Epics process variables
 
    from pvasync import (CAProcess, CAPool)
 
+CAPool splits lists of PVs between its workers, always giving a PV to the
+same worker (by a hash of its name), so that the workers keep their channels
+and monitors from one call to the next. Arrays of at least
+config.SHARED_MEMORY_MIN_BYTES come back from the workers through shared
+memory rather than being pickled.
+
 """
 #
 # Author:         Ken Lauer
@@ -15,13 +21,67 @@ Channel Access or using Epics process variables
 # Modifications:  Matt Newville, changed to subclass multiprocessing.Process
 #                 3/28/2014  KL, added CAPool
 
+import asyncio
+import collections
+import os
+import pickle
+import queue
+import sys
+import zlib
 import multiprocessing as mp
-from multiprocessing.pool import Pool
-from .context import get_contexts
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # (Python < 3.8) large arrays are pickled, like everything else
+    shared_memory = None
+
+from . import (ca, config, context, coroutines, pv, sync)
 
 
 __all__ = ['CAProcess', 'CAPool']
 
+# an array left in shared memory by a worker, for the parent to copy out
+_SharedArray = collections.namedtuple('_SharedArray', 'name dtype shape')
+
+
+def _loop_modules():
+    '''The modules of pvasync which keep the event loop as `loop`'''
+    package = __name__.rpartition('.')[0]
+    for name, module in list(sys.modules.items()):
+        if name != package and not name.startswith(package + '.'):
+            continue
+        if isinstance(getattr(module, 'loop', None),
+                      asyncio.AbstractEventLoop):
+            yield module
+
+
+def _clean_context():
+    '''Discard the event loop and contexts inherited from a parent process
+
+    A forked process has copies of its parent's event loop, CA contexts and
+    libca state, but none of the threads running them: start over with new
+    ones. (A spawned process imports pvasync anew, and has clean ones.)
+    '''
+    if context.get_contexts().pid == os.getpid():
+        return
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    for module in _loop_modules():
+        module.loop = loop
+    sync._loop_thread = None
+
+    ca.libca = None
+    ca.initial_context = None
+    context._pending_futures.clear()
+    pv._PVcache_.clear()
+
+    del context.CAContexts.instance
+    context._cm = context.CAContexts()
+
 
 class CAProcess(mp.Process):
     """
@@ -29,23 +89,291 @@ class CAProcess(mp.Process):
 
     Use CAProcess in place of multiprocessing.Process if your Process will
     be doing CA calls!
+
+    Parameters
+    ----------
+    start_method : {'fork', 'spawn', 'forkserver'}, optional
+        how to start the process (default: that of multiprocessing)
     """
-    def __init__(self, **kws):
-        super().__init__(**kws)
+    def __init__(self, *args, start_method=None, **kws):
+        super().__init__(*args, **kws)
+        self.start_method = start_method
+
+    def _Popen(self, process_obj):
+        return mp.get_context(self.start_method).Process._Popen(process_obj)
 
     def run(self):
-        cm = get_contexts()
-        # TODO this is definitely wrong
-        cm.stop()
-        cm.add_context()
+        _clean_context()
         super().run()
 
 
-class CAPool(Pool):
+def _to_shared(value):
+    '''Move a large array to shared memory, for the parent to copy out'''
+    if (shared_memory is None or not isinstance(value, np.ndarray) or
+            value.nbytes < config.SHARED_MEMORY_MIN_BYTES or
+            value.dtype.hasobject):
+        return value
+
+    shm = shared_memory.SharedMemory(create=True, size=value.nbytes)
+    try:
+        target = np.ndarray(value.shape, value.dtype, buffer=shm.buf)
+        target[...] = value
+        del target
+        return _SharedArray(shm.name, value.dtype.str, value.shape)
+    finally:
+        # (the parent unlinks it, once copied)
+        shm.close()
+
+
+def _from_shared(value):
+    if not isinstance(value, _SharedArray):
+        return value
+
+    shm = shared_memory.SharedMemory(name=value.name)
+    try:
+        return np.ndarray(value.shape, np.dtype(value.dtype),
+                          buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _apply(func, pvname, value):
+    if isinstance(value, Exception):
+        return value
+    try:
+        return func(pvname, value)
+    except Exception as ex:
+        return ex
+
+
+class _Worker:
+    '''What a pool worker keeps between tasks: its channels (in its context)
+    and its monitored PVs'''
+    def __init__(self):
+        self.loop = asyncio.get_event_loop()
+        self.monitors = {}
+
+    @asyncio.coroutine
+    def _read(self, pvnames, as_numpy, timeout, monitor):
+        if not monitor:
+            values = yield from coroutines.caget_many(
+                pvnames, as_numpy=as_numpy, timeout=timeout)
+            return values
+
+        connected = yield from coroutines.connect_many(pvnames,
+                                                       timeout=timeout)
+        values = []
+        for pvname in pvnames:
+            if not connected[pvname]:
+                values.append(asyncio.TimeoutError('{} failed to connect'
+                                                   ''.format(pvname)))
+                continue
+
+            monitored = self.monitors.get(pvname, None)
+            if monitored is None:
+                monitored = self.monitors[pvname] = pv.PV(pvname,
+                                                          auto_monitor=True)
+            try:
+                value = yield from monitored.aget(as_numpy=as_numpy,
+                                                  timeout=timeout)
+            except Exception as ex:
+                value = ex
+            values.append(value)
+        return values
+
+    def snapshot(self, pvnames, as_numpy, timeout, monitor):
+        values = self.loop.run_until_complete(
+            self._read(pvnames, as_numpy, timeout, monitor))
+        return [_to_shared(value) for value in values]
+
+    def map_pvs(self, pvnames, func, as_numpy, timeout, monitor):
+        values = self.loop.run_until_complete(
+            self._read(pvnames, as_numpy, timeout, monitor))
+        return [_to_shared(_apply(func, pvname, value))
+                for pvname, value in zip(pvnames, values)]
+
+
+def _picklable(ex):
+    try:
+        pickle.dumps(ex)
+    except Exception:
+        return RuntimeError(repr(ex))
+    return ex
+
+
+def _worker_main(index, tasks, results, initializer, initargs):
+    '''Run the tasks of one pool worker, until sent None'''
+    if initializer is not None:
+        initializer(*initargs)
+
+    worker = _Worker()
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+
+            task_id, method, args = task
+            try:
+                result = getattr(worker, method)(*args)
+            except Exception as ex:
+                results.put((task_id, index, False, _picklable(ex)))
+            else:
+                results.put((task_id, index, True, result))
+    finally:
+        context.get_contexts().stop()
+
+
+class CAPool:
     """
-    An EPICS-aware multiprocessing.Pool of CAProcesses.
+    A pool of CAProcess workers, which keep their channels between calls
+
+    Each PV is read by the same worker on every call, so that its channel
+    (and, with monitor=True, its subscription) is only set up once.
+
+    Parameters
+    ----------
+    processes : int, optional
+        the number of workers (default: the number of CPUs)
+    initializer : callable, optional
+        called with `initargs` by each worker as it starts
+    initargs : tuple, optional
+    start_method : {'spawn', 'fork', 'forkserver'}, optional
+        how to start the workers. Each starts with a clean context either
+        way, but spawned ones do not inherit anything of the parent's CA
+        state (the default).
     """
-    def __init__(self, *args, **kwargs):
-        self.Process = CAProcess
+    def __init__(self, processes=None, initializer=None, initargs=(), *,
+                 start_method='spawn'):
+        if processes is None:
+            processes = os.cpu_count() or 1
+
+        mp_context = mp.get_context(start_method)
+        self._results = mp_context.Queue()
+        self._task_id = 0
+        self._workers = []
+        for index in range(processes):
+            tasks = mp_context.Queue()
+            worker = CAProcess(target=_worker_main,
+                               args=(index, tasks, self._results, initializer,
+                                     initargs),
+                               start_method=start_method, daemon=True)
+            worker.start()
+            self._workers.append((worker, tasks))
+
+    @property
+    def processes(self):
+        return len(self._workers)
+
+    def worker_of(self, pvname):
+        '''The index of the worker which reads a PV'''
+        return zlib.crc32(pvname.encode('utf-8')) % len(self._workers)
+
+    def _call(self, method, pvnames, *args):
+        '''Call a method of the workers, each with its share of pvnames'''
+        if not self._workers:
+            raise ValueError('Pool not running')
+
+        pvnames = list(pvnames)
+        parts = collections.OrderedDict()
+        for pvname in pvnames:
+            parts.setdefault(self.worker_of(pvname), []).append(pvname)
+
+        self._task_id += 1
+        task_id = self._task_id
+        for index, names in parts.items():
+            self._workers[index][1].put((task_id, method, (names, ) + args))
+
+        values = {}
+        error = None
+        pending = set(parts)
+        while pending:
+            try:
+                task, index, ok, result = self._results.get(timeout=0.5)
+            except queue.Empty:
+                for index in pending:
+                    if not self._workers[index][0].is_alive():
+                        raise RuntimeError('Pool worker {} exited'
+                                           ''.format(index))
+                continue
+
+            if ok:
+                result = [_from_shared(value) for value in result]
+            if task != task_id:
+                # from an earlier call which failed
+                continue
+
+            pending.discard(index)
+            if ok:
+                values.update(zip(parts[index], result))
+            else:
+                error = result
+
+        if error is not None:
+            raise error
+        return collections.OrderedDict((pvname, values[pvname])
+                                       for pvname in pvnames)
+
+    def snapshot(self, pvnames, *, as_numpy=True, timeout=None,
+                 monitor=False):
+        """Read the values of a list of PVs, split between the workers
+
+        Parameters
+        ----------
+        pvnames : list of str
+        as_numpy : bool, optional
+            use numpy arrays for array data
+        timeout : float, optional
+            maximum time for the channels to connect, and for their values
+        monitor : bool, optional
+            subscribe to the PVs, and return the latest values received
+            (without a request, once subscribed)
+
+        Returns
+        -------
+        values : OrderedDict
+            keyed on PV name, in the order of `pvnames`. A PV which did not
+            connect or could not be read has the exception in place of its
+            value.
+        """
+        return self._call('snapshot', pvnames, as_numpy, timeout, monitor)
+
+    def map_pvs(self, func, pvnames, *, as_numpy=True, timeout=None,
+                monitor=False):
+        """Read a list of PVs, and call ``func(pvname, value)`` on each
+        value, in the worker which read it
+
+        `func` has to be picklable (a function of a module, for one). The
+        keyword arguments are those of `snapshot`.
+
+        Returns
+        -------
+        results : OrderedDict
+            the results of `func`, keyed on PV name, in the order of
+            `pvnames`. Exceptions (in reading the value or raised by `func`)
+            are in place of their result.
+        """
+        return self._call('map_pvs', pvnames, func, as_numpy, timeout,
+                          monitor)
+
+    def close(self, timeout=5.0):
+        '''Stop the workers once they are done with their tasks'''
+        for worker, tasks in self._workers:
+            tasks.put(None)
+        for worker, tasks in self._workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+        del self._workers[:]
+
+    def terminate(self):
+        for worker, tasks in self._workers:
+            worker.terminate()
+        del self._workers[:]
+
+    def __enter__(self):
+        return self
 
-        super().__init__(*args, **kwargs)
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,253 @@
+'''A pool of CA contexts, sharing out channels between them
+
+With a single context, one poll thread and one event queue carry the
+traffic of every channel: one busy IOC, or a flood of large waveforms, holds
+up all of the others. A `ContextPool` spreads channels over several
+contexts, each with its own poll and event queue threads (with libca), or
+its own search socket and virtual circuits (with the asyncio backend, where
+all contexts run on the event loop).
+
+The pool stands in for a single context: once created (see
+`CAContexts.create_pool`, or config.CONTEXT_POOL_SIZE), it is what
+`get_current_context` returns, so that PV, get_pv and coroutines use it
+unchanged. Each channel is created on the context its PV name is sharded to,
+by `shard`:
+
+'hash'
+    a hash of the whole name
+'prefix'
+    a hash of the name up to its first ':'. The records of an IOC usually
+    share a prefix, and so end up on the same context.
+callable
+    called with the PV name, returning the key to hash
+
+The server (IOC host) of a channel is only known once its name search is
+answered, after it was created on a context: a callable can map names to
+hosts, where those are known in advance.
+'''
+import collections
+import threading
+import zlib
+
+from . import ca
+from .context import DeliveryStats
+
+
+SHARD_POLICIES = ('hash', 'prefix')
+
+
+def _by_channel(name):
+    '''A method calling the method `name` of the context of a channel'''
+    def method(self, chid, *args, **kwargs):
+        return getattr(self.context_of(chid), name)(chid, *args, **kwargs)
+
+    method.__name__ = name
+    return method
+
+
+class ContextPool:
+    '''Channels spread over several context handlers
+
+    Parameters
+    ----------
+    contexts : list of CAContextHandler
+        the contexts of the pool; channels created before the pool keep
+        being found on theirs
+    shard : {'hash', 'prefix'} or callable, optional
+        how PV names are assigned to contexts
+    '''
+    def __init__(self, contexts, *, shard='hash'):
+        if not contexts:
+            raise ValueError('A context pool needs at least one context')
+        if shard not in SHARD_POLICIES and not callable(shard):
+            raise ValueError('Shard by one of {} or a callable'
+                             ''.format(SHARD_POLICIES))
+
+        self.contexts = list(contexts)
+        self.shard = shard
+        first = self.contexts[0]
+        self.backend = first.backend
+        self.driver = first.driver
+        self._loop = first._loop
+        self._sub_lock = threading.RLock()
+
+        # the estimates are by server, and the metrics by channel: they are
+        # shared by the contexts
+        self.round_trips = first.round_trips
+        for ctx in self.contexts[1:]:
+            ctx.round_trips = self.round_trips
+            ctx.metrics = first.metrics
+
+        self.channel_to_pv = collections.ChainMap(
+            *(ctx.channel_to_pv for ctx in self.contexts))
+        self.pv_to_channel = collections.ChainMap(
+            *(ctx.pv_to_channel for ctx in self.contexts))
+
+    # routing
+    def _shard_key(self, pvname):
+        if self.shard == 'hash':
+            return pvname
+        elif self.shard == 'prefix':
+            return pvname.split(':', 1)[0]
+        return str(self.shard(pvname))
+
+    def context_of_pv(self, pvname):
+        '''The context the channel of a PV is (or is to be) created on'''
+        for ctx in self.contexts:
+            if pvname in ctx.pv_to_channel:
+                return ctx
+
+        key = self._shard_key(pvname).encode('utf-8')
+        return self.contexts[zlib.crc32(key) % len(self.contexts)]
+
+    def context_of(self, chid):
+        '''The context of a channel'''
+        chid = ca.channel_id_to_int(chid)
+        for ctx in self.contexts:
+            if chid in ctx.channel_to_pv:
+                return ctx
+        # (for the first context to report the unknown channel)
+        return self.contexts[0]
+
+    def _context_of_callback(self, cbid):
+        for ctx in self.contexts:
+            if cbid in ctx._cbreg.cbid_owner:
+                return ctx
+        return self.contexts[0]
+
+    def shards(self):
+        '''The channels, subscriptions and event delivery of each context'''
+        shards = []
+        for ctx in self.contexts:
+            connected = [chid for chid in list(ctx.channel_to_pv)
+                         if ctx.is_connected(chid)]
+            hosts = {ctx.host_name(chid) for chid in connected}
+            shards.append(dict(channels=len(ctx.channel_to_pv),
+                               connected=len(connected),
+                               hosts=sorted(hosts),
+                               subscriptions=ctx.subscription_count(),
+                               queued_events=ctx.queued_events(),
+                               delivery=ctx.delivery_stats.snapshot(),
+                               ))
+        return shards
+
+    # channels
+    def create_channel(self, pvname, *, callback=None):
+        return self.context_of_pv(pvname).create_channel(pvname,
+                                                         callback=callback)
+
+    def create_channels(self, pvnames, *, callback=None):
+        '''Create the channels of many PVs at once, on their contexts
+
+        See `CAContextHandler.create_channels`.
+        '''
+        by_context = collections.OrderedDict()
+        for idx, pvname in enumerate(pvnames):
+            ctx = self.context_of_pv(pvname)
+            by_context.setdefault(ctx, []).append(idx)
+
+        chids = [None] * len(pvnames)
+        with self._sub_lock:
+            for ctx, indices in by_context.items():
+                created = ctx.create_channels([pvnames[idx]
+                                               for idx in indices],
+                                              callback=callback)
+                for idx, chid in zip(indices, created):
+                    chids[idx] = chid
+        return chids
+
+    def clear_channel(self, pvname):
+        self.context_of_pv(pvname).clear_channel(pvname)
+
+    def request_flush(self):
+        for ctx in self.contexts:
+            ctx.request_flush()
+
+    def flush(self):
+        for ctx in self.contexts:
+            ctx.flush()
+
+    connect_channel = _by_channel('connect_channel')
+    field_type = _by_channel('field_type')
+    element_count = _by_channel('element_count')
+    host_name = _by_channel('host_name')
+    access = _by_channel('access')
+    read_access = _by_channel('read_access')
+    write_access = _by_channel('write_access')
+    is_connected = _by_channel('is_connected')
+    get_request = _by_channel('get_request')
+    put_request = _by_channel('put_request')
+    metadata = _by_channel('metadata')
+    track_metadata = _by_channel('track_metadata')
+    untrack_metadata = _by_channel('untrack_metadata')
+    metadata_future = _by_channel('metadata_future')
+    subscribe_metadata = _by_channel('subscribe_metadata')
+
+    # subscriptions
+    def subscribe(self, sig, func, chid, *, oneshot=False, **kwargs):
+        return self.context_of(chid).subscribe(sig=sig, func=func, chid=chid,
+                                               oneshot=oneshot, **kwargs)
+
+    def unsubscribe(self, cbid):
+        self._context_of_callback(cbid).unsubscribe(cbid)
+
+    def subscription(self, cbid):
+        return self._context_of_callback(cbid).subscription(cbid)
+
+    def callback_health(self):
+        health = {}
+        for ctx in self.contexts:
+            health.update(ctx.callback_health())
+        return health
+
+    def suspend_callback(self, cbid):
+        self._context_of_callback(cbid).suspend_callback(cbid)
+
+    def offload_callback(self, cbid):
+        self._context_of_callback(cbid).offload_callback(cbid)
+
+    def resume_callback(self, cbid):
+        self._context_of_callback(cbid).resume_callback(cbid)
+
+    # statistics
+    @property
+    def metrics(self):
+        return self.contexts[0].metrics
+
+    def enable_metrics(self):
+        metrics = self.contexts[0].enable_metrics()
+        for ctx in self.contexts[1:]:
+            ctx.metrics = metrics
+        return metrics
+
+    def disable_metrics(self):
+        for ctx in self.contexts:
+            ctx.disable_metrics()
+
+    def metrics_snapshot(self):
+        return self.contexts[0].metrics_snapshot()
+
+    @property
+    def delivery_stats(self):
+        return DeliveryStats.combined(ctx.delivery_stats
+                                      for ctx in self.contexts)
+
+    def subscription_count(self):
+        return sum(ctx.subscription_count() for ctx in self.contexts)
+
+    def queued_events(self):
+        return sum(ctx.queued_events() for ctx in self.contexts)
+
+    def pending_requests(self):
+        if self.backend == 'libca':
+            # the futures of libca requests are counted across contexts
+            return self.contexts[0].pending_requests()
+        return sum(ctx.pending_requests() for ctx in self.contexts)
+
+    def stop(self):
+        for ctx in self.contexts:
+            ctx.stop()
+
+    def __repr__(self):
+        return '{0}({1} contexts, shard={2!r})'.format(
+            self.__class__.__name__, len(self.contexts), self.shard)
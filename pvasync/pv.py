@@ -9,6 +9,7 @@
 import time
 import copy
 import asyncio
+import collections
 
 from math import log10
 import numpy as np
@@ -16,15 +17,27 @@ import numpy as np
 from . import ca
 from . import dbr
 from . import config
-from .context import get_current_context
+from .context import (get_current_context, metadata_fields)
 from . import coroutines
+from .budgets import loop_only
 from .dbr import ChannelType
 from .utils import format_time
+from .streams import MonitorStream
 from .sync import blocking_wrapper
 
 _PVcache_ = {}
 
 
+class PVEvent(collections.namedtuple('PVEvent', 'pv pvname value char_value '
+                                     'timestamp status severity count')):
+    '''A change event, as passed to callbacks added with ``as_event=True``
+
+    One event is made per update and shared by all of the PV's event
+    callbacks.
+    '''
+    __slots__ = ()
+
+
 @asyncio.coroutine
 def get_pv(pvname, form='time', connect=False, context=None, timeout=5.0,
            **kws):
@@ -86,10 +99,15 @@ class PV(object):
 
     def __init__(self, pvname, form='time', auto_monitor=None,
                  connection_callback=None, connection_timeout=None,
-                 monitor_mask=None):
+                 monitor_mask=None, monitor_buffers=None, coalesce=False):
 
         self._context = get_current_context()
         self.monitor_mask = monitor_mask
+        # for array PVs, the number of preallocated arrays monitor updates are
+        # written into (None to allocate a new array for every update)
+        self.monitor_buffers = monitor_buffers
+        # deliver only the newest monitor update when updates back up
+        self.coalesce = coalesce
         self.chid = None
         self.pvname = pvname.strip()
         self.form = form.lower()
@@ -99,9 +117,18 @@ class PV(object):
         self.connection_timeout = connection_timeout
         # holder of data returned from create_subscription
         self._mon_cbid = None
+        # callback ids of the subscriptions to CTRL field changes and to
+        # connection changes
+        self._meta_cbid = None
+        self._conn_cbid = None
         self._conn_started = False
         self.connection_callbacks = []
         self.callbacks = {}
+        # indices of the callbacks that take a PVEvent rather than keywords
+        self._event_callbacks = set()
+        # the callbacks sorted for dispatch, and what they were sorted from
+        self._dispatch = ()
+        self._dispatch_sources = None
         self._args = dict(value=None,
                           pvname=self.pvname,
                           count=-1,
@@ -114,10 +141,10 @@ class PV(object):
         self.chid = self._context.create_channel(self.pvname)
         # subscribe should be smart enough to run the subscription if the
         # callback happens inbetween
-        self._context.subscribe(sig='connection', func=self.__on_connect,
-                                chid=self.chid)
+        handler, self._conn_cbid = self._context.subscribe(
+            sig='connection', func=self.__on_connect, chid=self.chid)
 
-        native_type = ca.field_type(self.chid)
+        native_type = self._context.field_type(self.chid)
         try:
             self.ftype = dbr.promote_type(native_type,
                                           use_ctrl=(self.form == 'ctrl'),
@@ -140,19 +167,20 @@ class PV(object):
         return hash(self._pvid)
 
     def _connected(self, chid):
+        ctx = self._context
         self.chid = dbr.chid_t(chid)
         try:
-            count = ca.element_count(self.chid)
+            count = ctx.element_count(self.chid)
         except ca.ChannelAccessException:
             time.sleep(0.025)
-            count = ca.element_count(self.chid)
+            count = ctx.element_count(self.chid)
         self._args['count'] = count
         self._args['nelm'] = count
-        self._args['host'] = ca.host_name(self.chid)
-        self._args['access'] = ca.access(self.chid)
-        self._args['read_access'] = (1 == ca.read_access(self.chid))
-        self._args['write_access'] = (1 == ca.write_access(self.chid))
-        self.ftype = dbr.promote_type(ca.field_type(self.chid),
+        self._args['host'] = ctx.host_name(self.chid)
+        self._args['access'] = ctx.access(self.chid)
+        self._args['read_access'] = (1 == ctx.read_access(self.chid))
+        self._args['write_access'] = (1 == ctx.write_access(self.chid))
+        self.ftype = dbr.promote_type(ctx.field_type(self.chid),
                                       use_ctrl=self.form == 'ctrl',
                                       use_time=self.form == 'time')
 
@@ -174,13 +202,26 @@ class PV(object):
             ptype = dbr.promote_type(self.ftype, use_ctrl=use_ctrl,
                                      use_time=use_time)
 
-            ctx = self._context
+            nbuffers = None
+            if count > 1:
+                nbuffers = self.monitor_buffers
+
             handler, cbid = ctx.subscribe(sig='monitor',
                                           func=self._monitor_update,
                                           chid=self.chid, ftype=ptype,
-                                          mask=mask)
+                                          mask=mask, nbuffers=nbuffers,
+                                          coalesce=self.coalesce)
             self._mon_cbid = cbid
 
+        # units, limits, enum strings etc are kept current by a shared
+        # subscription, and cached by the context (until disconnected)
+        if self._meta_cbid is None:
+            ctx.track_metadata(self.chid)
+            handler, self._meta_cbid = ctx.subscribe_metadata(
+                self.chid, self._metadata_update)
+        self._update_ctrlvars()
+
+    @loop_only
     def __on_connect(self, pvname=None, chid=None, connected=True):
         "callback for connection events"
         if connected:
@@ -256,6 +297,10 @@ class PV(object):
         if self.count <= 1 or val is None:
             return val
 
+        if 'seq' in self._args and isinstance(val, np.ndarray):
+            # a view of a monitor buffer, which will be overwritten
+            val = val.copy()
+
         if count is None:
             count = len(val)
         if (as_numpy and not isinstance(val, np.ndarray)):
@@ -273,7 +318,7 @@ class PV(object):
         return val
 
     @asyncio.coroutine
-    def aput(self, value, timeout=30.0, use_complete=False, callback=None,
+    def aput(self, value, timeout=None, use_complete=False, callback=None,
              callback_data=None):
         """set value for PV, optionally waiting until the processing is
         complete, and optionally specifying a callback function to be run
@@ -342,7 +387,7 @@ class PV(object):
             cval = '<array size=%d, type=%s>' % (len(val), typename)
         elif ntype in dbr.native_float_types:
             if call_ca and self._args['precision'] is None:
-                self.get_ctrlvars()
+                self._update_ctrlvars()
             try:
                 prec = self._args['precision']
                 fmt = "%%.%if"
@@ -353,7 +398,7 @@ class PV(object):
                 cval = str(val)
         elif ntype == ChannelType.ENUM:
             if call_ca and self._args['enum_strs'] in ([], None):
-                self.get_ctrlvars()
+                self._update_ctrlvars()
             try:
                 cval = self._args['enum_strs'][val]
             except (TypeError, KeyError, IndexError):
@@ -370,6 +415,18 @@ class PV(object):
         self._args.update(kwds)
         return kwds
 
+    def _update_ctrlvars(self):
+        '''Update the CTRL fields from the context's cache, if filled'''
+        info = self._context.metadata(self.chid)
+        if info is not None:
+            self._args.update(info)
+
+    @loop_only
+    def _metadata_update(self, chid=None, **kwd):
+        '''internal callback function for changes of the CTRL fields'''
+        self._args.update((key, kwd[key]) for key in metadata_fields
+                          if key in kwd)
+
     @asyncio.coroutine
     def get_timevars(self, timeout=5):
         "get time values for variable"
@@ -378,6 +435,7 @@ class PV(object):
         self._args.update(kwds)
         return kwds
 
+    @loop_only
     def _monitor_update(self, value=None, **kwd):
         """internal callback function: do not overwrite!!
         To have user-defined code run when the PV value changes,
@@ -386,9 +444,36 @@ class PV(object):
         self._args.update(kwd)
         self._args['value'] = value
         self._args['timestamp'] = kwd.get('timestamp', time.time())
+        if 'timestamp_ns' not in kwd:
+            # (the native form has no timestamp: that of its arrival)
+            self._args['timestamp_ns'] = int(self._args['timestamp'] * 1e9)
         self._set_charval(self._args['value'], call_ca=False)
         self.run_callbacks()
 
+    def _dispatch_list(self):
+        """the callbacks, sorted by index, as (index, fcn, kw, as_event)
+
+        Rebuilt only when the callbacks differ from a snapshot of those it
+        was built from (however they were changed: `callbacks` may be
+        changed directly), not for every event.
+        """
+        sources = (self.callbacks, self._event_callbacks)
+        if self._dispatch_sources != sources:
+            self._dispatch_sources = (dict(self.callbacks),
+                                      set(self._event_callbacks))
+            self._dispatch = tuple(
+                (index, fcn, kw, index in self._event_callbacks)
+                for index, (fcn, kw) in sorted(self.callbacks.items())
+                if callable(fcn))
+        return self._dispatch
+
+    def _make_event(self):
+        args = self._args
+        return PVEvent(self, self.pvname, args['value'],
+                       args.get('char_value'), args.get('timestamp'),
+                       args.get('status'), args.get('severity'),
+                       args['count'])
+
     def run_callbacks(self):
         """run all user-defined callbacks with the current data
 
@@ -396,8 +481,29 @@ class PV(object):
         it is provided here as a separate function for testing
         purposes.
         """
-        for index in sorted(list(self.callbacks.keys())):
-            self.run_callback(index)
+        dispatch = self._dispatch_list()
+        if not dispatch:
+            return
+
+        # one event for all of the event callbacks
+        event = None
+        for index, fcn, kwargs, as_event in dispatch:
+            if index not in self.callbacks:
+                # removed by an earlier callback
+                continue
+
+            if as_event:
+                if event is None:
+                    event = self._make_event()
+                fcn(event, **kwargs)
+            elif kwargs:
+                kwd = dict(self._args)
+                kwd.update(kwargs)
+                kwd['cb_info'] = (index, self)
+                fcn(**kwd)
+            else:
+                # (the call itself makes the only copy of the PV data)
+                fcn(cb_info=(index, self), **self._args)
 
     def run_callback(self, index):
         """run a specific user-defined callback, specified by index,
@@ -410,35 +516,54 @@ class PV(object):
         where the 'cb_info' is provided as a hook so that a callback
         function  that fails may de-register itself (for example, if
         a GUI resource is no longer available).
+
+        Callbacks added with as_event=True are instead called with a
+        PVEvent, followed by the keyword args included in add_callback().
         """
         try:
             fcn, kwargs = self.callbacks[index]
         except KeyError:
             return
+        if not callable(fcn):
+            return
+
+        if index in self._event_callbacks:
+            fcn(self._make_event(), **kwargs)
+            return
+
         kwd = copy.copy(self._args)
         kwd.update(kwargs)
         kwd['cb_info'] = (index, self)
-        if callable(fcn):
-            fcn(**kwd)
+        fcn(**kwd)
 
     def add_callback(self, callback=None, index=None, run_now=False,
-                     with_ctrlvars=True, **kw):
+                     with_ctrlvars=True, as_event=False, **kw):
         """add a callback to a PV.  Optional keyword arguments
         set here will be preserved and passed on to the callback
         at runtime.
 
         Note that a PV may have multiple callbacks, so that each
         has a unique index (small integer) that is returned by
-        add_callback.  This index is needed to remove a callback."""
+        add_callback.  This index is needed to remove a callback.
+
+        With as_event=True, the callback is called with a single PVEvent
+        (pv, pvname, value, char_value, timestamp, status, severity, count)
+        shared by all such callbacks, instead of a copy of all of the PV's
+        data as keyword arguments."""
         if callable(callback):
             if index is None:
                 index = 1
                 if len(self.callbacks) > 0:
                     index = 1 + max(self.callbacks.keys())
             self.callbacks[index] = (callback, kw)
+            if as_event:
+                self._event_callbacks.add(index)
+            else:
+                self._event_callbacks.discard(index)
 
         if with_ctrlvars and self.connected:
-            self.get_ctrlvars()  # <-- TODO coroutine
+            # (kept current since connection; see _metadata_update)
+            self._update_ctrlvars()
         if run_now:
             self.get(as_string=True)
             if self.connected:
@@ -449,10 +574,36 @@ class PV(object):
         """remove a callback by index"""
         if index in self.callbacks:
             self.callbacks.pop(index)
+            self._event_callbacks.discard(index)
 
     def clear_callbacks(self):
         "clear all callbacks"
         self.callbacks = {}
+        self._event_callbacks.clear()
+
+    def monitor(self, maxsize=100, policy='drop_oldest', mask=None):
+        """a stream of this PV's monitor updates, with its own bounded queue
+
+        Iterate over it (``async for event in pv.monitor()``) or read it with
+        ``yield from stream.get()``. Each event is a dictionary of the
+        update's value and its status, severity, timestamp, etc.
+
+        Parameters
+        ----------
+        maxsize : int, optional
+            maximum number of updates queued for this consumer
+        policy : {'drop_oldest', 'latest', 'drop_newest'}, optional
+            what to do with an update when the queue is full; see
+            streams.MonitorStream
+        mask : int, optional
+            subscription mask (default: `monitor_mask`)
+
+        Returns
+        -------
+        stream : streams.MonitorStream
+            close it to unsubscribe
+        """
+        return MonitorStream(self, maxsize=maxsize, policy=policy, mask=mask)
 
     @asyncio.coroutine
     def get_info(self, timeout=2.0):
@@ -525,6 +676,34 @@ class PV(object):
         out.append('=============================')
         return '\n'.join(out)
 
+    @property
+    def _monitor_handler(self):
+        if self._mon_cbid is None:
+            return None
+        return self._context.subscription(self._mon_cbid)
+
+    @property
+    def monitor_overruns(self):
+        """number of buffered monitor updates overwritten before delivery
+
+        Only counted when the PV was created with `monitor_buffers`
+        """
+        handler = self._monitor_handler
+        if handler is None or handler.buffer is None:
+            return 0
+        return handler.buffer.overruns
+
+    @property
+    def monitor_dropped(self):
+        """number of monitor updates skipped by coalescing
+
+        Only counted when the PV was created with `coalesce=True`
+        """
+        handler = self._monitor_handler
+        if handler is None:
+            return 0
+        return handler.dropped
+
     @property
     def nelm(self):
         """native count (number of elements).
@@ -534,7 +713,7 @@ class PV(object):
         """
         if self.count == 1:
             return 1
-        return ca.element_count(self.chid)
+        return self._context.element_count(self.chid)
 
     def __repr__(self):
         "string representation"
@@ -569,10 +748,15 @@ class PV(object):
             # down
 
         self.callbacks = {}
+        self._event_callbacks.clear()
 
-        if self._mon_cbid is not None:
-            cbid = self._mon_cbid
-            self._mon_cbid = None
+        tracked = getattr(self, '_meta_cbid', None) is not None
+        for attr in ('_mon_cbid', '_meta_cbid', '_conn_cbid'):
+            cbid = getattr(self, attr, None)
+            if cbid is None:
+                continue
+
+            setattr(self, attr, None)
             try:
                 ctx.unsubscribe(cbid)
             except KeyError:
@@ -581,6 +765,13 @@ class PV(object):
                 if not deleted:
                     raise
 
+        if tracked:
+            try:
+                ctx.untrack_metadata(self.chid)
+            except KeyError:
+                if not deleted:
+                    raise
+
     def disconnect(self):
         "disconnect PV"
         self._disconnect(deleted=False)
@@ -613,6 +804,9 @@ class PV(object):
     access = _arg_property('access', doc='pv write access')
     severity = _arg_property('severity', doc='pv severity')
     timestamp = _arg_property('timestamp', doc='timestamp of last pv action')
+    timestamp_ns = _arg_property('timestamp_ns',
+                                 doc='timestamp of last pv action, as integer '
+                                 'nanoseconds')
     precision = _arg_property('precision',
                               doc='number of digits after decimal point')
     units = _arg_property('units', doc='engineering units for pv')
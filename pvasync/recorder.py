@@ -0,0 +1,537 @@
+'''Recording monitor updates to column files, and reading them back
+
+A `Recorder` subscribes to a list of PVs (in their TIME form) and appends
+each update to the column files of its PV: the timestamp (integer
+nanoseconds since the Unix epoch), the alarm status and severity, and the
+value. Array PVs have fixed-width records, of their element count when
+first connected: shorter updates are padded with zeros, with their length
+in a fourth column, and longer ones are cut short. Strings are stored as
+40-byte records (dbr.MAX_STRING_SIZE), encoded in UTF-8.
+
+The subscription callbacks only append the update to a list. Every
+`flush_interval` seconds the lists are handed to a writer thread, which
+turns them into arrays and appends them to the files, so that the event
+loop never waits on the disk.
+
+The files of a PV are in its own directory, under the recording's, named by
+the PV name (quoted to be a valid file name)::
+
+    <directory>/<pvname>/meta.json
+    <directory>/<pvname>/000000.timestamp   int64
+    <directory>/<pvname>/000000.status      int16
+    <directory>/<pvname>/000000.severity    int16
+    <directory>/<pvname>/000000.value       the native type, x count
+    <directory>/<pvname>/000000.length      int32 (array PVs only)
+    <directory>/<pvname>/000001.timestamp   ...
+
+with a new chunk of files every `chunk_records` records. Recording to an
+existing directory appends to it (the PV's type and count are those first
+recorded). A `Recording` reads them back through memory maps::
+
+    with Recorder(pvnames, 'run42'):
+        ...
+    recording = Recording('run42')
+    columns = recording.read(pvname, start=np.datetime64('2016-05-01T12:00'))
+'''
+import asyncio
+import collections
+import concurrent.futures
+import datetime
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+from . import (cast, config, dbr)
+from .context import get_current_context
+
+
+logger = logging.getLogger(__name__)
+
+# the fixed columns, and their types (in the files: little-endian)
+COLUMNS = collections.OrderedDict([('timestamp', np.dtype('<i8')),
+                                   ('status', np.dtype('<i2')),
+                                   ('severity', np.dtype('<i2')),
+                                   ])
+LENGTH_DTYPE = np.dtype('<i4')
+META_FILE = 'meta.json'
+
+
+def _pv_directory(directory, pvname):
+    return os.path.join(directory, urllib.parse.quote(pvname, safe=''))
+
+
+def _chunk_path(pv_directory, chunk, column):
+    return os.path.join(pv_directory, '{:06d}.{}'.format(chunk, column))
+
+
+def _chunks(pv_directory):
+    '''The chunk numbers of the files in the directory of a PV'''
+    chunks = set()
+    for fn in os.listdir(pv_directory):
+        chunk, _, column = fn.partition('.')
+        if column == 'timestamp' and chunk.isdigit():
+            chunks.add(int(chunk))
+    return sorted(chunks)
+
+
+def _column_dtypes(meta):
+    dtypes = collections.OrderedDict(COLUMNS)
+    value_dtype = np.dtype(meta['dtype'])
+    if meta['count'] > 1:
+        dtypes['value'] = np.dtype((value_dtype, (meta['count'], )))
+        dtypes['length'] = LENGTH_DTYPE
+    else:
+        dtypes['value'] = value_dtype
+    return dtypes
+
+
+def _complete_records(pv_directory, chunk, dtypes):
+    '''The number of records of a chunk found whole in all of its columns'''
+    sizes = []
+    for column, dtype in dtypes.items():
+        path = _chunk_path(pv_directory, chunk, column)
+        try:
+            sizes.append(os.path.getsize(path) // dtype.itemsize)
+        except OSError:
+            sizes.append(0)
+    return min(sizes)
+
+
+class _ColumnWriter:
+    '''The column files of one PV, appended to by the writer thread'''
+    def __init__(self, directory, pvname, chunk_records):
+        self.pvname = pvname
+        self.directory = _pv_directory(directory, pvname)
+        self.chunk_records = chunk_records
+        self.meta = None
+        self.dtypes = None
+        self.chunk = 0
+        self.records = 0
+        self.files = {}
+        # updates not yet handed to the writer thread (see Recorder.flush)
+        self.pending = []
+        self.cbid = None
+
+    def open(self, ftype, count):
+        '''Set up the files, once the type of the channel is known (or those
+        of an earlier recording)'''
+        os.makedirs(self.directory, exist_ok=True)
+        meta_path = os.path.join(self.directory, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'rt') as f:
+                self.meta = json.load(f)
+        else:
+            ntype = dbr.native_type(ftype)
+            dtype = np.dtype(cast.native_dtype(ntype)).newbyteorder('<')
+            self.meta = dict(pvname=self.pvname,
+                             ftype=int(ntype),
+                             dtype=dtype.str,
+                             string=(ntype == dbr.ChannelType.STRING),
+                             count=max(1, int(count)),
+                             chunk_records=self.chunk_records,
+                             )
+            with open(meta_path, 'wt') as f:
+                json.dump(self.meta, f)
+
+        self.dtypes = _column_dtypes(self.meta)
+        self.chunk_records = self.meta['chunk_records']
+        chunks = _chunks(self.directory)
+        if chunks:
+            # append to the last chunk, dropping any record left incomplete
+            self.chunk = chunks[-1]
+            self.records = _complete_records(self.directory, self.chunk,
+                                             self.dtypes)
+            for column, dtype in self.dtypes.items():
+                path = _chunk_path(self.directory, self.chunk, column)
+                with open(path, 'ab') as f:
+                    f.truncate(self.records * dtype.itemsize)
+
+    def _columns(self, updates):
+        '''Arrays of the columns of a list of updates'''
+        num = len(updates)
+        columns = collections.OrderedDict(
+            (column, np.zeros(num, dtype=dtype))
+            for column, dtype in self.dtypes.items())
+
+        stamps, status, severity, values = zip(*updates)
+        columns['timestamp'][:] = stamps
+        columns['status'][:] = status
+        columns['severity'][:] = severity
+
+        if self.meta['string']:
+            values = [[elem.encode('utf-8')[:dbr.MAX_STRING_SIZE]
+                       for elem in (value if isinstance(value, list)
+                                    else [value])]
+                      for value in values]
+            if self.meta['count'] == 1:
+                values = [value[0] for value in values]
+
+        if self.meta['count'] == 1:
+            columns['value'][:] = values
+            return columns
+
+        count = self.meta['count']
+        array, lengths = columns['value'], columns['length']
+        for idx, value in enumerate(values):
+            value = np.asarray(value)[:count]
+            array[idx, :len(value)] = value
+            lengths[idx] = len(value)
+        return columns
+
+    def write(self, updates):
+        '''Append updates to the files, starting new chunks as needed;
+        returns the number of bytes written'''
+        columns = self._columns(updates)
+        written = 0
+        start = 0
+        while start < len(updates):
+            if self.records >= self.chunk_records:
+                self.close()
+                self.chunk += 1
+                self.records = 0
+
+            stop = min(len(updates), start + self.chunk_records - self.records)
+            for column, array in columns.items():
+                f = self.files.get(column, None)
+                if f is None:
+                    path = _chunk_path(self.directory, self.chunk, column)
+                    f = self.files[column] = open(path, 'ab')
+                data = array[start:stop].tobytes()
+                f.write(data)
+                written += len(data)
+
+            self.records += stop - start
+            start = stop
+
+        for f in self.files.values():
+            f.flush()
+        return written
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+
+
+class Recorder:
+    '''Record the monitor updates of PVs to column files
+
+    Parameters
+    ----------
+    pvnames : list of str
+    directory : str
+        where to write the files (created if need be)
+    mask : int, optional
+        subscription mask (default: that of the context, value and alarm
+        changes). DBE_LOG records the archive deadband's updates instead.
+    chunk_records : int, optional
+        records per chunk of files (default config.RECORDER_CHUNK_RECORDS)
+    flush_interval : float, optional
+        seconds between writes (default config.RECORDER_FLUSH_INTERVAL)
+
+    Attributes
+    ----------
+    received : int
+        number of updates received
+    written : int
+        number of updates written to the files
+    bytes_written : int
+    write_errors : int
+        number of failed writes
+    lost : int
+        number of updates lost to failed writes
+    max_write_time : float
+        longest time taken by the writer thread for one flush
+    '''
+    def __init__(self, pvnames, directory, *, mask=None, chunk_records=None,
+                 flush_interval=None):
+        if chunk_records is None:
+            chunk_records = config.RECORDER_CHUNK_RECORDS
+        if flush_interval is None:
+            flush_interval = config.RECORDER_FLUSH_INTERVAL
+        if chunk_records < 1:
+            raise ValueError('At least one record per chunk')
+
+        self.directory = directory
+        self.mask = mask
+        self.flush_interval = flush_interval
+        self.writers = collections.OrderedDict(
+            (pvname, _ColumnWriter(directory, pvname, chunk_records))
+            for pvname in pvnames)
+
+        self.received = 0
+        self.written = 0
+        self.bytes_written = 0
+        self.write_errors = 0
+        self.lost = 0
+        self.max_write_time = 0.0
+        self.running = False
+
+        self._loop = asyncio.get_event_loop()
+        self._context = None
+        self._lock = threading.Lock()
+        self._timer = None
+        self._executor = None
+
+    def start(self):
+        '''Create the channels, subscribing to each once connected'''
+        if self.running:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.running = True
+        self._context = get_current_context()
+        self._executor = concurrent.futures.ThreadPoolExecutor(1)
+        self._loop.call_soon_threadsafe(self._schedule_flush)
+        for pvname in self.writers:
+            chid = self._context.create_channel(pvname)
+            self._context.subscribe(sig='connection', chid=chid,
+                                    func=self._on_connection, oneshot=True)
+
+    def _on_connection(self, chid=None, pvname=None, connected=None,
+                       **kwargs):
+        writer = self.writers.get(pvname, None)
+        if not connected or not self.running or writer is None:
+            return
+        if writer.cbid is not None:
+            return
+
+        ctx = self._context
+        ftype = dbr.promote_type(ctx.field_type(chid), use_time=True)
+        # (the files are set up by the writer thread, before it writes any
+        # of the updates)
+        self._executor.submit(self._open, writer, ftype,
+                              ctx.element_count(chid))
+        handler, writer.cbid = ctx.subscribe(
+            sig='monitor', chid=chid, ftype=ftype, mask=self.mask,
+            func=functools.partial(self._on_event, writer))
+
+    def _on_event(self, writer, chid=None, value=None, status=0, severity=0,
+                  timestamp_ns=None, **kwargs):
+        '''Subscription callback (on the event loop): only queues the update'''
+        if timestamp_ns is None:
+            timestamp_ns = int(time.time() * 1e9)
+        with self._lock:
+            writer.pending.append((timestamp_ns, status, severity, value))
+            self.received += 1
+
+    def _schedule_flush(self):
+        if self.running:
+            self._timer = self._loop.call_later(self.flush_interval,
+                                                self._on_timer)
+
+    def _on_timer(self):
+        self.flush()
+        self._schedule_flush()
+
+    def flush(self):
+        '''Hand the queued updates to the writer thread
+
+        Returns
+        -------
+        future : concurrent.futures.Future or None
+            done once they are written (None if there were none)
+        '''
+        batch = []
+        with self._lock:
+            for writer in self.writers.values():
+                if writer.pending:
+                    batch.append((writer, writer.pending))
+                    writer.pending = []
+
+        if not batch or self._executor is None:
+            return None
+
+        return self._executor.submit(self._write, batch)
+
+    def _open(self, writer, ftype, count):
+        try:
+            writer.open(ftype, count)
+        except Exception:
+            self.write_errors += 1
+            logger.exception('Failed to set up the files of %s',
+                             writer.pvname)
+
+    def _write(self, batch):
+        '''Write a batch of updates (in the writer thread)'''
+        t0 = time.perf_counter()
+        for writer, updates in batch:
+            try:
+                if writer.dtypes is None:
+                    raise RuntimeError('No files to write to')
+                self.bytes_written += writer.write(updates)
+            except Exception:
+                self.write_errors += 1
+                self.lost += len(updates)
+                logger.exception('Failed to record %d updates of %s',
+                                 len(updates), writer.pvname)
+            else:
+                self.written += len(updates)
+        self.max_write_time = max(self.max_write_time,
+                                  time.perf_counter() - t0)
+
+    @property
+    def pending(self):
+        '''number of updates received, but not yet written (or lost)'''
+        return self.received - self.written - self.lost
+
+    def stats(self):
+        return dict(pvs=len(self.writers),
+                    subscribed=sum(writer.cbid is not None
+                                   for writer in self.writers.values()),
+                    received=self.received,
+                    written=self.written,
+                    pending=self.pending,
+                    lost=self.lost,
+                    bytes_written=self.bytes_written,
+                    write_errors=self.write_errors,
+                    max_write_time=self.max_write_time,
+                    )
+
+    def close(self):
+        '''Unsubscribe, and write out the updates received'''
+        if not self.running:
+            return
+
+        self.running = False
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        for writer in self.writers.values():
+            if writer.cbid is not None:
+                self._context.unsubscribe(writer.cbid)
+                writer.cbid = None
+
+        self.flush()
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        for writer in self.writers.values():
+            writer.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _to_ns(when):
+    '''Integer nanoseconds since the Unix epoch, from a datetime64, datetime,
+    float (Unix time in seconds) or int (in nanoseconds)'''
+    if when is None:
+        return None
+    elif isinstance(when, np.datetime64):
+        return int(when.astype('datetime64[ns]').astype(np.int64))
+    elif isinstance(when, datetime.datetime):
+        return int(when.timestamp() * 1e9)
+    elif isinstance(when, (float, np.floating)):
+        return int(when * 1e9)
+    return int(when)
+
+
+class Recording:
+    '''The files written by a Recorder, read through memory maps
+
+    Parameters
+    ----------
+    directory : str
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+
+    @property
+    def pvnames(self):
+        '''The PVs recorded'''
+        pvnames = []
+        for fn in sorted(os.listdir(self.directory)):
+            meta_path = os.path.join(self.directory, fn, META_FILE)
+            if os.path.exists(meta_path):
+                pvnames.append(urllib.parse.unquote(fn))
+        return pvnames
+
+    def meta(self, pvname):
+        '''The type, count and chunk size of the records of a PV'''
+        meta_path = os.path.join(_pv_directory(self.directory, pvname),
+                                 META_FILE)
+        with open(meta_path, 'rt') as f:
+            return json.load(f)
+
+    def read(self, pvname, start=None, stop=None):
+        '''The records of a PV from `start` (inclusive) to `stop`
+        (exclusive)
+
+        The chunks in the range are found by binary search on their
+        timestamps, which are assumed to increase (as do those of a record,
+        unless its clock is stepped back).
+
+        Parameters
+        ----------
+        pvname : str
+        start, stop : numpy.datetime64, datetime, float or int, optional
+            times (float: Unix time in seconds; int: nanoseconds since the
+            Unix epoch)
+
+        Returns
+        -------
+        columns : OrderedDict
+            timestamp (datetime64[ns]), status, severity, value (one row per
+            record for array PVs) and length (array PVs only). Where the
+            records are within one chunk, these are read-only views of its
+            memory maps.
+        '''
+        meta = self.meta(pvname)
+        dtypes = _column_dtypes(meta)
+        pv_directory = _pv_directory(self.directory, pvname)
+        start, stop = _to_ns(start), _to_ns(stop)
+
+        parts = []
+        for chunk in _chunks(pv_directory):
+            records = _complete_records(pv_directory, chunk, dtypes)
+            if not records:
+                continue
+
+            stamps = np.memmap(_chunk_path(pv_directory, chunk, 'timestamp'),
+                               dtype=COLUMNS['timestamp'], mode='r',
+                               shape=(records, ))
+            if start is not None and stamps[-1] < start:
+                continue
+            if stop is not None and stamps[0] >= stop:
+                break
+
+            lo = (0 if start is None
+                  else int(np.searchsorted(stamps, start, 'left')))
+            hi = (records if stop is None
+                  else int(np.searchsorted(stamps, stop, 'left')))
+            if hi > lo:
+                parts.append((chunk, records, lo, hi))
+
+        columns = collections.OrderedDict()
+        for column, dtype in dtypes.items():
+            arrays = []
+            for chunk, records, lo, hi in parts:
+                mapped = np.memmap(_chunk_path(pv_directory, chunk, column),
+                                   dtype=dtype, mode='r', shape=(records, ))
+                arrays.append(mapped[lo:hi])
+
+            if len(arrays) == 1:
+                array = arrays[0]
+            elif arrays:
+                array = np.concatenate(arrays)
+            else:
+                array = np.empty((0, ) + dtype.shape, dtype=dtype.base)
+
+            if column == 'timestamp':
+                array = array.view('datetime64[ns]')
+            columns[column] = array
+        return columns
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(self.__class__.__name__, self.directory)
@@ -0,0 +1,457 @@
+'''Replaying recorded monitor updates through the PV callbacks
+
+A `ReplayContextHandler` stands in for Channel Access: its channels are
+those of a `recorder.Recording`, and its monitor events are the recorded
+updates, in place of those of libca (or of the asyncio client). The events
+are dispatched exactly as live ones are, through the context's batches, the
+callback registry and the subscription handlers (with their buffers,
+coalescing and derived requests), so that PVs and their callbacks see what
+they would have seen live::
+
+    ctx = get_contexts().start_replay('run42')
+    pv = PV('XF:31IDA-OP{Tbl-Ax:X1}Mtr.RBV')
+    pv.add_callback(on_update)
+    stats = loop.run_until_complete(ctx.replay(speed=1.0))
+
+The updates of all the recorded PVs are merged by timestamp (with ties
+broken by PV name, then record order) so that a replay is deterministic.
+They are replayed either as fast as the callbacks take them (speed=None), or
+paced by their recorded timestamps. Events carry their recorded timestamps,
+alarm status and severity; the CTRL fields (units, limits, enum strings),
+which are not recorded, are absent.
+
+As a server would, a new subscription is first sent the current update of
+its channel: the latest one replayed or, before then, the first recorded.
+Channels which were not recorded never connect, and replayed ones are
+read-only.
+'''
+import asyncio
+import logging
+import time
+
+import numpy as np
+
+from . import (ca, cast, dbr, errors)
+from .ca_client import _cids
+from .callback_registry import ChannelCallbackBase
+from .context import (CAContextHandler, ConnectionCallback, MonitorCallback)
+from .recorder import Recording
+
+
+logger = logging.getLogger(__name__)
+
+
+def _native_type(meta):
+    '''The native field type of a PV's records'''
+    if 'ftype' in meta:
+        return dbr.ChannelType(meta['ftype'])
+    if meta['string']:
+        return dbr.ChannelType.STRING
+
+    # (recorded before the type was kept: the first with the same dtype)
+    dtype = np.dtype(meta['dtype'])
+    for ntype in dbr.native_types:
+        if ntype == dbr.ChannelType.STRING:
+            continue
+        if np.dtype(cast.native_dtype(ntype)).newbyteorder('<') == dtype:
+            return ntype
+    raise ValueError('No field type for records of {!r}'
+                     ''.format(meta['dtype']))
+
+
+def _unixtime(timestamp_ns):
+    '''UNIX timestamp (seconds), as from an Epics TimeStamp'''
+    secs, nsec = divmod(timestamp_ns - dbr.EPICS2UNIX_EPOCH_NS, 1000000000)
+    return dbr.epics_to_unixtime(secs, nsec)
+
+
+class _ReplayHeader:
+    '''The header of a get reply, from a record'''
+    def __init__(self, ftype, fields):
+        self.dbr_type = ftype
+        self.fields = fields
+
+    def to_dict(self):
+        return dict(self.fields)
+
+
+class _Records:
+    '''The records of a replayed PV'''
+    def __init__(self, recording, pvname, start=None, stop=None):
+        self.meta = recording.meta(pvname)
+        self.ntype = _native_type(self.meta)
+        self.dtype = np.dtype(cast.native_dtype(self.ntype))
+        self.columns = recording.read(pvname, start=start, stop=stop)
+        self.timestamps = self.columns['timestamp'].view(np.int64)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def values(self, idx):
+        '''The native values of a record, as received (see cast.copy_args)'''
+        value = self.columns['value'][idx]
+        if 'length' in self.columns:
+            value = value[:self.columns['length'][idx]]
+        return np.array(value, dtype=self.dtype, ndmin=1)
+
+    def header(self, idx, ftype):
+        '''The header fields of a record, for a subscription of type ftype
+        (None for native types)'''
+        columns = self.columns
+        if ftype in dbr.time_types:
+            stamp = int(self.timestamps[idx])
+            return dict(status=int(columns['status'][idx]),
+                        severity=int(columns['severity'][idx]),
+                        timestamp=_unixtime(stamp),
+                        timestamp_ns=stamp)
+        elif ftype in dbr.control_types:
+            return dict(status=int(columns['status'][idx]),
+                        severity=int(columns['severity'][idx]))
+        return None
+
+
+class ReplayMonitorCallback(MonitorCallback):
+    '''Callback type 'monitor' of a replay
+
+    There is nothing to subscribe to: the replay hands the handler its
+    events, and the current update is sent on creation.
+    '''
+    def create(self):
+        self._create_buffer()
+        self.evid = self.handler_id
+        self.context._initial_update(self)
+
+    def destroy(self):
+        ChannelCallbackBase.destroy(self)
+        self.evid = None
+
+
+class ReplayContextHandler(CAContextHandler):
+    '''A context handler replaying a recording, in place of Channel Access
+
+    Parameters
+    ----------
+    recording : recorder.Recording or str
+        the recording, or its directory
+    ctx : int, optional
+    '''
+    backend = 'replay'
+    callback_classes = {'connection': ConnectionCallback,
+                        'monitor': ReplayMonitorCallback,
+                        }
+
+    def __init__(self, recording, ctx=0):
+        super().__init__(ctx)
+        self.driver = 'replay'
+        if not isinstance(recording, Recording):
+            recording = Recording(recording)
+        self.recording = recording
+
+        self._recorded = set(recording.pvnames)
+        self._records = {}
+        self._connected = set()
+        # the latest replayed record by channel: (records, index)
+        self._latest = {}
+
+    def _channel_records(self, chid):
+        '''The records of a channel's PV (all of them)'''
+        pvname = self.channel_to_pv[chid]
+        records = self._records.get(pvname, None)
+        if records is None:
+            records = self._records[pvname] = _Records(self.recording, pvname)
+        return records
+
+    def _current(self, chid):
+        '''The current record of a channel: (records, index), or None'''
+        current = self._latest.get(chid, None)
+        if current is None:
+            records = self._channel_records(chid)
+            if len(records):
+                current = (records, 0)
+        return current
+
+    # channel information
+    def _connected_chid(self, chid):
+        chid = ca.channel_id_to_int(chid)
+        if chid not in self._connected:
+            raise errors.ChannelAccessException('Channel not connected')
+        return chid
+
+    def field_type(self, chid):
+        chid = ca.channel_id_to_int(chid)
+        if chid not in self._connected:
+            return -1
+        return self._channel_records(chid).ntype
+
+    def element_count(self, chid):
+        chid = ca.channel_id_to_int(chid)
+        if chid not in self._connected:
+            return 0
+        return self._channel_records(chid).meta['count']
+
+    def host_name(self, chid):
+        if not self.is_connected(chid):
+            return '<disconnected>'
+        return 'replay:{}'.format(self.recording.directory)
+
+    def read_access(self, chid):
+        return int(self.is_connected(chid))
+
+    def write_access(self, chid):
+        return 0
+
+    def access(self, chid):
+        return 'read-only' if self.is_connected(chid) else 'no access'
+
+    def is_connected(self, chid):
+        return ca.channel_id_to_int(chid) in self._connected
+
+    # channels
+    def _add_channel(self, pvname):
+        chid = next(_cids)
+        self.channel_to_pv[chid] = pvname
+        self.pv_to_channel[pvname] = chid
+        if pvname in self._recorded:
+            self._loop.call_soon_threadsafe(self._connect, chid)
+        return chid
+
+    def _connect(self, chid):
+        if chid not in self.channel_to_pv:
+            # cleared before it could connect
+            return
+        self._connected.add(chid)
+        self._process_batch([('connection', dict(chid=chid, connected=True),
+                              time.monotonic())])
+
+    def request_flush(self):
+        pass
+
+    def clear_channel(self, pvname):
+        with self._sub_lock:
+            chid = self.pv_to_channel[pvname]
+            super().clear_channel(pvname)
+            self._connected.discard(chid)
+            self._latest.pop(chid, None)
+
+    # requests
+    def pending_requests(self):
+        return 0
+
+    def get_request(self, chid, ftype, count):
+        '''A done future, with the current record of the channel'''
+        chid = self._connected_chid(chid)
+        current = self._current(chid)
+        if current is None:
+            raise errors.ChannelAccessException(
+                'No records of {}'.format(self.channel_to_pv[chid]))
+        records, idx = current
+        values = records.values(idx)
+        header = records.header(idx, ftype)
+        if header is not None:
+            header = _ReplayHeader(ftype, header)
+
+        future = asyncio.Future(loop=self._loop)
+        future.set_result([header, values])
+        return future
+
+    def put_request(self, chid, value, *, wait=True):
+        chid = self._connected_chid(chid)
+        raise errors.ChannelAccessException(
+            '{} is replayed, and cannot be written'
+            ''.format(self.channel_to_pv[chid]))
+
+    def flush(self):
+        pass
+
+    # monitor events
+    def _event(self, handler, records, idx):
+        '''The event of a record, as the client would queue it'''
+        values = records.values(idx)
+        if handler.count:
+            values = values[:handler.count]
+
+        if handler.buffer is not None:
+            seq, value = handler.buffer.write_array(values)
+        else:
+            value = cast.unpack_values(values, len(values), records.ntype)
+
+        info = dict(ftype=handler.ftype, count=len(values), chid=handler.chid,
+                    status=dbr.ECA.NORMAL, value=value,
+                    handler_id=handler.handler_id)
+        if handler.buffer is not None:
+            info['seq'] = seq
+        header = records.header(idx, handler.ftype)
+        if header is not None:
+            info.update(header)
+        return ('monitor', info, time.monotonic())
+
+    def _monitor_handlers(self, chid):
+        try:
+            return list(self._cbreg.handlers_by_chid[chid]['monitor'])
+        except KeyError:
+            return []
+
+    def _initial_update(self, handler):
+        '''Send a new subscription the current update of its channel'''
+        def send():
+            if handler.handler_id not in self._cbreg.handlers:
+                return
+            current = self._current(handler.chid)
+            if current is not None:
+                self._process_batch([self._event(handler, *current)])
+
+        self._loop.call_soon_threadsafe(send)
+
+    def _schedule(self, pvnames, start, stop):
+        '''The records to replay, merged by timestamp
+
+        Returns
+        -------
+        timestamps : ndarray
+            int64 nanoseconds, in replay order
+        sources : list of (chid, records, indices)
+            for each of `timestamps`, by the position of its PV in the list
+        order : ndarray
+            the index into `sources` of each of `timestamps`
+        indices : ndarray
+            the record number of each of `timestamps`
+        '''
+        sources = []
+        for pvname in sorted(pvnames):
+            chid = self.pv_to_channel.get(pvname, None)
+            if chid is None or pvname not in self._recorded:
+                continue
+            records = _Records(self.recording, pvname, start=start,
+                               stop=stop)
+            if len(records):
+                sources.append((chid, records))
+
+        if not sources:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, sources, empty, empty
+
+        timestamps = np.concatenate([records.timestamps
+                                     for chid, records in sources])
+        order = np.concatenate([np.full(len(records), i, dtype=np.int64)
+                                for i, (chid, records) in enumerate(sources)])
+        indices = np.concatenate([np.arange(len(records))
+                                  for chid, records in sources])
+        # (stable: ties stay in PV name, then record, order)
+        merged = np.argsort(timestamps, kind='mergesort')
+        return (timestamps[merged], sources, order[merged], indices[merged])
+
+    @asyncio.coroutine
+    def replay(self, *, speed=None, start=None, stop=None, pvnames=None,
+               batch_size=None):
+        '''Replay the recorded updates into the subscriptions
+
+        Parameters
+        ----------
+        speed : float, optional
+            None (the default) replays as fast as the callbacks take the
+            updates; otherwise, the updates are paced by their timestamps,
+            `speed` times faster than recorded (1.0: as recorded)
+        start, stop : optional
+            the times to replay from (inclusive) and to (exclusive), as taken
+            by `recorder.Recording.read`
+        pvnames : list of str, optional
+            the PVs to replay (default: all those of the recording with a
+            channel in this context)
+        batch_size : int, optional
+            the most updates dispatched in one batch (default:
+            `event_batch_size`)
+
+        Returns
+        -------
+        stats : dict
+            updates (the records replayed), events (the monitor events
+            dispatched, one per subscription of each update), batches,
+            seconds, updates_per_second, and max_lateness and mean_lateness
+            (in seconds, behind the recorded pace; 0 when speed is None)
+        '''
+        if speed is not None and speed <= 0:
+            raise ValueError('speed must be positive')
+        if batch_size is None:
+            batch_size = self.event_batch_size
+        if pvnames is None:
+            pvnames = list(self.pv_to_channel)
+
+        timestamps, sources, order, indices = self._schedule(pvnames, start,
+                                                             stop)
+        num = len(timestamps)
+        loop = self._loop
+        events = batches = 0
+        max_lateness = total_lateness = 0.0
+
+        t0 = loop.time()
+        pos = 0
+        while pos < num:
+            end = min(num, pos + batch_size)
+            if speed is not None:
+                # the updates due by now
+                elapsed = (loop.time() - t0) * speed
+                due = timestamps[0] + int(elapsed * 1e9)
+                end = min(end, int(np.searchsorted(timestamps[:end], due,
+                                                   'right')))
+                if end == pos:
+                    delay = ((timestamps[pos] - timestamps[0]) * 1e-9 -
+                             elapsed) / speed
+                    yield from asyncio.sleep(delay)
+                    continue
+
+                lateness = max(0.0, elapsed - (timestamps[pos] -
+                                               timestamps[0]) * 1e-9) / speed
+                max_lateness = max(max_lateness, lateness)
+                total_lateness += lateness * (end - pos)
+
+            batch = []
+            latest = {}
+            for source, idx in zip(order[pos:end], indices[pos:end]):
+                chid, records = sources[source]
+                idx = int(idx)
+                self._latest[chid] = (records, idx)
+                for handler in self._monitor_handlers(chid):
+                    event = self._event(handler, records, idx)
+                    if handler.coalesce:
+                        prior = latest.get(handler.handler_id, None)
+                        if prior is not None:
+                            # latest value wins, as live
+                            batch[prior] = event
+                            handler.dropped += 1
+                            continue
+                        latest[handler.handler_id] = len(batch)
+                    batch.append(event)
+
+            if batch:
+                self._process_batch(batch)
+            events += len(batch)
+            batches += 1
+            pos = end
+            # (let the loop run between batches, as it would live)
+            yield from asyncio.sleep(0)
+
+        seconds = loop.time() - t0
+        return dict(updates=num,
+                    events=events,
+                    batches=batches,
+                    seconds=seconds,
+                    updates_per_second=(num / seconds if seconds > 0
+                                        else float('inf')),
+                    max_lateness=max_lateness,
+                    mean_lateness=(total_lateness / num if num else 0.0),
+                    )
+
+    # life cycle
+    def start(self):
+        pass
+
+    def stop(self):
+        if not self._running:
+            return
+
+        for chid, pvname in list(self.channel_to_pv.items()):
+            logger.debug('Destroying channel %s (%d)', pvname, chid)
+            self.clear_channel(pvname)
+
+        self._cbreg.shutdown()
+        self._running = False
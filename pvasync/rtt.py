@@ -0,0 +1,141 @@
+'''Round-trip time and bandwidth estimates, per server
+
+Every completed get request is a sample of its server's responsiveness: the
+time from the request being queued to its reply being handled on the event
+loop, for a known number of payload bytes. Each server (keyed on its host
+name, as from `CAContextHandler.host_name`) keeps a smoothed round-trip time
+and its variation, as TCP does for its retransmission timeout (RFC 6298),
+and a smoothed bandwidth from the samples with large payloads.
+
+Default request timeouts are derived from those: the retransmission timeout
+``srtt + 4 * rttvar``, plus the time to transfer the payload at the
+estimated bandwidth, and never less than config.MIN_REQUEST_TIMEOUT. Large
+requests to a server with no bandwidth estimate yet keep the caller's
+default.
+'''
+from . import config
+
+
+class RoundTripEstimate:
+    '''The round-trip time and bandwidth estimates of one server'''
+    # gains of the smoothed round-trip time and its variation (RFC 6298)
+    alpha = 1 / 8
+    beta = 1 / 4
+    # gain of the smoothed bandwidth
+    gamma = 1 / 4
+    # payloads of at least this many bytes are bandwidth samples
+    min_bandwidth_bytes = 16384
+    # the largest timeout multiplier after consecutive timeouts
+    max_backoff = 8
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.bandwidth = None
+        self.samples = 0
+        self.timeouts = 0
+        self.backoff = 1
+
+    def record(self, elapsed, nbytes=0):
+        '''Add a sample: a reply of nbytes, `elapsed` seconds after its
+        request'''
+        self.samples += 1
+        self.backoff = 1
+
+        if (nbytes >= self.min_bandwidth_bytes and self.srtt is not None and
+                elapsed > self.srtt):
+            # the time beyond a round trip is taken to be the transfer
+            bandwidth = nbytes / (elapsed - self.srtt)
+            if self.bandwidth is None:
+                self.bandwidth = bandwidth
+            else:
+                self.bandwidth += self.gamma * (bandwidth - self.bandwidth)
+            return
+
+        if self.srtt is None:
+            self.srtt = elapsed
+            self.rttvar = elapsed / 2
+        else:
+            self.rttvar += self.beta * (abs(self.srtt - elapsed) -
+                                        self.rttvar)
+            self.srtt += self.alpha * (elapsed - self.srtt)
+
+    def record_timeout(self):
+        '''A request timed out: back off, until the next sample'''
+        self.timeouts += 1
+        self.backoff = min(2 * self.backoff, self.max_backoff)
+
+    def timeout(self, nbytes=0):
+        '''The timeout for a request with a payload of nbytes
+
+        None if there are no samples yet.
+        '''
+        if self.srtt is None:
+            return None
+
+        timeout = self.srtt + 4 * self.rttvar
+        if nbytes and self.bandwidth:
+            timeout += nbytes / self.bandwidth
+        return self.backoff * max(timeout, config.MIN_REQUEST_TIMEOUT)
+
+    def to_dict(self):
+        return dict(srtt=self.srtt,
+                    rttvar=self.rttvar,
+                    bandwidth=self.bandwidth,
+                    samples=self.samples,
+                    timeouts=self.timeouts,
+                    timeout=self.timeout(),
+                    )
+
+
+class RoundTripStats:
+    '''Round-trip estimates of all servers, keyed on host name'''
+    def __init__(self):
+        self.hosts = {}
+
+    def _estimate(self, host):
+        try:
+            return self.hosts[host]
+        except KeyError:
+            estimate = self.hosts[host] = RoundTripEstimate()
+            return estimate
+
+    def record(self, host, elapsed, nbytes=0):
+        self._estimate(host).record(elapsed, nbytes)
+
+    def record_timeout(self, host):
+        self._estimate(host).record_timeout()
+
+    def timeout(self, host, nbytes=0, default=None):
+        '''The timeout for a request to `host` with a payload of nbytes
+
+        `default` if there is no estimate for the host yet. Until the host
+        has a bandwidth estimate, a request with a large payload (one which
+        would be a bandwidth sample) is given at least `default` as well:
+        round trips of small requests say nothing of how long its transfer
+        takes, and if it timed out the estimate would never be acquired.
+        '''
+        estimate = self.hosts.get(host, None)
+        if estimate is not None:
+            timeout = estimate.timeout(nbytes)
+            if timeout is not None:
+                if (default is not None and estimate.bandwidth is None and
+                        nbytes >= estimate.min_bandwidth_bytes):
+                    return max(timeout, default)
+                return timeout
+        return default
+
+    def estimate(self, host):
+        '''The current estimates for `host`, as a dictionary (or None)'''
+        estimate = self.hosts.get(host, None)
+        if estimate is None:
+            return None
+        return estimate.to_dict()
+
+    def snapshot(self):
+        '''The current estimates of every host'''
+        return {host: estimate.to_dict()
+                for host, estimate in self.hosts.items()}
+
+    def reset(self):
+        self.hosts.clear()
@@ -0,0 +1,648 @@
+"""
+A Channel Access server on asyncio, serving in-memory PVs
+
+This is meant for tests and benchmarks: it needs no EPICS installation, and
+either client backend (libca or ca_client) can connect to it over loopback.
+PVs of every native DBR type are served, and can be read as any of their
+STS, TIME and CTRL types.
+
+From the command line::
+
+    pvasync-server --port 5064 --update-rate 10 --latency 0.001
+
+(or ``python -m pvasync.server``) serves the default PVs (those used by the
+tests, in tests/pvnames.py) until interrupted, and prints the environment a
+client needs to find it. If libca is not installed, run it with
+PVASYNC_BACKEND=asyncio, as importing pvasync otherwise loads libca. In the
+tests, setting PVASYNC_TEST_SERVER=1 serves them from a thread of the test
+process instead (see tests/conftest.py).
+"""
+import argparse
+import asyncio
+import logging
+import threading
+import time
+
+import numpy as np
+
+from . import ca_protocol as proto
+from . import cast
+from . import dbr
+from .ca_protocol import Command
+from .dbr import (ChannelType, ECA, SubscriptionType)
+from .utils import decode_bytes
+
+
+logger = logging.getLogger(__name__)
+
+_type_names = {ChannelType.STRING: 'string',
+               ChannelType.SHORT: 'short',
+               ChannelType.FLOAT: 'float',
+               ChannelType.ENUM: 'enum',
+               ChannelType.CHAR: 'char',
+               ChannelType.LONG: 'long',
+               ChannelType.DOUBLE: 'double',
+               }
+
+# posted on a change of value
+_value_mask = SubscriptionType.DBE_VALUE | SubscriptionType.DBE_LOG
+
+
+class ServedPV:
+    '''An in-memory PV
+
+    Parameters
+    ----------
+    name : str
+        PV name
+    value : scalar, str or sequence
+        initial value
+    native_type : int, optional
+        native DBR type (by default, DOUBLE for numbers, STRING for str and
+        ENUM if `enum_strs` are given)
+    count : int, optional
+        element count (by default, the length of the initial value)
+    units : str, optional
+    precision : int, optional
+    enum_strs : sequence of str, optional
+    update_rate : float, optional
+        number of simulated updates per second (see `step`)
+    **limits
+        the control, display, alarm and warning limits, named as in
+        dbr.CtrlLims (upper_disp_limit, ...)
+    '''
+    def __init__(self, name, value, *, native_type=None, count=None,
+                 units='', precision=0, enum_strs=None, update_rate=None,
+                 **limits):
+        if native_type is None:
+            if enum_strs:
+                native_type = ChannelType.ENUM
+            elif isinstance(value, str) or (isinstance(value, (list, tuple))
+                                            and value and
+                                            isinstance(value[0], str)):
+                native_type = ChannelType.STRING
+            else:
+                native_type = ChannelType.DOUBLE
+
+        self.name = name
+        self.native_type = ChannelType(native_type)
+        self.dtype = cast.native_dtype(self.native_type)
+        self.values = self._to_array(value)
+        self.count = count or len(self.values)
+        if self.count > len(self.values):
+            padded = np.zeros(self.count, dtype=self.dtype)
+            padded[:len(self.values)] = self.values
+            self.values = padded
+        self.values = self.values[:self.count]
+        self.update_rate = update_rate
+        self.fields = dict(status=0, severity=0, timestamp=time.time(),
+                           units=units, precision=precision,
+                           enum_strs=tuple(enum_strs or ()))
+        self.fields.update(limits)
+        # (circuit, subscription id) to (ftype, count, mask)
+        self.subscribers = {}
+
+    def __repr__(self):
+        return ('{0.__class__.__name__}({0.name!r}, type={1}, count={0.count})'
+                ''.format(self, _type_names[self.native_type]))
+
+    def _to_array(self, value):
+        if self.native_type == ChannelType.STRING:
+            if isinstance(value, str):
+                value = [value]
+            value = [elem.encode('latin-1') if isinstance(elem, str) else elem
+                     for elem in value]
+        elif isinstance(value, str):
+            # character waveform
+            value = list(value.encode('latin-1'))
+        return np.array(value, dtype=self.dtype, ndmin=1)
+
+    def _convert(self, values, from_type, to_type):
+        '''Convert an array of values between native types'''
+        if from_type == to_type:
+            return values
+
+        enum_strs = self.fields['enum_strs']
+        dtype = cast.native_dtype(to_type)
+        if to_type == ChannelType.STRING:
+            if from_type == ChannelType.ENUM:
+                strs = [enum_strs[v] if v < len(enum_strs) else str(v)
+                        for v in values]
+            elif from_type in dbr.native_float_types:
+                fmt = '%.{}f'.format(self.fields['precision'])
+                strs = [fmt % v for v in values]
+            else:
+                strs = [str(v) for v in values]
+            return np.array([s.encode('latin-1') for s in strs], dtype=dtype)
+
+        if from_type == ChannelType.STRING:
+            converted = np.zeros(len(values), dtype=dtype)
+            for i, elem in enumerate(values):
+                text = decode_bytes(elem)
+                if text in enum_strs:
+                    converted[i] = enum_strs.index(text)
+                else:
+                    try:
+                        converted[i] = float(text)
+                    except ValueError:
+                        pass
+            return converted
+        return values.astype(dtype)
+
+    def read(self, ftype, count):
+        '''Encode the value for a request of DBR type `ftype`
+
+        Returns
+        -------
+        payload : bytes
+        count : int
+            element count sent: that of the value if `count` is 0
+        '''
+        values = self._convert(self.values, self.native_type,
+                               dbr.native_type(ftype))
+        if count and count != len(values):
+            resized = np.zeros(count, dtype=values.dtype)
+            resized[:len(values)] = values[:count]
+            values = resized
+        return proto.encode_dbr(ftype, values, **self.fields), len(values)
+
+    def write(self, ftype, count, payload):
+        '''Set the value from a put of DBR type `ftype`'''
+        _, values = proto.decode_dbr(ftype, count, payload)
+        values = self._convert(values, dbr.native_type(ftype),
+                               self.native_type)
+        self.values = values[:self.count].copy()
+        self.fields['timestamp'] = time.time()
+        self.post(_value_mask)
+
+    def set_fields(self, **fields):
+        '''Change the alarm status, severity, units, limits, etc
+
+        Subscribers are sent an update on alarm (DBE_ALARM) or property
+        (DBE_PROPERTY) changes, as appropriate.
+        '''
+        mask = 0
+        for key, value in fields.items():
+            if self.fields.get(key, None) == value:
+                continue
+            if key in ('status', 'severity'):
+                mask |= SubscriptionType.DBE_ALARM
+            else:
+                mask |= SubscriptionType.DBE_PROPERTY
+            self.fields[key] = value
+
+        if mask:
+            self.post(mask)
+
+    def step(self):
+        '''Make a simulated update: increment scalars, rotate arrays'''
+        values = self.values
+        if self.native_type == ChannelType.STRING:
+            millis = int(time.time() * 1000) % 1000
+            # (formatted as str, then encoded: bytes formatting needs
+            # Python 3.5)
+            values = np.array([('%s %d' % (decode_bytes(v).split(' ')[0],
+                                           millis)).encode('latin-1')
+                               for v in values], dtype=self.dtype)
+        elif len(values) > 1:
+            values = np.roll(values, 1)
+        elif self.native_type == ChannelType.ENUM:
+            values = (values + 1) % max(1, len(self.fields['enum_strs']))
+        else:
+            values = values + 1
+
+        self.values = values.astype(self.dtype)
+        self.fields['timestamp'] = time.time()
+        self.post(_value_mask)
+
+    def subscribe(self, circuit, subid, ftype, count, mask):
+        self.subscribers[(circuit, subid)] = (ftype, count, mask)
+        # the current value is sent on subscribing
+        circuit.send_event(subid, self, ftype, count)
+
+    def unsubscribe(self, circuit, subid):
+        self.subscribers.pop((circuit, subid), None)
+
+    def post(self, mask):
+        '''Send an update to the subscriptions on any of `mask`'''
+        for (circuit, subid), (ftype, count,
+                               sub_mask) in list(self.subscribers.items()):
+            if sub_mask & mask:
+                circuit.send_event(subid, self, ftype, count)
+
+
+class ServerCircuit(asyncio.Protocol):
+    '''A TCP connection from one client'''
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.client = None
+        # sid to (ServedPV, cid)
+        self.channels = {}
+        # subscription id to (ServedPV, sid)
+        self.subscriptions = {}
+        self._sids = 0
+        self._buffer = bytearray()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.client = transport.get_extra_info('peername')
+        self.server.circuits.add(self)
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self.server.circuits.discard(self)
+        for subid, (pv, sid) in self.subscriptions.items():
+            pv.unsubscribe(self, subid)
+        self.subscriptions.clear()
+        self.channels.clear()
+
+    def data_received(self, data):
+        buf = self._buffer
+        buf += data
+        offset = 0
+        while True:
+            message, offset = proto.unpack(buf, offset)
+            if message is None:
+                break
+            try:
+                self.handle(message)
+            except Exception as ex:
+                logger.error('Failed to handle %s from %s', message[:5],
+                             self.client, exc_info=ex)
+
+        message = None
+        try:
+            del buf[:offset]
+        except BufferError:
+            self._buffer = buf[offset:]
+
+    def send(self, data):
+        if self.transport is None:
+            return
+
+        latency = self.server.latency
+        if latency:
+            self.server.loop.call_later(latency, self._write, data)
+        else:
+            self.transport.write(data)
+
+    def _write(self, data):
+        if self.transport is not None:
+            self.transport.write(data)
+
+    def send_event(self, subid, pv, ftype, count):
+        payload, count = pv.read(ftype, count)
+        self.send(proto.pack(Command.EVENT_ADD, payload, data_type=ftype,
+                             data_count=count, param1=ECA.NORMAL,
+                             param2=subid))
+
+    def handle(self, message):
+        command = message.command
+        if command in (Command.READ_NOTIFY, Command.WRITE_NOTIFY,
+                       Command.WRITE, Command.EVENT_ADD):
+            try:
+                pv, cid = self.channels[message.param1]
+            except KeyError:
+                self.send(proto.error(message, 0, ECA.BADCHID,
+                                      'Unknown channel'))
+                return
+
+        if command == Command.READ_NOTIFY:
+            payload, count = pv.read(message.data_type, message.data_count)
+            self.send(proto.pack(Command.READ_NOTIFY, payload,
+                                 data_type=message.data_type,
+                                 data_count=count, param1=ECA.NORMAL,
+                                 param2=message.param2))
+        elif command in (Command.WRITE_NOTIFY, Command.WRITE):
+            status = ECA.NORMAL
+            try:
+                pv.write(message.data_type, message.data_count,
+                         message.payload)
+            except Exception as ex:
+                logger.debug('Put to %s failed', pv.name, exc_info=ex)
+                status = ECA.PUTFAIL
+
+            if command == Command.WRITE_NOTIFY:
+                self.send(proto.pack(Command.WRITE_NOTIFY,
+                                     data_type=message.data_type,
+                                     data_count=message.data_count,
+                                     param1=status, param2=message.param2))
+        elif command == Command.EVENT_ADD:
+            mask = proto.decode_event_add(message.payload)
+            self.subscriptions[message.param2] = (pv, message.param1)
+            pv.subscribe(self, message.param2, message.data_type,
+                         message.data_count, mask)
+        elif command == Command.EVENT_CANCEL:
+            pv, sid = self.subscriptions.pop(message.param2, (None, None))
+            if pv is not None:
+                pv.unsubscribe(self, message.param2)
+            self.send(proto.pack(Command.EVENT_ADD,
+                                 data_type=message.data_type,
+                                 param1=message.param1,
+                                 param2=message.param2))
+        elif command == Command.CREATE_CHAN:
+            self._create_chan(message)
+        elif command == Command.CLEAR_CHANNEL:
+            self.channels.pop(message.param1, None)
+            for subid, (pv, sid) in list(self.subscriptions.items()):
+                if sid == message.param1:
+                    pv.unsubscribe(self, subid)
+                    del self.subscriptions[subid]
+            self.send(proto.pack(Command.CLEAR_CHANNEL,
+                                 param1=message.param1,
+                                 param2=message.param2))
+        elif command == Command.VERSION:
+            self.send(proto.version())
+        elif command == Command.ECHO:
+            self.send(proto.echo())
+
+    def _create_chan(self, message):
+        name = decode_bytes(bytes(message.payload))
+        cid = message.param1
+        pv = self.server.pvs.get(name, None)
+        if pv is None:
+            self.send(proto.pack(Command.CREATE_CH_FAIL, param1=cid))
+            return
+
+        self._sids += 1
+        sid = self._sids
+        self.channels[sid] = (pv, cid)
+        access = proto.ACCESS_READ | proto.ACCESS_WRITE
+        self.send(proto.pack(Command.ACCESS_RIGHTS, param1=cid,
+                             param2=access) +
+                  proto.pack(Command.CREATE_CHAN, data_type=pv.native_type,
+                             data_count=pv.count, param1=cid, param2=sid))
+
+
+class SearchResponder(asyncio.DatagramProtocol):
+    '''Answers name searches for the server's PVs'''
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        replies = []
+        offset = 0
+        while True:
+            message, offset = proto.unpack(data, offset)
+            if message is None:
+                break
+            if message.command != Command.SEARCH:
+                continue
+
+            name = decode_bytes(bytes(message.payload))
+            if name in self.server.pvs:
+                replies.append(proto.search_reply(message.param2,
+                                                  self.server.port))
+
+        if replies:
+            datagram = proto.version() + b''.join(replies)
+            latency = self.server.latency
+            if latency:
+                self.server.loop.call_later(latency, self.transport.sendto,
+                                            datagram, address)
+            else:
+                self.transport.sendto(datagram, address)
+
+
+class CAServer:
+    '''A Channel Access server for in-memory PVs
+
+    Parameters
+    ----------
+    pvs : sequence of ServedPV, optional
+        PVs to serve (default: `default_pvs()`)
+    host : str, optional
+        interface to listen on (default: loopback)
+    port : int, optional
+        TCP and UDP port (default: any free port)
+    latency : float, optional
+        artificial delay, in seconds, added to every reply
+    pause_pv : str, optional
+        name of a PV which, when non-zero, pauses the simulated updates
+    '''
+    def __init__(self, pvs=None, *, host='127.0.0.1', port=0, latency=0.0,
+                 pause_pv='Py:pause'):
+        if pvs is None:
+            pvs = default_pvs()
+
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.pause_pv = pause_pv
+        self.circuits = set()
+        self.loop = None
+        self._thread = None
+        self._server = None
+        self._udp = None
+        self._timers = {}
+
+        self.pvs = {}
+        for pv in pvs:
+            self.add_pv(pv)
+
+    def add_pv(self, pv):
+        self.pvs[pv.name] = pv
+        if self._server is not None:
+            self._schedule_update(pv)
+
+    @property
+    def env(self):
+        '''The environment a client needs to find this server'''
+        return dict(EPICS_CA_ADDR_LIST='{}:{}'.format(self.host, self.port),
+                    EPICS_CA_AUTO_ADDR_LIST='NO')
+
+    @property
+    def paused(self):
+        pv = self.pvs.get(self.pause_pv, None)
+        return pv is not None and bool(pv.values[0])
+
+    @asyncio.coroutine
+    def start(self):
+        '''Start serving, on the current event loop'''
+        self.loop = loop = asyncio.get_event_loop()
+        self._server = yield from loop.create_server(
+            lambda: ServerCircuit(self), self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._udp, _ = yield from loop.create_datagram_endpoint(
+            lambda: SearchResponder(self), local_addr=(self.host, self.port))
+
+        for pv in self.pvs.values():
+            self._schedule_update(pv)
+        logger.info('Serving %d PVs on %s:%d', len(self.pvs), self.host,
+                    self.port)
+
+    def _schedule_update(self, pv):
+        if pv.update_rate:
+            self._timers[pv.name] = self.loop.call_later(
+                1.0 / pv.update_rate, self._update, pv)
+
+    def _update(self, pv):
+        if not self.paused:
+            pv.step()
+        self._schedule_update(pv)
+
+    def start_in_thread(self, timeout=5.0):
+        '''Start serving on an event loop in a new (daemon) thread
+
+        Clients in this process can then use the server while their own
+        event loop is blocked or not running. Stop it with `stop`.
+        '''
+        started = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(self.start())
+            finally:
+                started.set()
+            loop.run_forever()
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name='CAServer',
+                                        daemon=True)
+        self._thread.start()
+        if not started.wait(timeout) or self._server is None:
+            raise RuntimeError('Server failed to start')
+
+    def stop(self):
+        '''Stop serving, closing all connections'''
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self.loop.call_soon_threadsafe(self._stop)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            thread.join()
+        else:
+            self._stop()
+
+    def _stop(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+
+        for circuit in list(self.circuits):
+            if circuit.transport is not None:
+                circuit.transport.close()
+
+        if self._udp is not None:
+            self._udp.close()
+            self._udp = None
+
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+
+def default_pvs(prefix='Py:', update_rate=1.0):
+    '''The PVs the tests use (see tests/pvnames.py), and one scalar and one
+    array PV of each native type, named `{prefix}types:{type}` and
+    `{prefix}types:{type}_array`
+
+    The PVs which the tests expect to update are updated `update_rate` times
+    per second.
+    '''
+    def pv(name, value, **kwargs):
+        return ServedPV(prefix + name, value, **kwargs)
+
+    def updating(name, value, **kwargs):
+        return pv(name, value, update_rate=update_rate, **kwargs)
+
+    limits = dict(upper_disp_limit=100.0, lower_disp_limit=-100.0,
+                  upper_alarm_limit=90.0, lower_alarm_limit=-90.0,
+                  upper_warning_limit=80.0, lower_warning_limit=-80.0,
+                  upper_ctrl_limit=100.0, lower_ctrl_limit=-100.0)
+    pvs = [updating('ao1', 1.0, units='microns', precision=4, **limits),
+           updating('ao2', 2.0, precision=3, **limits),
+           pv('ao3', 3.0, native_type=ChannelType.FLOAT, precision=2),
+           pv('ao4', 4.0, precision=3),
+           updating('ai1', 0.0, precision=3),
+           pv('ao1.DESC', 'ao'),
+           pv('ao1.PROC', 0, native_type=ChannelType.CHAR),
+           pv('pause', 0, native_type=ChannelType.LONG),
+           updating('long1', 1, native_type=ChannelType.LONG),
+           pv('long2', 2, native_type=ChannelType.LONG),
+           pv('mbbo1', 0,
+              enum_strs=('Stop', 'Start', 'Pause', 'Resume')),
+           pv('string128', ['str{}'.format(i) for i in range(128)]),
+           pv('waveform_char256', [0] * 256, native_type=ChannelType.CHAR),
+           updating('char256', 'char256 updating string',
+                    native_type=ChannelType.CHAR, count=256),
+           ]
+
+    for count, suffix in ((128, '128'), (2048, '2k'), (65536, '64k')):
+        pvs.append(pv('char' + suffix, np.arange(count) % 256,
+                      native_type=ChannelType.CHAR))
+        pvs.append(pv('long' + suffix, np.arange(count),
+                      native_type=ChannelType.LONG))
+        pvs.append(pv('double' + suffix, np.arange(count) * 0.5))
+
+    for ntype, name in _type_names.items():
+        if ntype == ChannelType.STRING:
+            scalar, array = 'string', ['string{}'.format(i) for i in range(16)]
+        else:
+            scalar, array = 1, np.arange(16)
+
+        enum_strs = None
+        if ntype == ChannelType.ENUM:
+            enum_strs = ['state{}'.format(i) for i in range(16)]
+        pvs.append(pv('types:' + name, scalar, native_type=ntype,
+                      enum_strs=enum_strs))
+        pvs.append(pv('types:{}_array'.format(name), array,
+                      native_type=ntype, enum_strs=enum_strs))
+    return pvs
+
+
+def pvs_from_file(fn, update_rate=None):
+    '''Scalar DOUBLE PVs for each name in a file (one per line)'''
+    with open(fn, 'rt') as f:
+        names = [line.strip() for line in f]
+
+    return [ServedPV(name, 0.0, update_rate=update_rate)
+            for name in names if name and not name.startswith('#')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Serve in-memory PVs over Channel Access')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='interface to listen on')
+    parser.add_argument('--port', type=int, default=proto.CA_SERVER_PORT,
+                        help='TCP and UDP port (0 for any)')
+    parser.add_argument('--prefix', default='Py:',
+                        help='prefix of the default PV names')
+    parser.add_argument('--update-rate', type=float, default=1.0,
+                        help='updates per second of the updating PVs')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='artificial delay added to each reply (s)')
+    parser.add_argument('--pvlist', action='append', default=[],
+                        help=('also serve a DOUBLE PV for each name in '
+                              'this file'))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    pvs = default_pvs(prefix=args.prefix, update_rate=args.update_rate)
+    for fn in args.pvlist:
+        pvs.extend(pvs_from_file(fn))
+
+    server = CAServer(pvs, host=args.host, port=args.port,
+                      latency=args.latency)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(server.start())
+    for key, value in sorted(server.env.items()):
+        print('{}={}'.format(key, value))
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+Monitor updates as asynchronous iterators
+
+A MonitorStream is a consumer of a PV's monitor updates with its own bounded
+queue, so that a slow consumer only ever delays itself::
+
+    stream = pv.monitor(maxsize=100, policy='drop_oldest')
+    async for event in stream:
+        print(event['value'], event['timestamp'])
+
+(or ``event = yield from stream.get()``, in generator-based coroutines).
+"""
+import asyncio
+import collections
+import logging
+
+from .budgets import loop_only
+
+
+logger = logging.getLogger(__name__)
+
+try:
+    StopAsyncIteration
+except NameError:
+    # Python 3.4: streams can only be read with get()
+    class StopAsyncIteration(Exception):
+        pass
+
+
+class MonitorStream:
+    '''A queue of the monitor updates of a PV, for one consumer
+
+    The stream subscribes to the channel through the context, like any other
+    monitor (sharing the libca subscription when possible), as soon as the PV
+    is connected. Updates are queued as the keyword arguments a monitor
+    callback would receive (value, status, severity, timestamp, ... for the
+    PV's form), without the rest of the PV's state.
+
+    Parameters
+    ----------
+    pv : PV
+    maxsize : int, optional
+        maximum number of updates queued
+    policy : {'drop_oldest', 'latest', 'drop_newest'}, optional
+        what to do with a new update when the queue is full:
+
+        * 'drop_oldest': discard the oldest queued update
+        * 'latest': keep only the newest update (`maxsize` is then 1)
+        * 'drop_newest': discard the new update, keeping those queued.
+          (Channel access updates cannot be held back, so there is no
+          policy which blocks.)
+    mask : int, optional
+        subscription mask (default: that of the PV)
+
+    Attributes
+    ----------
+    received : int
+        number of updates received
+    dropped : int
+        number of updates discarded by the policy
+    '''
+    policies = ('drop_oldest', 'latest', 'drop_newest')
+
+    def __init__(self, pv, *, maxsize=100, policy='drop_oldest', mask=None):
+        if policy not in self.policies:
+            raise ValueError('Unknown policy {!r}; choose from {}'
+                             ''.format(policy, self.policies))
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        if policy == 'latest':
+            maxsize = 1
+
+        self.pv = pv
+        self.policy = policy
+        self.maxsize = maxsize
+        self.mask = mask if mask is not None else pv.monitor_mask
+        self.received = 0
+        self.dropped = 0
+        self.closed = False
+        self._cbid = None
+        self._queue = collections.deque()
+        # the futures of consumers waiting while the queue is empty, in the
+        # order they called get()
+        self._getters = collections.deque()
+
+        if pv.connected:
+            self._subscribe()
+        else:
+            pv.connection_callbacks.append(self._on_connection)
+
+    def __repr__(self):
+        return ('{0.__class__.__name__}({0.pv.pvname!r}, policy={0.policy!r}, '
+                'maxsize={0.maxsize}, queued={1}, dropped={0.dropped})'
+                ''.format(self, len(self._queue)))
+
+    def __len__(self):
+        return len(self._queue)
+
+    def _subscribe(self):
+        ctx = self.pv._context
+        handler, self._cbid = ctx.subscribe(sig='monitor', func=self._on_event,
+                                            chid=self.pv.chid,
+                                            ftype=self.pv.ftype,
+                                            mask=self.mask)
+
+    def _on_connection(self, pvname=None, connected=None, pv=None):
+        if connected and self._cbid is None and not self.closed:
+            self._subscribe()
+
+    @loop_only
+    def _on_event(self, chid=None, handler_id=None, **kwargs):
+        '''Subscription callback (on the event loop)'''
+        if self.closed:
+            return
+
+        self.received += 1
+        queue = self._queue
+        if len(queue) >= self.maxsize:
+            self.dropped += 1
+            if self.policy == 'drop_newest':
+                return
+            queue.popleft()
+
+        queue.append(kwargs)
+        self._wake()
+
+    def _wake(self):
+        '''Wake the first consumer still waiting'''
+        while self._getters:
+            getter = self._getters.popleft()
+            if not getter.done():
+                getter.set_result(None)
+                return
+
+    @asyncio.coroutine
+    def get(self):
+        '''The next update, waiting for one if none is queued
+
+        Raises
+        ------
+        StopAsyncIteration
+            if the stream was closed and no updates are left
+        '''
+        if self._cbid is None and not self.closed:
+            yield from self.pv.wait_for_connection()
+            if self._cbid is None:
+                self._subscribe()
+
+        while not self._queue:
+            if self.closed:
+                raise StopAsyncIteration()
+            getter = asyncio.Future()
+            self._getters.append(getter)
+            try:
+                yield from getter
+            except BaseException:
+                getter.cancel()
+                try:
+                    self._getters.remove(getter)
+                except ValueError:
+                    # woken, but cancelled since: pass the update on
+                    if self._queue:
+                        self._wake()
+                raise
+
+        return self._queue.popleft()
+
+    def get_nowait(self):
+        '''The next queued update, or None'''
+        if not self._queue:
+            return None
+        return self._queue.popleft()
+
+    def close(self):
+        '''Unsubscribe. Updates already queued can still be read.'''
+        if self.closed:
+            return
+
+        self.closed = True
+        try:
+            self.pv.connection_callbacks.remove(self._on_connection)
+        except ValueError:
+            pass
+        if self._cbid is not None:
+            self.pv._context.unsubscribe(self._cbid)
+            self._cbid = None
+        # every waiting consumer finds the stream closed
+        while self._getters:
+            self._wake()
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+        event = yield from self.get()
+        return event
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
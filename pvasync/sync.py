@@ -5,13 +5,25 @@ import atexit
 from . import (ca, coroutines, context)
 
 
-def blocking_wrapper(coroutine):
+def blocking_wrapper(coroutine, *, wait_timeout=True):
+    '''Wrap a coroutine to be called synchronously
+
+    Parameters
+    ----------
+    coroutine : coroutine function
+    wait_timeout : bool, optional
+        also limit the blocking wait by the `timeout` keyword argument passed
+        to the coroutine. Disable this for coroutines which enforce their own
+        (connection and request) deadlines.
+    '''
     @functools.wraps(coroutine)
     def wrapped(*args, **kwargs):
         loop = asyncio.get_event_loop()
         future = asyncio.run_coroutine_threadsafe(coroutine(*args, **kwargs),
                                                   loop)
-        timeout = kwargs.get('timeout', None)
+        timeout = None
+        if wait_timeout:
+            timeout = kwargs.get('timeout', None)
         return future.result(timeout)
 
     return wrapped
@@ -31,15 +43,22 @@ def _background_loop(loop):
         _loop_thread = None
 
 
-def _cleanup(loop=None, *args, **kwargs):
+def _stop(loop):
     context.get_contexts().stop()
+    loop.stop()
+
 
+def _cleanup(loop=None, *args, **kwargs):
     if loop is None:
         loop = asyncio.get_event_loop()
 
-    loop.stop()
-    if _loop_thread is not None:
-        _loop_thread.join()
+    thread = _loop_thread
+    if thread is not None and loop.is_running():
+        # the contexts are stopped in the loop's thread, which they run on
+        loop.call_soon_threadsafe(_stop, loop)
+        thread.join()
+    else:
+        _stop(loop)
 
 
 def blocking_mode(loop=None):
@@ -64,4 +83,8 @@ def blocking_mode(loop=None):
 
 caget = blocking_wrapper(coroutines.caget)
 caput = blocking_wrapper(coroutines.caput)
-caget_many = blocking_wrapper(coroutines.caget_many)
+caget_many = blocking_wrapper(coroutines.caget_many, wait_timeout=False)
+caput_many = blocking_wrapper(coroutines.caput_many, wait_timeout=False)
+connect_many = blocking_wrapper(coroutines.connect_many, wait_timeout=False)
+get_timevars_many = blocking_wrapper(coroutines.get_timevars_many,
+                                     wait_timeout=False)
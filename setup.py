@@ -59,6 +59,8 @@ setup(name='pypvasync',
                       'Programming Language :: Python',
                       'Topic :: Scientific/Engineering'],
       packages=['pvasync'],
+      entry_points={'console_scripts':
+                    ['pvasync-server = pvasync.server:main']},
       data_files=data_files )
 
 
@@ -0,0 +1,39 @@
+'''
+Setting PVASYNC_TEST_SERVER=1 runs the tests against the bundled server
+(pvasync.server) instead of an IOC serving the test database. The server's
+address has to be in the environment before pvasync (and so libca) is
+imported, so it is chosen here, when pytest loads this file.
+'''
+import os
+import socket
+
+import pytest
+
+
+use_test_server = os.environ.get('PVASYNC_TEST_SERVER', '0') not in ('', '0')
+
+
+def _free_port(host):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+if use_test_server:
+    _host = '127.0.0.1'
+    _port = _free_port(_host)
+    os.environ['EPICS_CA_ADDR_LIST'] = '{}:{}'.format(_host, _port)
+    os.environ['EPICS_CA_AUTO_ADDR_LIST'] = 'NO'
+
+
+@pytest.fixture(scope='session', autouse=use_test_server)
+def ca_server():
+    '''The bundled CA server, serving the PVs named in pvnames'''
+    if not use_test_server:
+        pytest.skip('PVASYNC_TEST_SERVER is not set')
+
+    from pvasync.server import (CAServer, default_pvs)
+    server = CAServer(default_pvs(), host=_host, port=_port)
+    server.start_in_thread()
+    yield server
+    server.stop()
@@ -0,0 +1,185 @@
+import time
+import logging
+import threading
+
+import numpy as np
+import pytest
+
+from pvasync import config
+from pvasync.budgets import loop_only
+from pvasync.context import get_current_context
+
+
+def _subscribe(ctx, func, name):
+    # never connects: connection events are processed directly
+    chid = ctx.create_channel('absolutely_made_up_pvname_budgets_' + name)
+    handler, cbid = ctx.subscribe(sig='connection', chid=chid, func=func)
+    return handler, cbid
+
+
+def _process(handler, count=1):
+    for i in range(count):
+        handler.process(pvname=handler.pvname, connected=False)
+
+
+def test_error_budget(monkeypatch, caplog):
+    monkeypatch.setattr(config, 'CALLBACK_QUARANTINE', 'suspend')
+    monkeypatch.setattr(config, 'CALLBACK_ERROR_LIMIT', 3)
+    ctx = get_current_context()
+
+    def failing(**kwargs):
+        raise ValueError('callback failure')
+
+    handler, cbid = _subscribe(ctx, failing, 'errors')
+    try:
+        with caplog.at_level(logging.WARNING):
+            _process(handler, 5)
+        health = ctx.callback_health()[cbid]
+        assert health['state'] == 'suspended'
+        assert health['reason'] == 'errors'
+        assert health['calls'] == health['errors'] == 3
+        assert health['skipped'] == 2
+        assert 'ValueError' in health['last_error']
+
+        # one traceback, then rate-limited
+        tracebacks = [record for record in caplog.records
+                      if record.exc_info is not None]
+        assert len(tracebacks) == 1
+
+        ctx.resume_callback(cbid)
+        _process(handler)
+        assert ctx.callback_health()[cbid]['calls'] == 4
+    finally:
+        ctx.clear_channel(handler.pvname)
+
+    assert cbid not in ctx.callback_health()
+    with pytest.raises(ValueError):
+        ctx.resume_callback(cbid)
+
+
+def test_slow_callback_threaded(monkeypatch):
+    monkeypatch.setattr(config, 'CALLBACK_QUARANTINE', 'thread')
+    monkeypatch.setattr(config, 'CALLBACK_TIME_BUDGET', 0.001)
+    monkeypatch.setattr(config, 'CALLBACK_SLOW_LIMIT', 2)
+    ctx = get_current_context()
+    threads = []
+    called = threading.Event()
+
+    def slow(**kwargs):
+        threads.append(threading.current_thread())
+        time.sleep(0.005)
+        called.set()
+
+    handler, cbid = _subscribe(ctx, slow, 'slow')
+    try:
+        _process(handler, 2)
+        health = ctx.callback_health()[cbid]
+        assert health['state'] == 'threaded'
+        assert health['reason'] == 'slow'
+        assert health['slow_calls'] == 2
+
+        called.clear()
+        _process(handler)
+        assert called.wait(2.0)
+        assert threads[-1] is not threading.current_thread()
+    finally:
+        ctx.clear_channel(handler.pvname)
+
+
+def test_threaded_event_copied():
+    ctx = get_current_context()
+    values = []
+    called = threading.Event()
+
+    def offloaded(value=None, **kwargs):
+        values.append(value)
+        called.set()
+
+    handler, cbid = _subscribe(ctx, offloaded, 'copied')
+    try:
+        ctx.offload_callback(cbid)
+        # the ring buffer slot of a monitor, reused by the next event
+        value = np.arange(4)
+        handler.process(pvname=handler.pvname, connected=False, value=value)
+        value[:] = -1
+        assert called.wait(2.0)
+        assert list(values[0]) == [0, 1, 2, 3]
+    finally:
+        ctx.clear_channel(handler.pvname)
+
+
+def test_loop_only_not_threaded(monkeypatch, caplog):
+    monkeypatch.setattr(config, 'CALLBACK_QUARANTINE', 'thread')
+    monkeypatch.setattr(config, 'CALLBACK_ERROR_LIMIT', 2)
+    ctx = get_current_context()
+    threads = []
+
+    @loop_only
+    def failing(**kwargs):
+        threads.append(threading.current_thread())
+        raise ValueError('callback failure')
+
+    handler, cbid = _subscribe(ctx, failing, 'loop_only')
+    try:
+        with caplog.at_level(logging.WARNING):
+            _process(handler, 3)
+        assert ctx.callback_health()[cbid]['state'] == 'active'
+        assert threads == [threading.current_thread()] * 3
+        assert any('over its budget' in record.getMessage()
+                   for record in caplog.records)
+        with pytest.raises(ValueError):
+            ctx.offload_callback(cbid)
+    finally:
+        ctx.clear_channel(handler.pvname)
+
+
+def test_untimed_by_default():
+    assert config.CALLBACK_TIME_BUDGET is None
+    ctx = get_current_context()
+    if ctx.metrics is not None:
+        pytest.skip('metrics time the callbacks')
+
+    handler, cbid = _subscribe(ctx, lambda **kwargs: None, 'untimed')
+    try:
+        _process(handler, 3)
+        health = ctx.callback_health()[cbid]
+        assert health['calls'] == 3
+        assert health['mean_time'] is None
+    finally:
+        ctx.clear_channel(handler.pvname)
+
+
+def test_warn_only(monkeypatch, caplog):
+    monkeypatch.setattr(config, 'CALLBACK_QUARANTINE', 'warn')
+    monkeypatch.setattr(config, 'CALLBACK_ERROR_LIMIT', 2)
+    ctx = get_current_context()
+    calls = []
+
+    def failing(**kwargs):
+        calls.append(kwargs)
+        raise ValueError('callback failure')
+
+    handler, cbid = _subscribe(ctx, failing, 'warn')
+    try:
+        with caplog.at_level(logging.WARNING):
+            _process(handler, 5)
+        assert len(calls) == 5
+        assert ctx.callback_health()[cbid]['state'] == 'active'
+        # warned each time the limit is reached, and not rate-limited
+        warnings = [record for record in caplog.records
+                    if 'over its budget' in record.getMessage()]
+        assert len(warnings) == 2
+        assert all(record.levelno == logging.WARNING for record in warnings)
+
+        ctx.suspend_callback(cbid)
+        _process(handler)
+        assert len(calls) == 5
+    finally:
+        ctx.clear_channel(handler.pvname)
+
+
+def test_unknown_policy(monkeypatch):
+    monkeypatch.setattr(config, 'CALLBACK_QUARANTINE', 'ignore')
+    ctx = get_current_context()
+    with pytest.raises(ValueError):
+        ctx._cbreg._quarantine(None, 'errors')
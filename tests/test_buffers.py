@@ -0,0 +1,74 @@
+import ctypes
+
+import numpy as np
+import pytest
+
+from pvasync.buffers import (BufferPool, MonitorBuffer)
+
+
+def test_pool_reuse():
+    pool = BufferPool(max_per_bucket=1)
+    arr = pool.acquire(np.float64, 100)
+    assert arr.shape == (100, )
+    assert arr.dtype == np.float64
+    assert pool.allocated == 1
+
+    pool.release(arr)
+    arr2 = pool.acquire(np.int32, 200)
+    assert pool.reused == 1
+    assert arr2.base is arr.base
+
+    # only one free buffer per bucket is kept
+    arr3 = pool.acquire(np.float64, 100)
+    pool.release(arr2)
+    pool.release(arr3)
+    assert len(pool._buckets[pool.bucket_size(800)]) == 1
+
+
+@pytest.mark.parametrize('nbytes, size', [(0, 64), (1, 64), (64, 64),
+                                          (65, 128), (800, 1024)])
+def test_pool_buckets(nbytes, size):
+    assert BufferPool(min_size=64).bucket_size(nbytes) == size
+
+
+def _source(values):
+    src = np.ascontiguousarray(values, dtype=np.float64)
+    return src, src.ctypes.data
+
+
+def test_monitor_buffer_double():
+    buf = MonitorBuffer(np.float64, 4)
+    src, addr = _source([1, 2, 3, 4])
+    seq1, view1 = buf.write(addr, 4)
+    np.testing.assert_array_equal(view1, src)
+    assert not view1.flags.writeable
+
+    src, addr = _source([5, 6])
+    seq2, view2 = buf.write(addr, 2)
+    assert seq2 == seq1 + 1
+    assert len(view2) == 2
+    # double buffered: the first update is untouched
+    np.testing.assert_array_equal(view1, [1, 2, 3, 4])
+    assert buf.valid(seq1) and buf.valid(seq2)
+
+
+def test_monitor_buffer_overruns():
+    buf = MonitorBuffer(np.float64, 1, nslots=2)
+    src, addr = _source([0])
+    seqs = [buf.write(addr, 1)[0] for i in range(2)]
+    assert buf.overruns == 0
+
+    buf.mark_delivered(seqs[0])
+    buf.write(addr, 1)
+    assert buf.overruns == 0
+    assert not buf.valid(seqs[0])
+
+    # seqs[1] was never delivered
+    buf.write(addr, 1)
+    assert buf.overruns == 1
+    assert not buf.valid(seqs[1])
+
+
+def test_monitor_buffer_slots():
+    with pytest.raises(ValueError):
+        MonitorBuffer(np.float64, 10, nslots=1)
@@ -479,3 +479,43 @@ def test_xArray3(ctx):
     assert isinstance(char_val, str)
     conv = ''.join([chr(i) for i in val])
     assert conv == char_val
+
+
+@async_test
+@asyncio.coroutine
+def test_caget_many(ctx):
+    print('Bulk get of several PVs, including one that cannot connect')
+    pvs = [pvnames.double_pv, pvnames.enum_pv, pvnames.str_pv,
+           'impossible_pvname_certain_to_fail']
+    values = yield from coroutines.caget_many(pvs, connection_timeout=1.0)
+    assert len(values) == len(pvs)
+    for value in values[:3]:
+        assert not isinstance(value, Exception)
+    assert isinstance(values[3], asyncio.TimeoutError)
+
+    by_name = yield from coroutines.caget_many(pvs[:3], as_dict=True)
+    assert list(by_name.keys()) == pvs[:3]
+    assert by_name[pvnames.str_pv] == 'ao'
+
+
+@async_test
+@asyncio.coroutine
+@no_simulator_updates
+def test_caput_many(ctx):
+    print('Bulk put to several PVs, including one that cannot connect')
+    bad_pv = 'impossible_pvname_certain_to_fail'
+    status = yield from coroutines.caput_many([(pvnames.non_updating_pv, 3),
+                                               (pvnames.enum_pv, 'Start'),
+                                               (bad_pv, 1)],
+                                              connection_timeout=1.0)
+    assert status[pvnames.non_updating_pv] is True
+    assert status[pvnames.enum_pv] is True
+    assert isinstance(status[bad_pv], asyncio.TimeoutError)
+
+    values = yield from coroutines.caget_many([pvnames.non_updating_pv,
+                                               pvnames.enum_pv])
+    assert values == [3, 1]
+
+    status = yield from coroutines.caput_many({pvnames.enum_pv: 0},
+                                              wait=False)
+    assert status[pvnames.enum_pv] is True
@@ -0,0 +1,145 @@
+import struct
+
+import numpy as np
+import pytest
+
+from pvasync import (ca_protocol as proto, cast, dbr)
+from pvasync.buffers import (BufferPool, MonitorBuffer)
+from pvasync.ca_protocol import Command
+from pvasync.dbr import ChannelType
+
+
+def test_pack_unpack():
+    msg = proto.read_notify(ChannelType.TIME_DOUBLE, 10, 3, 4)
+    assert len(msg) == 16
+
+    message, offset = proto.unpack(msg + msg[:8])
+    assert offset == 16
+    assert message.command == Command.READ_NOTIFY
+    assert message.data_type == ChannelType.TIME_DOUBLE
+    assert message.data_count == 10
+    assert (message.param1, message.param2) == (3, 4)
+    assert len(message.payload) == 0
+
+    # a partial message is left in the buffer
+    message, offset = proto.unpack(msg + msg[:8], offset)
+    assert message is None
+    assert offset == 16
+
+
+def test_padding():
+    msg = proto.create_chan('abc', 1)
+    message, _ = proto.unpack(msg)
+    assert len(message.payload) == 8
+    assert bytes(message.payload) == b'abc\0\0\0\0\0'
+
+
+def test_extended_header():
+    payload = b'\1' * 0x10000
+    msg = proto.pack(Command.EVENT_ADD, payload, data_type=6,
+                     data_count=0x2000, param1=1, param2=2)
+    assert len(msg) == 24 + len(payload)
+
+    message, offset = proto.unpack(msg)
+    assert offset == len(msg)
+    assert message.data_count == 0x2000
+    assert len(message.payload) == len(payload)
+
+
+@pytest.mark.parametrize('ftype, offset', [
+    (ChannelType.DOUBLE, 0),
+    (ChannelType.STS_CHAR, 5),
+    (ChannelType.STS_DOUBLE, 8),
+    (ChannelType.TIME_STRING, 12),
+    (ChannelType.TIME_SHORT, 14),
+    (ChannelType.TIME_CHAR, 15),
+    (ChannelType.TIME_DOUBLE, 16),
+    (ChannelType.CTRL_SHORT, 28),
+    (ChannelType.CTRL_FLOAT, 48),
+    (ChannelType.CTRL_ENUM, 422),
+    (ChannelType.CTRL_CHAR, 21),
+    (ChannelType.CTRL_LONG, 44),
+    (ChannelType.CTRL_DOUBLE, 80),
+])
+def test_value_offset(ftype, offset):
+    # offsets of the value fields in db_access.h
+    assert proto.value_offset(ftype) == offset
+
+
+def test_decode_time_double():
+    secs, nsec = 1000, 500000000
+    payload = (struct.pack('>hhIIi', 0, 2, secs, nsec, 0) +
+               np.arange(4, dtype='>f8').tobytes())
+
+    pool = BufferPool()
+    header, values = proto.decode_dbr(ChannelType.TIME_DOUBLE, 4, payload,
+                                      pool=pool)
+    assert values.dtype == np.float64
+    assert values.dtype.isnative
+    assert list(values) == [0, 1, 2, 3]
+    assert pool.allocated == 1
+
+    info = header.to_dict()
+    assert info['severity'] == 2
+    assert info['timestamp'] == dbr.epics_to_unixtime(secs, nsec)
+    assert info['timestamp_ns'] == (dbr.EPICS2UNIX_EPOCH_NS +
+                                    secs * 1000000000 + nsec)
+
+
+def test_timestamp_ns():
+    # nanoseconds apart: the same float timestamp, ordered in nanoseconds
+    first = dbr.TimeStamp(1000, 123456789)
+    second = dbr.TimeStamp(1000, 123456790)
+    assert first.unixtime == second.unixtime
+    assert second.unix_ns - first.unix_ns == 1
+
+    stamps = dbr.unix_ns_to_datetime64([first.unix_ns, second.unix_ns])
+    assert stamps.dtype == np.dtype('datetime64[ns]')
+    assert stamps[0] == np.datetime64('1990-01-01T00:16:40.123456789')
+
+
+def test_decode_ctrl_enum():
+    strs = [b'off', b'on']
+    payload = struct.pack('>hhh', 0, 0, len(strs))
+    payload += b''.join(s.ljust(dbr.MAX_ENUM_STRING_SIZE, b'\0')
+                        for s in strs)
+    payload += b'\0' * (dbr.MAX_ENUM_STRING_SIZE * (16 - len(strs)))
+    payload += struct.pack('>H', 1)
+
+    header, values = proto.decode_dbr(ChannelType.CTRL_ENUM, 1, payload)
+    assert header.to_dict() == dict(status=0, severity=0,
+                                    enum_strs=('off', 'on'))
+    assert values.item(0) == 1
+
+
+def test_decode_strings():
+    payload = b''.join(s.ljust(dbr.MAX_STRING_SIZE, b'\0')
+                       for s in (b'abc', b'defg'))
+    header, values = proto.decode_dbr(ChannelType.STRING, 2, payload)
+    assert header is None
+    assert cast.unpack_values(values, 2, ChannelType.STRING) == ['abc',
+                                                                 'defg']
+
+
+def test_decode_into_monitor_buffer():
+    payload = np.arange(10, dtype='>i4').tobytes()
+    buf = MonitorBuffer(np.int32, 10)
+    values = proto.wire_values(ChannelType.LONG, 10, payload, 0)
+    seq, view = buf.write_array(values)
+    assert seq == 1
+    assert view.dtype.isnative
+    assert list(view) == list(range(10))
+
+
+def test_encode_put():
+    ftype, count, data = cast.put_info(ChannelType.DOUBLE, 3, [1, 2, 3])
+    payload = proto.encode_values(ftype, data)
+    assert len(payload) == 24
+    assert list(np.frombuffer(payload, dtype='>f8')) == [1, 2, 3]
+
+    # a single string is not a sequence of characters
+    ftype, count, data = cast.put_info(ChannelType.STRING, 1, 'abc')
+    assert count == 1
+    payload = proto.encode_values(ftype, data)
+    assert len(payload) == dbr.MAX_STRING_SIZE
+    assert payload.startswith(b'abc\0')
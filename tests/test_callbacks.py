@@ -0,0 +1,191 @@
+import asyncio
+import functools
+
+from pvasync import (PV, coroutines, dbr)
+from pvasync.context import get_current_context
+from pvasync.pv import PVEvent
+from pvasync.server import ServedPV
+
+
+def _pv():
+    # never connects: callbacks are run directly with the data set here
+    pv = PV('absolutely_made_up_pvname_callbacks')
+    pv._args.update(value=2.5, char_value='2.50', timestamp=1.0, status=0,
+                    severity=0)
+    return pv
+
+
+def test_order_and_kwargs():
+    pv = _pv()
+    calls = []
+
+    def callback(value=None, cb_info=None, tag=None, **kwargs):
+        calls.append((tag, value, cb_info))
+
+    pv.add_callback(callback, index=5, with_ctrlvars=False, tag='b')
+    pv.add_callback(callback, index=2, with_ctrlvars=False, tag='a')
+    pv.run_callbacks()
+    assert calls == [('a', 2.5, (2, pv)), ('b', 2.5, (5, pv))]
+
+    # the extra keywords of one callback do not leak into the next
+    del calls[:]
+    pv.add_callback(callback, index=9, with_ctrlvars=False)
+    pv.run_callbacks()
+    assert [tag for tag, value, cb_info in calls] == ['a', 'b', None]
+
+
+def test_event_callbacks():
+    pv = _pv()
+    events = []
+    pv.add_callback(events.append, with_ctrlvars=False, as_event=True)
+    pv.add_callback(events.append, with_ctrlvars=False, as_event=True)
+    pv.run_callbacks()
+
+    assert len(events) == 2
+    event = events[0]
+    assert event is events[1]
+    assert isinstance(event, PVEvent)
+    assert (event.pv, event.value, event.char_value) == (pv, 2.5, '2.50')
+
+    pv.run_callback(1)
+    assert events[-1].timestamp == 1.0
+
+
+def test_remove_while_running():
+    pv = _pv()
+    calls = []
+
+    def remover(**kwargs):
+        calls.append('remover')
+        pv.remove_callback(2)
+
+    pv.add_callback(remover, with_ctrlvars=False)
+    pv.add_callback(lambda **kwargs: calls.append('removed'),
+                    with_ctrlvars=False)
+    pv.add_callback(lambda event: calls.append('event'), with_ctrlvars=False,
+                    as_event=True)
+    pv.run_callbacks()
+    assert calls == ['remover', 'event']
+
+    pv.clear_callbacks()
+    pv.run_callbacks()
+    assert calls == ['remover', 'event']
+
+
+def test_callbacks_changed_directly():
+    pv = _pv()
+    calls = []
+    pv.add_callback(lambda **kwargs: calls.append('added'),
+                    with_ctrlvars=False)
+    pv.run_callbacks()
+
+    # as allowed before the dispatch list was cached
+    pv.callbacks[7] = (lambda **kwargs: calls.append('set'), {})
+    pv.run_callbacks()
+    assert calls == ['added', 'added', 'set']
+
+    del calls[:]
+    pv.callbacks.pop(1)
+    pv.callbacks.update({3: (lambda **kwargs: calls.append('updated'), {})})
+    pv.run_callbacks()
+    assert calls == ['updated', 'set']
+
+    del calls[:]
+    pv.callbacks = {1: (lambda **kwargs: calls.append('assigned'), {})}
+    pv.run_callbacks()
+    assert calls == ['assigned']
+
+
+def test_unsubscribe_clears_channel():
+    ctx = get_current_context()
+    pvname = 'absolutely_made_up_pvname_unsubscribe'
+    chid = ctx.create_channel(pvname)
+    handler, cbid = ctx.subscribe(sig='connection', chid=chid,
+                                  func=lambda **kwargs: None)
+    ctx.unsubscribe(cbid)
+    assert pvname not in ctx.pv_to_channel
+    assert chid not in ctx.channel_to_pv
+
+
+def test_shared_subscription(ca_server):
+    name = 'CallbacksTest:shared'
+    if name not in ca_server.pvs:
+        ca_server.add_pv(ServedPV(name, 1.0))
+
+    loop = asyncio.get_event_loop()
+    ctx = get_current_context()
+    chid = ctx.create_channel(name)
+    loop.run_until_complete(ctx.connect_channel(chid, timeout=5.0))
+
+    ntype = ctx.field_type(chid)
+    ttype = dbr.promote_type(ntype, use_time=True)
+    native, time_ = [], []
+    try:
+        nhandler, ncbid = ctx.subscribe(sig='monitor', chid=chid,
+                                        func=lambda **kw: native.append(kw),
+                                        ftype=ntype)
+        # the TIME subscription replaces the native one, and serves both
+        thandler, tcbid = ctx.subscribe(sig='monitor', chid=chid,
+                                        func=lambda **kw: time_.append(kw),
+                                        ftype=ttype)
+        assert thandler is not nhandler
+        assert ctx.subscription(ncbid) is thandler
+        assert nhandler.evid is None
+        # and a native one from now on is served by it too
+        handler, cbid = ctx.subscribe(sig='monitor', chid=chid,
+                                      func=lambda **kw: None, ftype=ntype)
+        assert handler is thandler
+
+        loop.run_until_complete(coroutines.put(chid, 2.0, timeout=2.0))
+        loop.run_until_complete(asyncio.sleep(0.5))
+        assert native[-1]['value'] == time_[-1]['value'] == 2.0
+        assert native[-1]['ftype'] == ntype
+        assert 'timestamp' not in native[-1]
+        assert 'timestamp' in time_[-1]
+    finally:
+        ctx.clear_channel(name)
+
+
+def test_merged_masks(ca_server):
+    name = 'CallbacksTest:merged'
+    if name not in ca_server.pvs:
+        ca_server.add_pv(ServedPV(name, 1.0))
+
+    loop = asyncio.get_event_loop()
+    ctx = get_current_context()
+    chid = ctx.create_channel(name)
+    loop.run_until_complete(ctx.connect_channel(chid, timeout=5.0))
+
+    ST = dbr.SubscriptionType
+    ctype = dbr.promote_type(ctx.field_type(chid), use_ctrl=True)
+    values, properties = [], []
+    try:
+        vhandler, vcbid = ctx.subscribe(sig='monitor', chid=chid,
+                                        func=lambda **kw: values.append(kw),
+                                        ftype=ctype, mask=ST.DBE_VALUE)
+        # one subscription, with the union of the masks
+        handler, pcbid = ctx.subscribe(sig='monitor', chid=chid,
+                                       func=lambda **kw: properties.append(kw),
+                                       ftype=ctype,
+                                       mask=ST.DBE_VALUE | ST.DBE_PROPERTY)
+        assert handler.mask == ST.DBE_VALUE | ST.DBE_PROPERTY
+        assert ctx.subscription(vcbid) is handler
+        assert vhandler.evid is None
+        loop.run_until_complete(asyncio.sleep(0.5))
+        del values[:]
+        del properties[:]
+
+        served = ca_server.pvs[name]
+        ca_server.loop.call_soon_threadsafe(
+            functools.partial(served.set_fields, units='mm'))
+        loop.run_until_complete(asyncio.sleep(0.5))
+        assert not values
+        assert properties[-1]['units'] == 'mm'
+
+        loop.run_until_complete(coroutines.put(chid, 2.0, timeout=2.0))
+        loop.run_until_complete(asyncio.sleep(0.5))
+        assert values[-1]['value'] == 2.0
+        assert properties[-1]['value'] == 2.0
+        assert len(properties) == 2
+    finally:
+        ctx.clear_channel(name)
@@ -0,0 +1,42 @@
+import asyncio
+import os
+import time
+
+from pvasync import coroutines
+from pvasync.server import pvs_from_file
+
+
+loop = asyncio.get_event_loop()
+PVLIST = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'fastconn_pvlist.txt')
+
+
+def test_connect_many(ca_server):
+    # (not updating, so these can be added from this thread)
+    pvs = pvs_from_file(PVLIST)
+    for pv in pvs:
+        ca_server.add_pv(pv)
+
+    names = [pv.name for pv in pvs]
+    connect_times = []
+
+    def connection_update(pvname=None, connected=None):
+        if connected:
+            connect_times.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    result = loop.run_until_complete(
+        coroutines.connect_many(names, timeout=30.0,
+                                callback=connection_update))
+    assert list(result) == names
+    assert all(result.values())
+    assert len(connect_times) == len(names)
+    print('{} PVs: 99% connected after {:.2f}s'
+          ''.format(len(names), connect_times[len(names) * 99 // 100 - 1]))
+
+    # already connected channels complete immediately
+    missing = 'not_a_pv_connect_many'
+    result = loop.run_until_complete(
+        coroutines.connect_many(names[:100] + [missing], timeout=0.5))
+    assert all(result[name] for name in names[:100])
+    assert not result[missing]
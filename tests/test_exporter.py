@@ -0,0 +1,94 @@
+import asyncio
+import os
+import tempfile
+import urllib.request
+
+from pvasync import PV
+from pvasync.context import get_current_context
+from pvasync.exporter import (MetricsExporter, render)
+
+from . import pvnames
+
+
+loop = asyncio.get_event_loop()
+
+
+def _samples(text):
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_render(ca_server):
+    pv = PV(pvnames.double_pv)
+    loop.run_until_complete(pv.wait_for_connection())
+    samples = _samples(render())
+    assert samples['pvasync_channels'] >= 1
+    assert 1 <= samples['pvasync_channels_connected'] <= \
+        samples['pvasync_channels']
+    assert samples['pvasync_subscriptions'] >= 1
+    assert 'pvasync_event_queue_depth' in samples
+    assert 'pvasync_get_seconds_count' not in samples
+
+    ctx = get_current_context()
+    ctx.enable_metrics()
+    try:
+        samples = _samples(render())
+    finally:
+        ctx.disable_metrics()
+    assert samples['pvasync_get_seconds_bucket{le="+Inf"}'] == 0
+
+
+def test_http():
+    exporter = MetricsExporter(port=0, lag_interval=0.01)
+    loop.run_until_complete(exporter.start())
+
+    def fetch(path):
+        url = 'http://127.0.0.1:{}{}'.format(exporter.port, path)
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:
+                return (response.status, response.headers['Content-Type'],
+                        response.read().decode('utf-8'))
+        except urllib.error.HTTPError as ex:
+            return ex.code, None, None
+
+    try:
+        loop.run_until_complete(asyncio.sleep(0.05))
+        status, content_type, text = loop.run_until_complete(
+            loop.run_in_executor(None, fetch, '/metrics'))
+        not_found = loop.run_until_complete(
+            loop.run_in_executor(None, fetch, '/other'))
+    finally:
+        exporter.stop()
+
+    assert status == 200
+    assert content_type.startswith('text/plain; version=0.0.4')
+    assert 'pvasync_loop_lag_seconds' in _samples(text)
+    assert exporter.loop_lag.ticks > 0
+    assert not_found[0] == 404
+
+
+def test_unix_socket():
+    path = os.path.join(tempfile.mkdtemp(), 'metrics.sock')
+    exporter = MetricsExporter(unix_path=path)
+    loop.run_until_complete(exporter.start())
+
+    @asyncio.coroutine
+    def fetch():
+        reader, writer = yield from asyncio.open_unix_connection(path)
+        writer.write(b'GET /metrics HTTP/1.0\r\n\r\n')
+        response = yield from reader.read()
+        writer.close()
+        return response.decode('utf-8')
+
+    try:
+        response = loop.run_until_complete(fetch())
+    finally:
+        exporter.stop()
+        os.unlink(path)
+
+    assert response.startswith('HTTP/1.1 200 OK')
+    assert 'pvasync_channels ' in response
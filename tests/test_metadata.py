@@ -0,0 +1,118 @@
+import asyncio
+import functools
+
+import numpy as np
+
+from pvasync import (PV, coroutines, dbr)
+from pvasync.context import get_current_context
+from pvasync.server import ServedPV
+
+from . import pvnames
+
+
+loop = asyncio.get_event_loop()
+
+
+def test_ctrlvars_cached():
+    @asyncio.coroutine
+    def check():
+        pv = PV(pvnames.double_pv)
+        yield from pv.wait_for_connection()
+        ctrlvars = yield from coroutines.get_ctrlvars(pv.chid)
+        assert get_current_context().metadata(pv.chid) == ctrlvars
+        assert ctrlvars['units'] == pvnames.double_pv_units
+
+        precision = yield from coroutines.get_precision(pv.chid)
+        assert precision == pvnames.double_pv_prec
+        assert pv.units == pvnames.double_pv_units
+
+        enum_pv = PV(pvnames.enum_pv)
+        yield from enum_pv.wait_for_connection()
+        enum_strs = yield from coroutines.get_enum_strings(enum_pv.chid)
+        assert list(enum_strs) == pvnames.enum_pv_strs
+
+    loop.run_until_complete(check())
+
+
+def test_property_change(ca_server):
+    served = ca_server.pvs[pvnames.double_pv2]
+
+    @asyncio.coroutine
+    def check():
+        pv = PV(pvnames.double_pv2)
+        yield from pv.wait_for_connection()
+        yield from coroutines.get_ctrlvars(pv.chid)
+
+        set_units = functools.partial(served.set_fields, units='mm')
+        ca_server.loop.call_soon_threadsafe(set_units)
+        yield from asyncio.sleep(0.5)
+        ctrlvars = yield from coroutines.get_ctrlvars(pv.chid)
+        assert ctrlvars['units'] == 'mm'
+        assert pv.units == 'mm'
+
+    units = served.fields['units']
+    try:
+        loop.run_until_complete(check())
+    finally:
+        ca_server.loop.call_soon_threadsafe(
+            functools.partial(served.set_fields, units=units))
+
+
+def test_metadata_released(ca_server):
+    name = 'MetadataTest:released'
+    if name not in ca_server.pvs:
+        ca_server.add_pv(ServedPV(name, 1.0, units='mm'))
+    ctx = get_current_context()
+
+    @asyncio.coroutine
+    def check():
+        pvs = [PV(name), PV(name, form='time')]
+        for pv in pvs:
+            yield from pv.wait_for_connection()
+        chid = pvs[0].chid
+        ctrlvars = yield from coroutines.get_ctrlvars(chid)
+        assert ctrlvars['units'] == 'mm'
+        assert 'status' in ctrlvars
+        assert ctx.metadata(chid) == ctrlvars
+
+        # the subscription is kept while any PV of the channel is connected
+        pvs[0].disconnect()
+        assert ctx.metadata(chid) == ctrlvars
+        pvs[1].disconnect()
+        assert ctx.metadata(chid) is None
+        assert ctx.metadata_future(chid) is None
+        # nothing else subscribes to the channel
+        assert name not in ctx.pv_to_channel
+
+        # not cached: read with a request
+        chid = ctx.create_channel(name)
+        yield from ctx.connect_channel(chid, timeout=5.0)
+        ctrlvars = yield from coroutines.get_ctrlvars(chid)
+        assert ctrlvars['units'] == 'mm'
+        assert ctx.metadata(chid) is None
+
+    loop.run_until_complete(check())
+
+
+def test_timevars_many():
+    names = [pvnames.non_updating_pv, pvnames.enum_pv,
+             'absolutely_made_up_pvname_timevars']
+
+    @asyncio.coroutine
+    def check():
+        columns = yield from coroutines.get_timevars_many(
+            names, connection_timeout=1.0)
+        assert list(columns['ok']) == [True, True, False]
+        assert columns['timestamp'].dtype == np.dtype('datetime64[ns]')
+        assert np.isnat(columns['timestamp'][2])
+        assert columns['severity'][2] == -1
+
+        info = yield from coroutines.get_timevars(
+            PV(pvnames.non_updating_pv).chid)
+        stamp = columns['timestamp'][0].astype(np.int64)
+        assert stamp == info['timestamp_ns']
+        # (the float timestamp is rounded to microseconds on its own)
+        secs, nsec = divmod(int(stamp) - dbr.EPICS2UNIX_EPOCH_NS, 1000000000)
+        assert dbr.epics_to_unixtime(secs, nsec) == info['timestamp']
+
+    loop.run_until_complete(check())
@@ -0,0 +1,80 @@
+import time
+import asyncio
+
+import pytest
+
+from pvasync import (PV, coroutines)
+from pvasync.context import get_current_context
+from pvasync.metrics import Histogram
+
+from . import pvnames
+
+
+loop = asyncio.get_event_loop()
+
+
+def test_histogram():
+    histogram = Histogram()
+    assert histogram.percentile(50) is None
+
+    for value in [0.001] * 98 + [0.1, 1000.0, 0.0]:
+        histogram.record(value)
+
+    summary = histogram.to_dict()
+    assert summary['count'] == 101
+    assert summary['min'] == 0.0
+    assert summary['max'] == 1000.0
+    # the upper edge of the bin of 0.001: [2 ** -10, 2 ** -9)
+    assert summary['p50'] == 2 ** -9
+    assert summary['p99'] == 2 ** -3
+    # out of range values land in the first and last bins
+    assert summary['bins'][2.0 ** Histogram.min_exponent] == 1
+    assert summary['bins'][2.0 ** Histogram.max_exponent] == 1
+    assert sum(summary['bins'].values()) == 101
+
+
+def test_disabled_by_default():
+    ctx = get_current_context()
+    assert ctx.metrics is None
+    assert ctx.metrics_snapshot() is None
+
+
+def test_metrics(ca_server):
+    ctx = get_current_context()
+    ctx.enable_metrics()
+
+    @asyncio.coroutine
+    def check():
+        pv = PV(pvnames.updating_pv1)
+        yield from pv.wait_for_connection()
+        for i in range(5):
+            yield from coroutines.get(pv.chid)
+        with pytest.raises(asyncio.TimeoutError):
+            yield from coroutines.get(pv.chid, timeout=0)
+
+        # a monitor event, for its queue wait and callback
+        put_pv = PV(pvnames.double_pv2, auto_monitor=True)
+        yield from put_pv.wait_for_connection()
+        updated = asyncio.Event()
+        put_pv.add_callback(lambda **kwargs: updated.set(),
+                            with_ctrlvars=False)
+        yield from coroutines.put(put_pv.chid, time.time() % 1000)
+        yield from asyncio.wait_for(updated.wait(), timeout=2.0)
+        put_pv.clear_callbacks()
+
+    try:
+        loop.run_until_complete(check())
+        snapshot = ctx.metrics_snapshot()
+    finally:
+        ctx.disable_metrics()
+
+    histograms = snapshot['histograms']
+    assert histograms['get']['count'] >= 5
+    assert histograms['put']['count'] >= 1
+    assert histograms['queue_wait']['count'] > 0
+    assert histograms['callback']['count'] > 0
+
+    counters = snapshot['channels'][pvnames.updating_pv1]
+    assert counters['timeouts'] == 1
+    assert counters['errors'] == 0
+    assert snapshot['channels'][pvnames.double_pv2]['events'] > 0
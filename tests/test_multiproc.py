@@ -0,0 +1,68 @@
+import asyncio
+import sys
+
+import numpy as np
+import pytest
+
+from pvasync import (CAPool, config)
+
+from . import pvnames
+
+
+def _mean(pvname, value):
+    return float(np.mean(value))
+
+
+def _fail(pvname, value):
+    raise ValueError(pvname)
+
+
+def _stale_loops(pvname, value):
+    loop = asyncio.get_event_loop()
+    return sorted(name for name, module in list(sys.modules.items())
+                  if name.startswith('pvasync') and
+                  isinstance(getattr(module, 'loop', None),
+                             asyncio.AbstractEventLoop) and
+                  module.loop is not loop)
+
+
+@pytest.mark.parametrize('start_method', ['spawn', 'fork'])
+def test_snapshot(ca_server, start_method):
+    names = [pvnames.double_pv, pvnames.long_pv] + pvnames.double_arrays
+    missing = 'not_a_pv_multiproc'
+    with CAPool(2, start_method=start_method) as pool:
+        values = pool.snapshot(names + [missing], timeout=2.0)
+        assert list(values) == names + [missing]
+        assert isinstance(values[missing], Exception)
+
+        large = values[pvnames.double_arrays[-1]]
+        assert large.nbytes >= config.SHARED_MEMORY_MIN_BYTES
+        assert len(large) == 65536
+
+        # warm channels and monitors, on the same workers
+        for monitor in (True, True, False):
+            again = pool.snapshot(names, timeout=2.0, monitor=monitor)
+            assert again[pvnames.long_pv] == values[pvnames.long_pv]
+            np.testing.assert_array_equal(
+                again[pvnames.double_arrays[-1]], large)
+
+
+def test_map_pvs(ca_server):
+    names = pvnames.double_arrays
+    with CAPool(3) as pool:
+        assert {pool.worker_of(name) for name in names} <= {0, 1, 2}
+        values = pool.snapshot(names)
+        means = pool.map_pvs(_mean, names)
+        assert list(means) == names
+        for name in names:
+            assert means[name] == pytest.approx(np.mean(values[name]))
+
+        errors = pool.map_pvs(_fail, names[:1])
+        assert isinstance(errors[names[0]], ValueError)
+
+
+def test_fork_rebinds_loops(ca_server):
+    names = pvnames.double_arrays[:1]
+    with CAPool(1, start_method='fork') as pool:
+        stale = pool.map_pvs(_stale_loops, names)
+        assert stale[names[0]] == []
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from pvasync import (PV, ca, config, coroutines)
+from pvasync.context import (get_contexts, get_current_context)
+from pvasync.pool import ContextPool
+from pvasync.server import ServedPV
+
+
+loop = asyncio.get_event_loop()
+NAMES = ['PoolTest{}:ao{}'.format(ioc, i) for ioc in range(4)
+         for i in range(8)]
+
+
+@pytest.fixture
+def pool(ca_server):
+    for idx, name in enumerate(NAMES):
+        if name not in ca_server.pvs:
+            ca_server.add_pv(ServedPV(name, float(idx)))
+
+    contexts = get_contexts()
+    if contexts.pool is not None:
+        pytest.skip('A context pool is configured (PVASYNC_CONTEXTS)')
+    before = set(contexts.contexts)
+    pool = contexts.create_pool(3)
+    try:
+        yield pool
+    finally:
+        contexts.pool = None
+        for ctx_id in set(contexts.contexts) - before:
+            contexts.contexts.pop(ctx_id).stop()
+
+
+def test_sharding(pool):
+    assert get_current_context() is pool
+    assert len(pool.contexts) == 3
+    # channels created before the pool stay on the first context
+    assert pool.contexts[0] is get_contexts()[None]
+
+    pool.shard = 'prefix'
+    prefixes = {}
+    for name in NAMES:
+        ctx = pool.context_of_pv(name)
+        assert prefixes.setdefault(name.split(':')[0], ctx) is ctx
+
+    with pytest.raises(ValueError):
+        ContextPool(pool.contexts, shard='by_mood')
+
+
+def test_transparent(pool):
+    @asyncio.coroutine
+    def check():
+        result = yield from coroutines.connect_many(NAMES, timeout=5.0)
+        assert all(result.values())
+
+        values = yield from coroutines.caget_many(NAMES)
+        assert list(values) == [float(idx) for idx in range(len(NAMES))]
+
+        pv = PV(NAMES[3])
+        yield from pv.wait_for_connection()
+        updated = asyncio.Event()
+        pv.add_callback(lambda **kwargs: updated.set(), with_ctrlvars=False)
+        yield from pv.aput(42.0)
+        yield from asyncio.wait_for(updated.wait(), timeout=2.0)
+        assert (yield from pv.aget()) == 42.0
+        pv.clear_callbacks()
+
+    loop.run_until_complete(check())
+
+    used = [ctx for ctx in pool.contexts
+            if any(name in ctx.pv_to_channel for name in NAMES)]
+    assert len(used) > 1
+    for name in NAMES:
+        chid = pool.pv_to_channel[name]
+        assert pool.context_of(chid) is pool.context_of_pv(name)
+        assert pool.channel_to_pv[chid] == name
+
+    shards = pool.shards()
+    assert sum(shard['channels'] for shard in shards) >= len(NAMES)
+    assert all(shard['hosts'] for shard in shards if shard['connected'])
+
+
+@pytest.mark.skipif(config.CA_BACKEND != 'libca',
+                    reason='the libca backend is not in use')
+def test_libca_contexts(pool):
+    loop.run_until_complete(coroutines.connect_many(NAMES, timeout=5.0))
+    pvs = [PV(name) for name in NAMES]
+    for pv in pvs:
+        loop.run_until_complete(pv.wait_for_connection(timeout=5.0))
+    loop.run_until_complete(asyncio.sleep(0.5))
+
+    for ctx in pool.contexts[1:]:
+        chids = [chid for name, chid in ctx.pv_to_channel.items()
+                 if name in NAMES]
+        assert chids
+        # created in (and attached to) this context, not the first
+        ctx.flush()
+        assert ca.current_context() == ctx._ctx
+        assert all(ctx.is_connected(chid) for chid in chids)
+        # connection and monitor events reached this context's handler
+        assert ctx.delivery_stats.events >= 2 * len(chids)
+
+    for pv in pvs:
+        pv.disconnect()
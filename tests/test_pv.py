@@ -1,13 +1,14 @@
 #!/usr/bin/env python
 # unit-tests for ca interface
 
+import time
 import unittest
 import asyncio
 import numpy as np
 from .util import (no_simulator_updates, async_test)
 from . import pvnames
 
-from pvasync import PV
+from pvasync import (PV, ca, coroutines)
 from pvasync.coroutines import (caget, caput)
 from unittest import mock
 
@@ -108,6 +109,21 @@ class PV_Tests(unittest.TestCase):
             self.assertAlmostEqual(rbv, v, delta=retry_deadband)
             self.assertTrue(done_callback.called)
 
+    @async_test
+    def test_monitor_stream(self):
+        mypv = PV(pvnames.updating_pv1)
+        yield from mypv.wait_for_connection()
+
+        stream = mypv.monitor(maxsize=2, policy='drop_oldest')
+        with stream:
+            first = yield from stream.get()
+            second = yield from stream.get()
+        self.assertIn('value', first)
+        self.assertGreaterEqual(second['timestamp'], first['timestamp'])
+        self.assertTrue(stream.closed)
+        self.assertEqual(stream.received,
+                         stream.dropped + 2 + len(stream))
+
     @async_test
     def test_get_callback(self):
         print("Callback test:  changing PV must be updated\n")
@@ -266,6 +282,48 @@ class PV_Tests(unittest.TestCase):
         # TODO other fix
         # info = yield from pv.get_info()
 
+    @async_test
+    def test_waveform_monitor_buffers(self):
+        pv = PV(pvnames.double_arr_pv, auto_monitor=True, monitor_buffers=3)
+        callback = mock.Mock()
+        pv.add_callback(callback)
+
+        value = np.arange(10, dtype=np.float64)
+        yield from pv.aput(value)
+        yield from asyncio.sleep(0.5)
+
+        self.assertTrue(callback.called)
+        kwargs = callback.call_args[1]
+        self.assertIn('seq', kwargs)
+        self.assertFalse(kwargs['value'].flags.writeable)
+        np.testing.assert_array_almost_equal(kwargs['value'][:10], value)
+
+        got = yield from pv.aget()
+        self.assertTrue(got.flags.writeable)
+        self.assertEqual(pv.monitor_overruns, 0)
+
+    @async_test
+    @no_simulator_updates
+    def test_coalesced_monitor(self):
+        pv = PV(pvnames.non_updating_pv, auto_monitor=True, coalesce=True)
+        yield from pv.wait_for_connection()
+        yield from asyncio.sleep(0.2)
+
+        callback = mock.Mock()
+        pv.add_callback(callback, with_ctrlvars=False)
+
+        # queue a burst of puts, then keep the event loop busy while the
+        # monitor updates arrive
+        for value in range(10):
+            coroutines._put_request(pv.chid, value, wait=False)
+        ca.flush_io()
+        time.sleep(0.5)
+        yield from asyncio.sleep(0.2)
+
+        self.assertEqual(callback.call_args[1]['value'], 9)
+        self.assertLess(callback.call_count, 10)
+        self.assertGreater(pv.monitor_dropped, 0)
+
 
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase( PV_Tests)
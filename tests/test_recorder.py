@@ -0,0 +1,99 @@
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+from pvasync import coroutines
+from pvasync.context import get_current_context
+from pvasync.recorder import (Recorder, Recording)
+from pvasync.server import ServedPV
+
+
+loop = asyncio.get_event_loop()
+SCALAR = 'RecorderTest:ao'
+WAVEFORM = 'RecorderTest:wave'
+STRING = 'RecorderTest:string'
+
+
+@pytest.fixture
+def served(ca_server):
+    for pv in (ServedPV(SCALAR, 0.0),
+               ServedPV(WAVEFORM, [0.0] * 8),
+               ServedPV(STRING, 'initial')):
+        if pv.name not in ca_server.pvs:
+            ca_server.add_pv(pv)
+    return ca_server
+
+
+def _put_many(puts):
+    @asyncio.coroutine
+    def put():
+        ctx = get_current_context()
+        for pvname, value in puts:
+            chid = ctx.pv_to_channel[pvname]
+            yield from coroutines.put(chid, value, timeout=2.0)
+        yield from asyncio.sleep(0.3)
+
+    loop.run_until_complete(put())
+
+
+def test_record_and_read(served, tmpdir):
+    directory = str(tmpdir.join('recording'))
+    pvnames = [SCALAR, WAVEFORM, STRING]
+    with Recorder(pvnames, directory, chunk_records=3,
+                  flush_interval=0.1) as recorder:
+        loop.run_until_complete(asyncio.sleep(0.5))
+        _put_many([(SCALAR, float(i)) for i in range(1, 6)] +
+                  [(WAVEFORM, [1.0, 2.0, 3.0]), (STRING, 'final')])
+        loop.run_until_complete(asyncio.sleep(0.3))
+
+    stats = recorder.stats()
+    assert stats['subscribed'] == 0
+    assert stats['written'] == stats['received'] > 0
+    assert stats['pending'] == stats['lost'] == 0
+
+    recording = Recording(directory)
+    assert sorted(recording.pvnames) == sorted(pvnames)
+
+    columns = recording.read(SCALAR)
+    assert list(columns['value'][-5:]) == [1.0, 2.0, 3.0, 4.0, 5.0]
+    stamps = columns['timestamp']
+    assert stamps.dtype == np.dtype('datetime64[ns]')
+    assert (np.diff(stamps.astype(np.int64)) >= 0).all()
+    # (chunks of 3 records)
+    assert len(os.listdir(os.path.join(directory, 'RecorderTest%3Aao'))) > 4
+
+    # binary search, across chunks
+    selected = recording.read(SCALAR, start=stamps[-4], stop=stamps[-1])
+    assert list(selected['value']) == [2.0, 3.0, 4.0]
+    assert len(recording.read(SCALAR, start=stamps[-1] + 1)['value']) == 0
+
+    columns = recording.read(WAVEFORM)
+    assert columns['value'].shape[1] == 8
+    assert list(columns['value'][-1]) == [1.0, 2.0, 3.0] + [0.0] * 5
+    assert columns['length'][-1] == 3
+
+    columns = recording.read(STRING)
+    assert list(columns['value'][-2:]) == [b'initial', b'final']
+
+
+def test_append_after_crash(served, tmpdir):
+    directory = str(tmpdir.join('recording'))
+    with Recorder([SCALAR], directory, flush_interval=0.1):
+        loop.run_until_complete(asyncio.sleep(0.3))
+    records = len(Recording(directory).read(SCALAR)['value'])
+    assert records >= 1
+
+    # a record only partly written is dropped, and recording resumes
+    with open(os.path.join(directory, 'RecorderTest%3Aao',
+                           '000000.timestamp'), 'ab') as f:
+        f.write(b'\0' * 3)
+    assert len(Recording(directory).read(SCALAR)['value']) == records
+
+    with Recorder([SCALAR], directory, flush_interval=0.1):
+        loop.run_until_complete(asyncio.sleep(0.3))
+        _put_many([(SCALAR, 42.0)])
+    columns = Recording(directory).read(SCALAR)
+    assert len(columns['value']) > records
+    assert columns['value'][-1] == 42.0
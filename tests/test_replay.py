@@ -0,0 +1,119 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from pvasync import coroutines
+from pvasync.context import (get_contexts, get_current_context)
+from pvasync.pv import PV
+from pvasync.recorder import (Recorder, Recording)
+from pvasync.server import ServedPV
+
+
+loop = asyncio.get_event_loop()
+SCALAR = 'ReplayTest:ao'
+WAVEFORM = 'ReplayTest:wave'
+
+
+@pytest.fixture(scope='module')
+def recording(ca_server, tmpdir_factory):
+    for pv in (ServedPV(SCALAR, 0.0),
+               ServedPV(WAVEFORM, [0.0] * 4)):
+        if pv.name not in ca_server.pvs:
+            ca_server.add_pv(pv)
+
+    @asyncio.coroutine
+    def put_many():
+        ctx = get_current_context()
+        for i in range(1, 6):
+            yield from coroutines.put(ctx.pv_to_channel[SCALAR], float(i),
+                                      timeout=2.0)
+            yield from coroutines.put(ctx.pv_to_channel[WAVEFORM],
+                                      [float(i)] * (2 + i % 3),
+                                      timeout=2.0)
+            yield from asyncio.sleep(0.05)
+        yield from asyncio.sleep(0.3)
+
+    directory = str(tmpdir_factory.mktemp('replay').join('recording'))
+    with Recorder([SCALAR, WAVEFORM], directory, flush_interval=0.1):
+        loop.run_until_complete(asyncio.sleep(0.5))
+        loop.run_until_complete(put_many())
+    return Recording(directory)
+
+
+@pytest.fixture
+def replay(recording):
+    ctx = get_contexts().start_replay(recording)
+    yield ctx
+    get_contexts().stop_replay()
+
+
+def _connected_pvs(*pvnames, **kwargs):
+    pvs = [PV(pvname, **kwargs) for pvname in pvnames]
+    for pv in pvs:
+        loop.run_until_complete(pv.wait_for_connection(timeout=1.0))
+    # (the current update, sent on subscribing)
+    loop.run_until_complete(asyncio.sleep(0.05))
+    return pvs
+
+
+def test_replay(recording, replay):
+    updates = []
+
+    def callback(pvname=None, value=None, timestamp_ns=None, severity=None,
+                 **kwargs):
+        updates.append((pvname, np.array(value).tolist(), timestamp_ns))
+
+    scalar, waveform = _connected_pvs(SCALAR, WAVEFORM, form='time')
+    ctrlvars = loop.run_until_complete(scalar.get_ctrlvars())
+    assert ctrlvars['severity'] == 0
+    assert scalar.write_access is False
+    scalar.add_callback(callback)
+    waveform.add_callback(callback)
+    del updates[:]
+
+    stats = loop.run_until_complete(replay.replay(batch_size=2))
+    scalars = recording.read(SCALAR)
+    waves = recording.read(WAVEFORM)
+    assert stats['updates'] == len(scalars['value']) + len(waves['value'])
+    assert stats['events'] >= stats['updates']
+    assert stats['batches'] == (stats['updates'] + 1) // 2
+    assert stats['updates_per_second'] > 0
+
+    # in order of their recorded timestamps, carrying them
+    assert len(updates) == stats['updates']
+    stamps = [stamp for pvname, value, stamp in updates]
+    assert stamps == sorted(stamps)
+    recorded = {SCALAR: scalars['timestamp'].astype(np.int64).tolist(),
+                WAVEFORM: waves['timestamp'].astype(np.int64).tolist()}
+    for pvname in (SCALAR, WAVEFORM):
+        assert [stamp for name, value, stamp in updates
+                if name == pvname] == recorded[pvname]
+
+    assert [value for name, value, stamp in updates
+            if name == SCALAR][-5:] == [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert [value for name, value, stamp in updates
+            if name == WAVEFORM][-1] == [5.0] * 4
+    assert loop.run_until_complete(scalar.aget()) == 5.0
+    assert scalar.timestamp_ns == recorded[SCALAR][-1]
+
+    # replaying again delivers the same updates
+    replayed = list(updates)
+    del updates[:]
+    loop.run_until_complete(replay.replay(batch_size=3))
+    assert updates == replayed
+
+
+def test_replay_paced(recording, replay):
+    scalar, = _connected_pvs(SCALAR)
+    stamps = recording.read(SCALAR)['timestamp'].astype(np.int64)
+    span = (stamps[-1] - stamps[0]) * 1e-9
+    stats = loop.run_until_complete(replay.replay(speed=2.0,
+                                                  pvnames=[SCALAR]))
+    assert stats['updates'] == len(stamps)
+    assert stats['seconds'] >= 0.9 * span / 2.0
+    assert 0.0 <= stats['mean_lateness'] <= stats['max_lateness']
+    assert loop.run_until_complete(scalar.aget()) == 5.0
+
+    with pytest.raises(ValueError):
+        loop.run_until_complete(replay.replay(speed=0))
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from pvasync import (PV, config, coroutines)
+from pvasync.context import get_current_context
+from pvasync.rtt import RoundTripStats
+
+from . import pvnames
+
+
+loop = asyncio.get_event_loop()
+
+
+def test_estimate():
+    stats = RoundTripStats()
+    assert stats.timeout('ioc:5064', default=1.5) == 1.5
+    assert stats.estimate('ioc:5064') is None
+
+    for i in range(50):
+        stats.record('ioc:5064', 1.4)
+    estimate = stats.estimate('ioc:5064')
+    assert estimate['srtt'] == pytest.approx(1.4)
+    assert estimate['samples'] == 50
+    # the variation decays with steady samples
+    assert 1.4 < stats.timeout('ioc:5064') < 1.5
+
+
+def test_minimum_and_backoff():
+    stats = RoundTripStats()
+    stats.record('ioc:5064', 0.001)
+    assert stats.timeout('ioc:5064') == config.MIN_REQUEST_TIMEOUT
+
+    for i in range(10):
+        stats.record_timeout('ioc:5064')
+    assert stats.timeout('ioc:5064') == 8 * config.MIN_REQUEST_TIMEOUT
+
+    # a completed request resets the backoff
+    stats.record('ioc:5064', 0.001)
+    assert stats.timeout('ioc:5064') == config.MIN_REQUEST_TIMEOUT
+    assert stats.estimate('ioc:5064')['timeouts'] == 10
+
+
+def test_bandwidth():
+    stats = RoundTripStats()
+    for i in range(10):
+        stats.record('ioc:5064', 1.5)
+    # 1 MB in 1 s beyond the round trip
+    stats.record('ioc:5064', 2.5, nbytes=1000000)
+    assert stats.estimate('ioc:5064')['bandwidth'] == pytest.approx(1e6)
+    assert stats.estimate('ioc:5064')['srtt'] == pytest.approx(1.5)
+    assert (stats.timeout('ioc:5064', nbytes=2000000) ==
+            pytest.approx(stats.timeout('ioc:5064') + 2.0))
+
+
+def test_large_without_bandwidth():
+    stats = RoundTripStats()
+    for i in range(10):
+        stats.record('ioc:5064', 0.001)
+    assert stats.timeout('ioc:5064') == config.MIN_REQUEST_TIMEOUT
+
+    # no bandwidth estimate yet: a large transfer keeps the default
+    default = 1.0 + 6.6
+    assert stats.timeout('ioc:5064', nbytes=32000000,
+                         default=default) == default
+    # (small ones need not)
+    assert (stats.timeout('ioc:5064', nbytes=8, default=default) ==
+            config.MIN_REQUEST_TIMEOUT)
+
+    stats.record('ioc:5064', 2.0, nbytes=32000000)
+    assert stats.estimate('ioc:5064')['bandwidth'] is not None
+    assert stats.timeout('ioc:5064', nbytes=32000000,
+                         default=default) < default
+
+
+def test_measured(ca_server):
+    @asyncio.coroutine
+    def check():
+        pv = PV(pvnames.double_pv)
+        yield from pv.wait_for_connection()
+        for i in range(5):
+            yield from coroutines.get(pv.chid)
+        return pv
+
+    pv = loop.run_until_complete(check())
+    estimate = get_current_context().round_trips.estimate(pv.host)
+    assert estimate['samples'] >= 5
+    assert estimate['timeout'] >= config.MIN_REQUEST_TIMEOUT
+
+
+def test_bulk_timeout():
+    class Context:
+        round_trips = RoundTripStats()
+
+    ctx = Context()
+    small = {'ioc:5064': [8] * 100}
+    assert coroutines._bulk_timeout(ctx, small) == pytest.approx(
+        3.0 + 800 / config.BULK_GET_BANDWIDTH)
+
+    # the slowest server's payloads, at its estimated bandwidth if any
+    large = {'ioc:5064': [8] * 5, 'big:5064': [4000000] * 5}
+    expected = 2.0 + 20000000 / config.BULK_GET_BANDWIDTH
+    assert coroutines._bulk_timeout(ctx, large) == pytest.approx(expected)
+
+    ctx.round_trips.record('big:5064', 0.001)
+    ctx.round_trips.record('big:5064', 0.101, 100000000)
+    assert ctx.round_trips.estimate('big:5064')['bandwidth'] == (
+        pytest.approx(1e9))
+    assert coroutines._bulk_timeout(ctx, large) == pytest.approx(2.02)
@@ -0,0 +1,98 @@
+import asyncio
+
+import numpy as np
+
+from pvasync import (ca_protocol as proto, cast)
+from pvasync.ca_protocol import Command
+from pvasync.dbr import (ChannelType, SubscriptionType)
+from pvasync.server import (CAServer, ServedPV, default_pvs)
+
+
+def test_default_pvs():
+    pvs = {pv.name: pv for pv in default_pvs()}
+    for name in ('Py:ao1', 'Py:mbbo1', 'Py:ao1.DESC', 'Py:char64k',
+                 'Py:string128', 'Py:types:enum_array'):
+        assert name in pvs
+
+    assert pvs['Py:mbbo1'].native_type == ChannelType.ENUM
+    assert pvs['Py:long2k'].count == 2048
+    assert pvs['Py:char256'].count == 256
+
+
+def test_read_as_types():
+    pv = ServedPV('enum', 1, enum_strs=['off', 'on'])
+    payload, count = pv.read(ChannelType.STRING, 0)
+    _, values = proto.decode_dbr(ChannelType.STRING, count, payload)
+    assert cast.unpack_values(values, count, ChannelType.STRING) == 'on'
+
+    payload, count = pv.read(ChannelType.CTRL_ENUM, 1)
+    header, values = proto.decode_dbr(ChannelType.CTRL_ENUM, count, payload)
+    assert header.to_dict()['enum_strs'] == ('off', 'on')
+    assert values.item(0) == 1
+
+    pv = ServedPV('ai', 1.5, units='mm', precision=2, upper_disp_limit=10.)
+    payload, count = pv.read(ChannelType.CTRL_DOUBLE, 1)
+    header, values = proto.decode_dbr(ChannelType.CTRL_DOUBLE, count, payload)
+    info = header.to_dict()
+    assert info['units'] == 'mm'
+    assert info['precision'] == 2
+    assert info['upper_disp_limit'] == 10.
+    assert values.item(0) == 1.5
+
+
+def test_write_and_step():
+    pv = ServedPV('enum', 0, enum_strs=['off', 'on'])
+    ftype, count, data = cast.put_info(ChannelType.STRING, 1, 'on')
+    pv.write(ftype, count, proto.encode_values(ftype, data))
+    assert pv.values[0] == 1
+    pv.step()
+    assert pv.values[0] == 0
+
+    pv = ServedPV('wave', np.arange(4), native_type=ChannelType.LONG)
+    pv.step()
+    assert list(pv.values) == [3, 0, 1, 2]
+
+
+def test_loopback():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = CAServer([ServedPV('test:ai', 2.0)], latency=0.01)
+
+    @asyncio.coroutine
+    def client():
+        yield from server.start()
+        reader, writer = yield from asyncio.open_connection(server.host,
+                                                            server.port)
+        writer.write(proto.version() + proto.create_chan('test:ai', 7))
+        mask = SubscriptionType.DBE_VALUE
+        writer.write(proto.event_add(ChannelType.DOUBLE, 1, 1, 3, mask))
+
+        replies = []
+        data = b''
+        while len(replies) < 4:
+            data += yield from reader.read(1024)
+            offset = 0
+            replies = []
+            while True:
+                message, offset = proto.unpack(data, offset)
+                if message is None:
+                    break
+                replies.append(message)
+        writer.close()
+        return replies
+
+    try:
+        version, access, created, event = loop.run_until_complete(client())
+    finally:
+        server.stop()
+        loop.close()
+
+    assert version.command == Command.VERSION
+    assert access.command == Command.ACCESS_RIGHTS
+    assert created.command == Command.CREATE_CHAN
+    assert created.param1 == 7
+    assert created.data_type == ChannelType.DOUBLE
+    assert event.command == Command.EVENT_ADD
+    assert event.param2 == 3
+    _, values = proto.decode_dbr(ChannelType.DOUBLE, 1, event.payload)
+    assert values.item(0) == 2.0
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from unittest import mock
+
+from pvasync.streams import MonitorStream
+
+
+def _stream(**kwargs):
+    # an unconnected PV: the stream subscribes once it connects
+    pv = mock.Mock(connected=False, monitor_mask=None, pvname='test',
+                   connection_callbacks=[])
+    return MonitorStream(pv, **kwargs)
+
+
+def _feed(stream, values):
+    for value in values:
+        stream._on_event(chid=1, handler_id=1, value=value)
+
+
+def _drain(stream):
+    events = []
+    while True:
+        event = stream.get_nowait()
+        if event is None:
+            return events
+        events.append(event['value'])
+
+
+def test_drop_oldest():
+    stream = _stream(maxsize=3, policy='drop_oldest')
+    _feed(stream, range(5))
+    assert stream.received == 5
+    assert stream.dropped == 2
+    assert _drain(stream) == [2, 3, 4]
+
+
+def test_latest():
+    stream = _stream(maxsize=10, policy='latest')
+    assert stream.maxsize == 1
+    _feed(stream, range(5))
+    assert stream.dropped == 4
+    assert _drain(stream) == [4]
+
+
+def test_drop_newest():
+    stream = _stream(maxsize=3, policy='drop_newest')
+    _feed(stream, range(5))
+    assert stream.received == 5
+    assert stream.dropped == 2
+    assert _drain(stream) == [0, 1, 2]
+
+
+def test_bad_policy():
+    with pytest.raises(ValueError):
+        _stream(policy='newest')
+
+
+@pytest.fixture
+def loop():
+    # (of its own: other test modules close theirs)
+    previous = asyncio.get_event_loop()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(previous)
+
+
+def test_get_waits(loop):
+    stream = _stream(maxsize=2)
+    stream._cbid = 1
+
+    @asyncio.coroutine
+    def consume():
+        events = []
+        while True:
+            try:
+                event = yield from stream.get()
+            except StopAsyncIteration:
+                return events
+            events.append(event['value'])
+
+    loop.call_soon(_feed, stream, [0])
+    loop.call_later(0.01, _feed, stream, [1])
+    loop.call_later(0.02, stream.close)
+    assert loop.run_until_complete(consume()) == [0, 1]
+    stream.pv._context.unsubscribe.assert_called_once_with(1)
+
+
+def test_concurrent_get(loop):
+    stream = _stream(maxsize=4)
+    stream._cbid = 1
+
+    @asyncio.coroutine
+    def consume():
+        try:
+            event = yield from stream.get()
+        except StopAsyncIteration:
+            return None
+        return event['value']
+
+    consumers = [asyncio.ensure_future(consume()) for i in range(3)]
+    loop.call_later(0.01, _feed, stream, [0, 1])
+    loop.call_later(0.02, stream.close)
+    results = loop.run_until_complete(asyncio.gather(*consumers))
+    assert sorted(results, key=str) == [0, 1, None]
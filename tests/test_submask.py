@@ -78,3 +78,85 @@ def test_mask(ntype, mask1, mask2):
     #         [native_m1, native_m2, promoted_m1, promoted_m2])
     # TODO ordering here really isn't well defined, probably should remove
     #      __lt__ on MonitorCallback
+
+
+def test_native_from_time():
+    mreg = MockRegistry()
+    ntype = dbr.ChannelType.DOUBLE
+    ttype = dbr.promote_type(ntype, use_time=True)
+    tcb = MonitorCallback(mreg, chid=0, ftype=ttype)
+
+    event = dict(value=1.5, ftype=ttype, count=1, status=1, severity=2,
+                 timestamp=1.0)
+    assert tcb.derive(tcb.request(), event) is event
+
+    ncb = MonitorCallback(mreg, chid=0, ftype=ntype)
+    derived = tcb.derive(ncb.request(), event)
+    assert derived == dict(value=1.5, ftype=ntype, count=1,
+                           status=dbr.ECA.NORMAL)
+
+
+def test_union():
+    mreg = MockRegistry()
+    ntype = dbr.ChannelType.DOUBLE
+    ttype = dbr.promote_type(ntype, use_time=True)
+    ctype = dbr.promote_type(ntype, use_ctrl=True)
+
+    alarm_cb = MonitorCallback(mreg, chid=0, ftype=ctype, mask=val | alarm)
+    prop_cb = MonitorCallback(mreg, chid=0, ftype=ntype, mask=val | prop)
+    assert alarm_cb.union(prop_cb) == prop_cb.union(alarm_cb)
+    merged = MonitorCallback(mreg, chid=0, **alarm_cb.union(prop_cb))
+    assert (merged.mask, merged.ftype) == (val | alarm | prop, ctype)
+    check_order(lesser=alarm_cb, greater=merged)
+    check_order(lesser=prop_cb, greater=merged)
+
+    # no union of the TIME and CTRL types, or of different delivery
+    time_cb = MonitorCallback(mreg, chid=0, ftype=ttype, mask=val)
+    assert alarm_cb.union(time_cb) is None
+    coalesced = MonitorCallback(mreg, chid=0, ftype=ttype, mask=val,
+                                coalesce=True)
+    assert alarm_cb.union(coalesced) is None
+
+
+def test_union_told_apart():
+    mreg = MockRegistry()
+    ntype = dbr.ChannelType.DOUBLE
+    ttype = dbr.promote_type(ntype, use_time=True)
+    ctype = dbr.promote_type(ntype, use_ctrl=True)
+
+    def union(ftype, mask1, mask2, **kwargs):
+        m1 = MonitorCallback(mreg, chid=0, ftype=ftype, mask=mask1, **kwargs)
+        m2 = MonitorCallback(mreg, chid=0, ftype=ftype, mask=mask2, **kwargs)
+        return m1.union(m2)
+
+    assert union(ctype, val, val | prop | alarm) is not None
+    assert union(ttype, val | log, val | log | alarm) is not None
+    # property changes do not show in TIME updates, nor alarms in native ones
+    assert union(ttype, val, val | prop) is None
+    assert union(ntype, val, val | alarm) is None
+    # value and log updates cannot be told apart
+    assert union(ctype, val, prop) is None
+    assert union(ttype, val | alarm, log | alarm) is None
+    # nor can a previous update be compared with, in a ring of buffers
+    assert union(ctype, val, val | prop, nbuffers=2) is None
+
+
+def test_filter_by_mask():
+    mreg = MockRegistry()
+    ctype = dbr.promote_type(dbr.ChannelType.DOUBLE, use_ctrl=True)
+    merged = MonitorCallback(mreg, chid=0, ftype=ctype, mask=val | prop)
+    value_req = MonitorCallback(mreg, chid=0, ftype=ctype, mask=val).request()
+
+    def update(**kwargs):
+        merged._changes = merged._event_changes(kwargs)
+        return merged.derive(value_req, kwargs) is not None
+
+    # the first update goes to both
+    assert update(value=1.0, units='mm')
+    # no property changed: posted for the value
+    assert update(value=2.0, units='mm')
+    assert update(value=2.0, units='mm')
+    # only a property changed: not for the value's callback
+    assert not update(value=2.0, units='um')
+    # both changed
+    assert update(value=3.0, units='nm')
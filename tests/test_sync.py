@@ -1,8 +1,8 @@
 import pytest
 import logging
 import functools
-from pvasync.sync import (caget, caput, blocking_mode,
-                          _cleanup)
+from pvasync.sync import (caget, caput, caget_many, caput_many,
+                          blocking_mode, _cleanup)
 
 from . import pvnames
 
@@ -47,3 +47,19 @@ def test_caget():
 def test_caput():
     caput(pvnames.enum_pv, 'Stop')
     assert caget(pvnames.enum_pv) == 0
+
+
+def test_caget_many():
+    pvs = (pvnames.double_pv, pvnames.enum_pv, pvnames.str_pv)
+    values = caget_many(pvs)
+    assert len(values) == len(pvs)
+    assert not any(isinstance(value, Exception) for value in values)
+
+
+@no_simulator_updates
+def test_caput_many():
+    status = caput_many({pvnames.non_updating_pv: 4,
+                         pvnames.enum_pv: 'Stop'})
+    assert all(value is True for value in status.values())
+    assert caget(pvnames.non_updating_pv) == 4
+    assert caget(pvnames.enum_pv) == 0